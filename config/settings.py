@@ -33,6 +33,7 @@ INSTALLED_APPS = [
     "django.contrib.contenttypes",
     "django.contrib.sessions",
     "django.contrib.messages",
+    "django.contrib.sites",
     "django.contrib.staticfiles",
     "social_django",
     "tahoe_idp",
@@ -154,3 +155,15 @@ MAGICLINK_LOGIN_REQUEST_TIME_LIMIT = 30
 MAGICLINK_LOGIN_VERIFY_URL = 'tahoe_idp:verify_login'
 MAGICLINK_STUDIO_DOMAIN = 'studio.example.com'
 MAGICLINK_STUDIO_PERMISSION_METHOD = None
+MAGICLINK_STORAGE_BACKEND = 'tahoe_idp.magiclink_storage:DatabaseMagicLinkStorage'
+MAGICLINK_STORAGE_CACHE = 'default'
+MAGICLINK_STUDIO_SESSION_COOKIE_DOMAIN = None
+MAGICLINK_STUDIO_SESSION_COOKIE_NAME = 'tahoe_idp_studio_session'
+MAGICLINK_STUDIO_SESSION_COOKIE_AGE = 3600
+MAGICLINK_GET_USER_CACHE_TIMEOUT = 0
+MAGICLINK_VERIFY_FAILURE_LIMIT = 0
+MAGICLINK_VERIFY_FAILURE_WINDOW = 300
+MAGICLINK_VERIFY_CLIENT_IP_HEADER = 'REMOTE_ADDR'
+MAGICLINK_VERIFY_TRUSTED_PROXY_COUNT = 0
+MAGICLINK_REJECTED_TOKEN_CACHE_TIMEOUT = 60
+MAGICLINK_STUDIO_PERMISSION_CACHE_TIMEOUT = 0
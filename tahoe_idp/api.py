@@ -10,19 +10,25 @@ External Python API helpers goes here.
    - No parameters should be removed from the function
    - New parameters should have safe defaults
  * For breaking changes, new functions should be created
+
+`requests` and `social_django` are imported on first use to keep importing this module light.
 """
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import contextlib
 from datetime import datetime
 import logging
 import pytz
-from requests import exceptions as requests_exceptions
-from social_django.models import UserSocialAuth
+import time
+from django.core.cache import cache
 
 from urllib.parse import urlencode
 
-from .constants import BACKEND_NAME
-from . import helpers
+from .constants import BACKEND_NAME, IDP_USER_EXPORT_FIELDS
+from . import helpers, idp_sync_outbox, tracing
+from .concurrency_limiting import get_concurrency_limiter
+from .rate_limiting import TokenBucket, batch_traffic
 
 
 log = logging.getLogger(__name__)
@@ -31,6 +37,7 @@ log = logging.getLogger(__name__)
 @contextlib.contextmanager
 def with_user_api_allowed_error_conditions(user):
     """API function context manager to handle allowable error conditions."""
+    from requests import exceptions as requests_exceptions
 
     try:
         yield
@@ -43,16 +50,66 @@ def with_user_api_allowed_error_conditions(user):
             raise
 
 
-def request_password_reset(email):
+def request_password_reset(email, site_configuration=None):
     """
     Start password reset email for Username|Password Database Connection users.
+
+    :param site_configuration: The `SiteConfiguration` of the user's site, required outside of its requests.
     """
-    api_client = helpers.get_api_client()
+    api_client = helpers.get_api_client(site_configuration=site_configuration)
     client_response = api_client.forgot_password({'loginId': email})
     http_response = helpers.get_successful_fusion_auth_http_response(client_response)
     return http_response
 
 
+def request_password_resets(emails, rate=10, burst=1, on_result=None, site_configuration=None):
+    """
+    Start password reset emails for many users, paced to `rate` requests per second.
+
+    Emails are deduplicated case-insensitively. Failed requests are reported instead of raised.
+
+    :param emails: iterable of emails.
+    :param rate: Maximum number of requests per second.
+    :param burst: Maximum number of requests sent back to back after an idle period.
+    :param on_result: optional callable `on_result(email, succeeded)` called after each request e.g. to checkpoint.
+    :param site_configuration: The `SiteConfiguration` of the users' site, required outside of its requests.
+    :return: dict with the `sent` and `failed` lists of emails, and the `elapsed_seconds`.
+    """
+    from requests import exceptions as requests_exceptions
+
+    bucket = TokenBucket(rate=rate, capacity=burst)
+    seen_emails = set()
+    result = {
+        'sent': [],
+        'failed': [],
+    }
+    started_at = time.monotonic()
+
+    for email in emails:
+        email = email.strip()
+        if not email or email.lower() in seen_emails:
+            continue
+        seen_emails.add(email.lower())
+
+        bucket.acquire()
+        try:
+            with batch_traffic():
+                request_password_reset(email, site_configuration=site_configuration)
+        except requests_exceptions.RequestException as exc:
+            log.warning('Could not request a password reset for {email}: {error}'.format(email=email, error=exc))
+            result['failed'].append(email)
+            succeeded = False
+        else:
+            result['sent'].append(email)
+            succeeded = True
+
+        if on_result:
+            on_result(email, succeeded)
+
+    result['elapsed_seconds'] = time.monotonic() - started_at
+    return result
+
+
 def get_logout_url(post_logout_redirect_uri):
     """
     Get Tahoe IdP URL.
@@ -79,6 +136,8 @@ def get_tahoe_idp_id_by_user(user):
 
     This helper uses the `social_django` app.
     """
+    from social_django.models import UserSocialAuth
+
     if not user:
         raise ValueError('User should be provided')
 
@@ -98,13 +157,41 @@ def get_tahoe_idp_id_by_user(user):
         return None
 
 
-def update_user(user, properties):
+def get_idp_permission_flags(user):
+    """
+    Get the IdP permission flags of a Django user without calling the IdP.
+
+    The flags are stored on the `UserSocialAuth` entry at login and cached, so this is at most one cache lookup
+    and one database query.
+
+    :return: dict with `is_organization_admin`, `is_organization_staff`, `is_course_author`, `capabilities` and
+             `data_version` (the IdP `lastUpdateInstant` of the user at login), or None if the user has no
+             flags stored.
+    """
+    from social_django.models import UserSocialAuth
+
+    if not user or user.is_anonymous:
+        return None
+
+    flags = cache.get(helpers.get_idp_permission_flags_cache_key(user.id))
+    if flags is None:
+        extra_data = UserSocialAuth.objects.filter(
+            user_id=user.id, provider=BACKEND_NAME,
+        ).values_list('extra_data', flat=True).first()
+        flags = helpers.cache_idp_permission_flags(user.id, extra_data)
+
+    return flags or None
+
+
+def update_user(user, properties, site_configuration=None):
     """
     Update user properties via PATCH /api/user/{userId}.
 
     See: https://fusionauth.io/docs/v1/tech/apis/users#update-a-user
+
+    :param site_configuration: The site configuration of the user's tenant, defaults to the current one.
     """
-    api_client = helpers.get_api_client()
+    api_client = helpers.get_api_client(site_configuration=site_configuration)
     idp_user_id = get_tahoe_idp_id_by_user(user)
     if idp_user_id is None:
         return
@@ -115,6 +202,7 @@ def update_user(user, properties):
             request=properties,
         )
         http_response = helpers.get_successful_fusion_auth_http_response(client_response)
+        helpers.invalidate_cached_idp_user(idp_user_id)
         return http_response
 
 
@@ -131,12 +219,18 @@ def update_user_email(user, email, set_email_as_verified=False):
     if set_email_as_verified:
         properties['skipVerification'] = True
 
+    if idp_sync_outbox.is_outbox_enabled():
+        idp_sync_outbox.enqueue_user_update(user, properties)
+        return None
+
     return update_user(user, properties=properties)
 
 
 def update_tahoe_user_id(user, now=None):
     """
     Store the Tahoe `User.id` in FusionAuth via PATCH /api/user/.
+
+    With `TAHOE_IDP_BUFFER_LAST_LOGIN` the update is buffered and sent by the `drain_idp_sync_outbox` command.
     """
     if not now:
         now = datetime.now(pytz.utc)
@@ -152,7 +246,13 @@ def update_tahoe_user_id(user, now=None):
         },
     }
 
-    return update_user(user, properties=properties)
+    if idp_sync_outbox.is_last_login_buffer_enabled():
+        # Sent in batches by the `drain_idp_sync_outbox` command
+        idp_sync_outbox.enqueue_last_login(user, properties)
+        return None
+
+    with tracing.start_span('tahoe_idp.api.update_tahoe_user_id'):
+        return update_user(user, properties=properties)
 
 
 def deactivate_user(idp_user_id):
@@ -168,4 +268,135 @@ def deactivate_user(idp_user_id):
         user_id=idp_user_id,
     )
     http_response = helpers.get_successful_fusion_auth_http_response(client_response)
+    helpers.invalidate_cached_idp_user(idp_user_id)
     return http_response
+
+
+def iter_idp_users(query='*', page_size=500, fields=IDP_USER_EXPORT_FIELDS):
+    """
+    Lazily iterate over the IdP users of the tenant matching an Elasticsearch query string.
+
+    Pages are fetched via POST /api/user/search and the next page is prefetched in a background thread while
+    the caller processes the current one. Only one page is held in memory at a time.
+
+    Pages are selected with a range on (`insertInstant`, `id`) after the last user seen instead of `startRow`,
+    because Elasticsearch rejects offsets past its 10,000 results window.
+
+    See: https://fusionauth.io/docs/v1/tech/apis/users#search-for-users
+
+    :param query: Elasticsearch query string e.g. `data.platform_role:staff`.
+    :param page_size: Number of users fetched per request.
+    :param fields: The user fields to include in the yielded records.
+    :return: generator of dicts with the requested `fields` of each user.
+    """
+    with batch_traffic():
+        api_client = helpers.get_api_client()
+
+    def fetch_page(last_idp_user):
+        page_query = query
+        if last_idp_user:
+            page_query = '({query}) AND ({after_last_user})'.format(
+                query=query,
+                after_last_user=_get_idp_users_after_query(last_idp_user),
+            )
+        client_response = api_client.search_users_by_query({
+            'search': {
+                'queryString': page_query,
+                'numberOfResults': page_size,
+                'startRow': 0,
+                # The order of the range above, so users don't move across pages while iterating
+                'sortFields': [{'name': 'insertInstant'}, {'name': 'id'}],
+            },
+        })
+        http_response = helpers.get_successful_fusion_auth_http_response(client_response)
+        return http_response.json()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_page = executor.submit(fetch_page, None)
+        while next_page:
+            page = next_page.result()
+            idp_users = page.get('users') or []
+
+            next_page = None
+            if len(idp_users) >= page_size:
+                next_page = executor.submit(fetch_page, idp_users[-1])
+
+            for idp_user in idp_users:
+                yield {field: idp_user.get(field) for field in fields}
+
+
+def _get_idp_users_after_query(idp_user):
+    """
+    Get the Elasticsearch query string of the users sorted after `idp_user` by (`insertInstant`, `id`).
+    """
+    return 'insertInstant:{{{insert_instant} TO *}} OR (insertInstant:{insert_instant} AND id:{{"{id}" TO *}})'.format(
+        insert_instant=idp_user['insertInstant'],
+        id=idp_user['id'],
+    )
+
+
+def deactivate_users(idp_user_ids, chunk_size=100, max_workers=None):
+    """
+    Soft delete many IdP user accounts.
+
+    Users are deactivated in chunks via DELETE /api/user/bulk. If the bulk endpoint isn't available or a chunk
+    fails, the users of the chunk are deactivated one by one via `DELETE /api/user/{userId}` using a pool of
+    at most `max_workers` threads, so a single bad id doesn't fail the whole chunk.
+
+    See: https://fusionauth.io/docs/v1/tech/apis/users#bulk-delete-users
+
+    :param idp_user_ids: iterable of IdP user ids.
+    :param chunk_size: Number of users per bulk request.
+    :param max_workers: Maximum number of concurrent requests in the fallback. Defaults to the `max_limit` of the
+                        adaptive concurrency limiter if enabled, which then sets the actual concurrency, or 8.
+    :return: dict with the `succeeded` and `failed` lists of ids in the input order.
+    """
+    from requests import exceptions as requests_exceptions
+
+    with batch_traffic():
+        api_client = helpers.get_api_client()
+    if max_workers is None:
+        concurrency_limiter = get_concurrency_limiter()
+        max_workers = concurrency_limiter.max_limit if concurrency_limiter else 8
+    idp_user_ids = list(OrderedDict.fromkeys(idp_user_ids))
+    deactivated_ids = set()
+    is_bulk_available = True
+
+    def deactivate_one(idp_user_id):
+        try:
+            client_response = api_client.deactivate_user(user_id=idp_user_id)
+            helpers.get_successful_fusion_auth_http_response(client_response)
+        except requests_exceptions.RequestException as exc:
+            log.warning('Could not deactivate IdP user {idp_user_id}: {error}'.format(
+                idp_user_id=idp_user_id, error=exc,
+            ))
+            return None
+        return idp_user_id
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, len(idp_user_ids), chunk_size):
+            chunk = idp_user_ids[start:start + chunk_size]
+
+            if is_bulk_available:
+                try:
+                    client_response = api_client.deactivate_users_by_ids(chunk)
+                except requests_exceptions.RequestException as exc:
+                    log.warning('Bulk deactivation of IdP users failed: {error}'.format(error=exc))
+                else:
+                    if client_response.was_successful():
+                        # Ids that don't exist are omitted from the `userIds` of the response
+                        bulk_response = client_response.success_response or {}
+                        deactivated_ids.update(bulk_response.get('userIds', chunk))
+                        continue
+
+                    if client_response.status == 404:
+                        log.info('IdP bulk deactivation endpoint is unavailable, deactivating users one by one')
+                        is_bulk_available = False
+
+            deactivated_ids.update(idp_user_id for idp_user_id in executor.map(deactivate_one, chunk) if idp_user_id)
+
+    helpers.invalidate_cached_idp_users(deactivated_ids)
+    return {
+        'succeeded': [idp_user_id for idp_user_id in idp_user_ids if idp_user_id in deactivated_ids],
+        'failed': [idp_user_id for idp_user_id in idp_user_ids if idp_user_id not in deactivated_ids],
+    }
@@ -0,0 +1,62 @@
+"""
+FusionAuth API client wrapper.
+
+All the FusionAuth calls of the package go through `TahoeIdpApiClient`, which emits a tracing span per call and
+applies the cluster-wide rate limit of the traffic class of the client. Batch calls are also subject to the adaptive
+concurrency limit of the process.
+"""
+
+from functools import wraps
+import logging
+
+from fusionauth.fusionauth_client import FusionAuthClient
+
+from tahoe_idp import concurrency_limiting, rate_limiting, tracing
+
+
+log = logging.getLogger(__name__)
+
+
+class TahoeIdpApiClient:
+    """
+    Proxy to a `FusionAuthClient` of a tenant. API methods are wrapped with tracing spans and rate limited.
+
+    Clients created in a `rate_limiting.batch_traffic()` block use the batch budget, the others the interactive one.
+    """
+
+    def __init__(self, api_key, base_url, tenant_id):
+        self.client = FusionAuthClient(api_key=api_key, base_url=base_url)
+        self.client.set_tenant_id(tenant_id)
+        self.tenant_id = tenant_id
+        self.traffic = rate_limiting.get_traffic()
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def traced_call(*args, **kwargs):
+            with tracing.start_span('tahoe_idp.fusionauth.{}'.format(name), {
+                'tahoe_idp.tenant_id': self.tenant_id,
+                'tahoe_idp.traffic': self.traffic,
+            }) as span:
+                rate_limiter = rate_limiting.get_api_rate_limiter(self.traffic)
+                if rate_limiter and not rate_limiter.acquire():
+                    # Only interactive calls have a max wait, they go ahead instead of failing e.g. the login
+                    log.warning('Calling FusionAuth {name} over the {traffic} rate limit'.format(
+                        name=name, traffic=self.traffic,
+                    ))
+                    span.set_attribute('tahoe_idp.rate_limited', True)
+
+                concurrency_limiter = None
+                if self.traffic == rate_limiting.TRAFFIC_BATCH:
+                    concurrency_limiter = concurrency_limiting.get_concurrency_limiter()
+                if concurrency_limiter:
+                    client_response = concurrency_limiter.call(attr, *args, **kwargs)
+                else:
+                    client_response = attr(*args, **kwargs)
+                span.set_attribute('http.status_code', client_response.status)
+                return client_response
+
+        return traced_call
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class TahoeIdpConfig(AppConfig):
@@ -43,6 +44,20 @@ class TahoeIdpConfig(AppConfig):
                         'signal_path': 'django.db.models.signals.post_save',
                         'sender_path': 'student.models.UserProfile',
                     },
+                    {
+                        'receiver_func_name': 'invalidate_magiclink_user_cache',
+                        'signal_path': 'django.db.models.signals.post_save',
+                        'sender_path': 'django.contrib.auth.models.User',
+                    },
+                    {
+                        'receiver_func_name': 'invalidate_magiclink_user_cache',
+                        'signal_path': 'django.db.models.signals.post_delete',
+                        'sender_path': 'django.contrib.auth.models.User',
+                    },
+                    {
+                        'receiver_func_name': 'invalidate_studio_session_marker',
+                        'signal_path': 'django.contrib.auth.signals.user_logged_out',
+                    },
                 ],
             },
             'cms.djangoapp': {
@@ -58,8 +73,36 @@ class TahoeIdpConfig(AppConfig):
                         'signal_path': 'django.db.models.signals.post_save',
                         'sender_path': 'student.models.UserProfile',
                     },
+                    {
+                        'receiver_func_name': 'invalidate_magiclink_user_cache',
+                        'signal_path': 'django.db.models.signals.post_save',
+                        'sender_path': 'django.contrib.auth.models.User',
+                    },
+                    {
+                        'receiver_func_name': 'invalidate_magiclink_user_cache',
+                        'signal_path': 'django.db.models.signals.post_delete',
+                        'sender_path': 'django.contrib.auth.models.User',
+                    },
+                    {
+                        'receiver_func_name': 'invalidate_studio_session_marker',
+                        'signal_path': 'django.contrib.auth.signals.user_logged_out',
+                    },
                 ],
             },
 
         },
     }
+
+    def ready(self):
+        """
+        Resolve MAGICLINK_STUDIO_PERMISSION_METHOD at startup to fail loudly on misconfiguration.
+
+        When TAHOE_IDP_WARM_UP_ON_STARTUP is enabled, all the settings are validated and the login code paths
+        are warmed up, see `tahoe_idp.warm_up`.
+        """
+        if getattr(settings, 'TAHOE_IDP_WARM_UP_ON_STARTUP', False):
+            from .warm_up import warm_up  # Models need to be loaded first
+            warm_up()
+        elif getattr(settings, 'MAGICLINK_STUDIO_PERMISSION_METHOD', None):
+            from .magiclink_helpers import get_studio_permission_method  # Models need to be loaded first
+            get_studio_permission_method()
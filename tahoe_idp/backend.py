@@ -9,13 +9,12 @@ from django.conf import settings
 from social_core.backends.oauth import BaseOAuth2
 
 from .constants import BACKEND_NAME
-from . import helpers
+from . import helpers, tracing
 
 from .permissions import (
+    get_capabilities,
+    get_capability_flags,
     get_role_with_default,
-    is_course_author,
-    is_organization_admin,
-    is_organization_staff,
 )
 
 
@@ -51,12 +50,14 @@ class TahoeIdpOAuth2(BaseOAuth2):
         allow FusionAuth to automatically redirect to the provider's login page instead of
         showing FusionAuth form with (Login to SAML) button
         """
-        params = super().auth_params(state=state)
-        params["tenantId"] = helpers.get_tenant_id()
-        default_idp_hint = helpers.get_default_idp_hint()
-        if default_idp_hint:
-            params["idp_hint"] = default_idp_hint
-        return params
+        with tracing.start_span("tahoe_idp.backend.auth_params") as span:
+            params = super().auth_params(state=state)
+            params["tenantId"] = helpers.get_tenant_id()
+            span.set_attribute("tahoe_idp.tenant_id", params["tenantId"])
+            default_idp_hint = helpers.get_default_idp_hint()
+            if default_idp_hint:
+                params["idp_hint"] = default_idp_hint
+            return params
 
     def auth_extra_arguments(self):
         """
@@ -96,6 +97,17 @@ class TahoeIdpOAuth2(BaseOAuth2):
     def revoke_token_url(self, token, uid):
         return "{}/oauth2/logout".format(helpers.get_idp_base_url())
 
+    def auth_complete(self, *args, **kwargs):
+        with tracing.start_span("tahoe_idp.backend.auth_complete"):
+            return super().auth_complete(*args, **kwargs)
+
+    def request_access_token(self, *args, **kwargs):
+        """
+        Exchange the authorization code for an access token.
+        """
+        with tracing.start_span("tahoe_idp.backend.request_access_token"):
+            return super().request_access_token(*args, **kwargs)
+
     def get_user_id(self, details, response):
         """
         Return current permanent user id.
@@ -104,30 +116,70 @@ class TahoeIdpOAuth2(BaseOAuth2):
         """
         return details["tahoe_idp_uuid"]
 
+    def _poll_idp_user(self, tahoe_idp_uuid):
+        """
+        Retrieve the IdP user until it has a username.
+
+        Deal with race conditions in setting of FusionAuth user username
+        when not set explicitly by user through a Form.
+        see https://appsembler.atlassian.net/browse/ENG-80
+
+        :return: (idp_user, number of retries)
+        """
+        api_retries = 0
+        max_retries = settings.FEATURES.get('TAHOE_MAX_IDP_USER_API_RETRIES', 5)
+        while True:
+            idp_user = helpers.fusionauth_retrieve_user(tahoe_idp_uuid, use_cache=False)
+            time.sleep(1)
+            if idp_user.get("username") is not None or api_retries >= max_retries:
+                return idp_user, api_retries
+            api_retries += 1
+
+    def _wait_for_idp_user(self, tahoe_idp_uuid):
+        """
+        Retrieve the IdP user, and wait for a `user.create`/`user.update` webhook event if it has no username yet.
+
+        The IdP is called at most twice: once at first and once more if no event arrives before the deadline.
+
+        :return: (idp_user, number of retries)
+        """
+        idp_user = helpers.fusionauth_retrieve_user(tahoe_idp_uuid, use_cache=False)
+        if idp_user.get("username") is not None:
+            return idp_user, 0
+
+        webhook_idp_user = helpers.wait_for_idp_user_ready(
+            tahoe_idp_uuid,
+            timeout=settings.FEATURES.get('TAHOE_IDP_USER_WEBHOOK_TIMEOUT', 5),
+        )
+        if webhook_idp_user is not None:
+            return webhook_idp_user, 0
+
+        return helpers.fusionauth_retrieve_user(tahoe_idp_uuid, use_cache=False), 1
+
     def get_user_details(self, response):
         """
         Fetches the user details from response's JWT and build the social_core JSON object.
         """
         tahoe_idp_uuid = response["userId"]
-        username = None
 
-        # Deal with race conditions in setting of FusionAuth user username
-        # when not set explicitly by user through a Form.
-        # see https://appsembler.atlassian.net/browse/ENG-80
-        api_retries = 0
-        max_retries = settings.FEATURES.get('TAHOE_MAX_IDP_USER_API_RETRIES', 5)
-        while username is None:
-            if api_retries <= max_retries:
-                idp_user = helpers.fusionauth_retrieve_user(tahoe_idp_uuid)
-                username = idp_user.get("username")
-                time.sleep(1)
-                api_retries += 1
+        with tracing.start_span("tahoe_idp.backend.get_user_details") as span:
+            if settings.FEATURES.get('TAHOE_IDP_WAIT_FOR_USER_WEBHOOK', False):
+                idp_user, api_retries = self._wait_for_idp_user(tahoe_idp_uuid)
             else:
+                idp_user, api_retries = self._poll_idp_user(tahoe_idp_uuid)
+
+            username = idp_user.get("username")
+            if username is None:
                 username = idp_user["id"]
                 logger.warning("tahoe-idp found no username from IdP.  Set to %s", username)
 
+            span.set_attribute("tahoe_idp.retry_count", api_retries)
+            if idp_user.get("tenantId"):
+                span.set_attribute("tahoe_idp.tenant_id", idp_user["tenantId"])
+
         user_data = idp_user.get("data", {})
-        user_data_role = get_role_with_default(user_data)
+        capabilities = get_capabilities(get_role_with_default(user_data))
+        capability_flags = get_capability_flags(capabilities)
 
         return {
             "username": username,
@@ -135,7 +187,23 @@ class TahoeIdpOAuth2(BaseOAuth2):
             "fullname": idp_user.get("fullName", username),
             "tahoe_idp_uuid": idp_user["id"],
             "tahoe_idp_metadata": idp_user.get("data", {}),
-            "tahoe_idp_is_course_author": is_course_author(user_data_role),
-            "tahoe_idp_is_organization_admin": is_organization_admin(user_data_role),
-            "tahoe_idp_is_organization_staff": is_organization_staff(user_data_role),
+            "tahoe_idp_is_course_author": capability_flags["is_course_author"],
+            "tahoe_idp_is_organization_admin": capability_flags["is_organization_admin"],
+            "tahoe_idp_is_organization_staff": capability_flags["is_organization_staff"],
+            "tahoe_idp_capabilities": capabilities,
+            "tahoe_idp_data_version": idp_user.get("lastUpdateInstant"),
         }
+
+    def extra_data(self, user, uid, response, details=None, *args, **kwargs):
+        """
+        Persist the IdP capabilities and data version in `UserSocialAuth.extra_data`.
+
+        This allows permission checks in LMS/Studio without calling the IdP, see `api.get_idp_permission_flags`.
+        """
+        data = super().extra_data(user, uid, response, details, *args, **kwargs)
+        details = details or {}
+        if "tahoe_idp_capabilities" in details:
+            data["tahoe_idp_capabilities"] = details["tahoe_idp_capabilities"]
+            data["tahoe_idp_data_version"] = details.get("tahoe_idp_data_version")
+            helpers.cache_idp_permission_flags(user.id, data)
+        return data
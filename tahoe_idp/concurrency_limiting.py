@@ -0,0 +1,101 @@
+"""
+Adaptive concurrency limiting of the batch calls to the IdP.
+
+The limit of concurrent calls follows AIMD (additive increase, multiplicative decrease) like TCP congestion control:
+it grows by one call per `limit` fast successful calls, and is multiplied by `backoff_ratio` when a call is slow,
+fails, or is answered with 429 or 5xx. Throughput then tracks the capacity of FusionAuth instead of a fixed pool size.
+
+The limiter is shared by all the batch traffic of the process, see `settings.TAHOE_IDP_ADAPTIVE_CONCURRENCY`.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+
+from tahoe_idp.settings_cache import cached_until_setting_changed
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Thread-safe AIMD limiter of concurrent calls.
+    """
+
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=32, latency_target=1.0, backoff_ratio=0.5,
+                 clock=time.monotonic):
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError('The limits must be 1 <= min_limit <= initial_limit <= max_limit')
+        if latency_target <= 0:
+            raise ValueError('The latency target must be a positive number')
+        if not 0 < backoff_ratio < 1:
+            raise ValueError('The backoff ratio must be between 0 and 1')
+
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self.clock = clock
+        self.in_flight = 0
+        self.decreased_at = None
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait until a call can start.
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, failed=False):
+        """
+        End a call and adjust the limit with its outcome.
+
+        :param latency: Seconds the call took.
+        :param failed: <True> if the IdP failed or signaled overload.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if failed or latency > self.latency_target:
+                now = self.clock()
+                # The calls in flight during a decrease don't reflect it yet, so decrease at most once per target
+                if self.decreased_at is None or now - self.decreased_at >= self.latency_target:
+                    self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                    self.decreased_at = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Call `fn(*args, **kwargs)` within the limit, `fn` returns a FusionAuth `ClientResponse`.
+        """
+        self.acquire()
+        started_at = self.clock()
+        failed = True
+        try:
+            client_response = fn(*args, **kwargs)
+            failed = is_overload_status(client_response.status)
+            return client_response
+        finally:
+            self.release(self.clock() - started_at, failed=failed)
+
+
+def is_overload_status(status):
+    return status == 429 or status >= 500
+
+
+@cached_until_setting_changed('TAHOE_IDP_ADAPTIVE_CONCURRENCY')
+def get_concurrency_limiter():
+    """
+    Get the process-wide limiter of the batch calls, or None if adaptive concurrency isn't enabled.
+
+    TAHOE_IDP_ADAPTIVE_CONCURRENCY holds the options of `AdaptiveConcurrencyLimiter`, for example:
+        {"max_limit": 16, "latency_target": 0.5}
+    """
+    options = getattr(settings, 'TAHOE_IDP_ADAPTIVE_CONCURRENCY', None)
+    if options is None:
+        return None
+    return AdaptiveConcurrencyLimiter(**options)
@@ -11,3 +11,15 @@ USER_FIELDS_TO_SYNC_OPENEDX_TO_IDP = {
     'name': 'fullName',  # UserProfile
     # TODO:  Consider updating user.preferredLanguages from UserPreference model save
 }
+
+# Fields of the compact IdP user records yielded by `api.iter_idp_users`
+IDP_USER_EXPORT_FIELDS = (
+    'id',
+    'username',
+    'email',
+    'fullName',
+    'active',
+    'verified',
+    'lastLoginInstant',
+    'data',
+)
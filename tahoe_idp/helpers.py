@@ -1,22 +1,38 @@
 """
 Helpers
+
+The FusionAuth and site configuration clients are imported on first use, so processes that only use magic links
+don't pay for importing them.
 """
 
+from copy import deepcopy
 from importlib import import_module
 import logging
-
-from fusionauth.fusionauth_client import FusionAuthClient
-from site_config_client.openedx import api as config_client_api
+import time
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 from django.utils import http
 
+from . import singleflight
+from .permissions import get_capability_flags
+from .redirect_whitelist import get_redirect_whitelist
+
 
 logger = logging.getLogger(__name__)
 
+# Seconds to keep the user records of webhook events for `wait_for_idp_user_ready`
+IDP_USER_READY_TIMEOUT = 5 * 60
+
+# Default seconds to keep the FusionAuth user records read by `fusionauth_retrieve_user`
+IDP_USER_CACHE_TIMEOUT = 30
+
+# De-duplicates the concurrent IdP reads of the same user
+_idp_user_reads = singleflight.Group()
 
-def is_tahoe_idp_enabled():
+
+def is_tahoe_idp_enabled(site_configuration=None):
     """
     A helper method that checks if Tahoe IdP is enabled or not.
 
@@ -28,9 +44,12 @@ def is_tahoe_idp_enabled():
     configuration.
 
     Raises `ImproperlyConfigured` if the configuration not correct.
+
+    :param site_configuration: The site configuration to use instead of the one of the current request.
     """
+    from site_config_client.openedx import api as config_client_api
 
-    is_flag_enabled = config_client_api.get_admin_value("ENABLE_TAHOE_IDP")
+    is_flag_enabled = config_client_api.get_admin_value("ENABLE_TAHOE_IDP", site_configuration=site_configuration)
 
     if is_flag_enabled is None:
         is_flag_enabled = settings.FEATURES.get("ENABLE_TAHOE_IDP", False)
@@ -58,21 +77,21 @@ def is_tahoe_idp_enabled():
     return is_flag_enabled
 
 
-def fail_if_tahoe_idp_not_enabled():
+def fail_if_tahoe_idp_not_enabled(site_configuration=None):
     """
     A helper that makes sure Tahoe IdP is enabled or throw an EnvironmentError.
     """
-    if not is_tahoe_idp_enabled():
+    if not is_tahoe_idp_enabled(site_configuration=site_configuration):
         raise EnvironmentError("Tahoe IdP is not enabled in your project")
 
 
-def get_required_setting(setting_name):
+def get_required_setting(setting_name, site_configuration=None):
     """
     Get a required Tahoe Identity Provider setting from TAHOE_IDP_CONFIGS.
 
     We will raise an ImproperlyConfigured error if we couldn't find the setting.
     """
-    fail_if_tahoe_idp_not_enabled()
+    fail_if_tahoe_idp_not_enabled(site_configuration=site_configuration)
     setting_value = settings.TAHOE_IDP_CONFIGS.get(setting_name)
     if not setting_value:
         raise ImproperlyConfigured("Tahoe IdP `{}` cannot be empty".format(setting_name))
@@ -100,6 +119,8 @@ def get_key_and_secret():
     """
     Return dict with Consumer Key and Consumer Secret for Tahoe IdP OAuth client.
     """
+    from site_config_client.openedx import api as config_client_api
+
     fail_if_tahoe_idp_not_enabled()
     key = config_client_api.get_admin_value('TAHOE_IDP_CLIENT_ID')
     secret = config_client_api.get_secret_value('TAHOE_IDP_CLIENT_SECRET')
@@ -113,19 +134,23 @@ def get_key_and_secret():
     }
 
 
-def get_idp_base_url():
+def get_idp_base_url(site_configuration=None):
     """
     Get IdP base_url from Django's settings variable.
     """
-    return get_required_setting('BASE_URL')
+    return get_required_setting('BASE_URL', site_configuration=site_configuration)
 
 
-def get_tenant_id():
+def get_tenant_id(site_configuration=None):
     """
     Get TAHOE_IDP_TENANT_ID for the FusionAuth API client.
     """
-    fail_if_tahoe_idp_not_enabled()
-    TAHOE_IDP_TENANT_ID = config_client_api.get_admin_value("TAHOE_IDP_TENANT_ID")
+    from site_config_client.openedx import api as config_client_api
+
+    fail_if_tahoe_idp_not_enabled(site_configuration=site_configuration)
+    TAHOE_IDP_TENANT_ID = config_client_api.get_admin_value(
+        "TAHOE_IDP_TENANT_ID", site_configuration=site_configuration,
+    )
 
     if not TAHOE_IDP_TENANT_ID:
         raise ImproperlyConfigured("Tahoe IdP `TAHOE_IDP_TENANT_ID` cannot be empty in `admin` Site Configuration.")
@@ -133,11 +158,11 @@ def get_tenant_id():
     return TAHOE_IDP_TENANT_ID
 
 
-def get_api_key():
+def get_api_key(site_configuration=None):
     """
     Get API_KEY for the FusionAuth API client.
     """
-    return get_required_setting("API_KEY")
+    return get_required_setting("API_KEY", site_configuration=site_configuration)
 
 
 def get_id_jwt_decode_options():
@@ -148,46 +173,197 @@ def get_id_jwt_decode_options():
     return settings.TAHOE_IDP_CONFIGS.get("JWT_OPTIONS", {})
 
 
-def get_api_client():
+def get_api_client(site_configuration=None):
     """
     Get a configured Rest API client for the Identity Provider.
+
+    :param site_configuration: The site configuration of the tenant, required outside of the requests of the site
+                               e.g. in management commands.
     """
-    client = FusionAuthClient(
-        api_key=get_api_key(),
-        base_url=get_idp_base_url(),
+    from .api_client import TahoeIdpApiClient
+
+    return TahoeIdpApiClient(
+        api_key=get_api_key(site_configuration=site_configuration),
+        base_url=get_idp_base_url(site_configuration=site_configuration),
+        tenant_id=get_tenant_id(site_configuration=site_configuration),
     )
-    client.set_tenant_id(get_tenant_id())
-    return client
+
+
+def get_current_site():
+    """
+    Get the `Site` of the current site configuration, or None outside of the requests of a site.
+    """
+    from site_config_client.openedx import api as config_client_api
+
+    site_configuration = config_client_api.get_current_configuration()
+    return site_configuration.site if site_configuration else None
+
+
+def get_site_configuration(site):
+    """
+    Get the Open edX `SiteConfiguration` of a site, to call the IdP for the site outside of its requests.
+    """
+    return site.configuration
 
 
 def get_default_idp_hint():
     """
     Get DEFAULT_IDP_HINT for auto-redirect to predefined Identity Provider
     """
+    from site_config_client.openedx import api as config_client_api
+
     fail_if_tahoe_idp_not_enabled()
     return config_client_api.get_admin_value("DEFAULT_IDP_HINT")
 
 
-def fusionauth_retrieve_user(user_uuid):
+def get_idp_user_cache_key(user_uuid):
+    return 'tahoe_idp.helpers.idp_user.{user_uuid}'.format(user_uuid=user_uuid)
+
+
+def get_idp_user_cache_timeout():
+    return getattr(settings, 'TAHOE_IDP_USER_CACHE_TIMEOUT', IDP_USER_CACHE_TIMEOUT)
+
+
+def cache_idp_user(idp_user):
+    """
+    Write a FusionAuth user record to the cache unless a newer version, by `lastUpdateInstant`, is already cached.
+
+    This keeps a slow read from overwriting the record of a webhook event that arrived in the meantime.
+
+    :return: <True> if the record was cached, <False> otherwise.
+    """
+    timeout = get_idp_user_cache_timeout()
+    if not timeout or not idp_user.get('id'):
+        return False
+
+    cache_key = get_idp_user_cache_key(idp_user['id'])
+    cached_idp_user = cache.get(cache_key)
+    if cached_idp_user is not None:
+        cached_version = cached_idp_user.get('lastUpdateInstant') or 0
+        if cached_version > (idp_user.get('lastUpdateInstant') or 0):
+            return False
+
+    cache.set(cache_key, idp_user, timeout=timeout)
+    return True
+
+
+def invalidate_cached_idp_user(user_uuid):
+    cache.delete(get_idp_user_cache_key(user_uuid))
+
+
+def invalidate_cached_idp_users(user_uuids):
+    cache.delete_many([get_idp_user_cache_key(user_uuid) for user_uuid in user_uuids])
+
+
+def _fetch_idp_user(user_uuid):
     idp_user_res = get_api_client().retrieve_user(user_uuid)
     response = get_successful_fusion_auth_http_response(idp_user_res)
-    return response.json()["user"]
+    idp_user = response.json()["user"]
+    cache_idp_user(idp_user)
+    return idp_user
+
+
+def fusionauth_retrieve_user(user_uuid, use_cache=True):
+    """
+    Get the FusionAuth user record, read through a cache for `TAHOE_IDP_USER_CACHE_TIMEOUT` seconds.
+
+    Concurrent calls for the same user in the process share a single IdP request.
+
+    :param use_cache: <False> to always call the IdP e.g. when waiting for a change, the fresh record is still cached.
+    """
+    if use_cache and get_idp_user_cache_timeout():
+        idp_user = cache.get(get_idp_user_cache_key(user_uuid))
+        if idp_user is not None:
+            return idp_user
+
+    idp_user, shared = _idp_user_reads.do(user_uuid, _fetch_idp_user, user_uuid)
+    if shared:
+        # Each caller may modify its copy of the record
+        idp_user = deepcopy(idp_user)
+    return idp_user
+
+
+def get_idp_permission_flags_cache_key(user_id):
+    return 'tahoe_idp.helpers.idp_permission_flags.{user_id}'.format(user_id=user_id)
+
+
+def get_idp_permission_flags_from_extra_data(extra_data):
+    """
+    Build the permission flags from the capabilities stored in `UserSocialAuth.extra_data` by the backend.
+
+    :return: dict of flags plus `capabilities` and `data_version`, or an empty dict if not stored yet.
+    """
+    capabilities = (extra_data or {}).get('tahoe_idp_capabilities')
+    if capabilities is None:
+        return {}
+
+    flags = get_capability_flags(capabilities)
+    flags['capabilities'] = capabilities
+    flags['data_version'] = extra_data.get('tahoe_idp_data_version')
+    return flags
+
+
+def cache_idp_permission_flags(user_id, extra_data):
+    """
+    Write the permission flags of the user to the cache, for `TAHOE_IDP_PERMISSION_FLAGS_CACHE_TIMEOUT` seconds.
+    """
+    flags = get_idp_permission_flags_from_extra_data(extra_data)
+    cache.set(
+        get_idp_permission_flags_cache_key(user_id),
+        flags,
+        timeout=getattr(settings, 'TAHOE_IDP_PERMISSION_FLAGS_CACHE_TIMEOUT', 3600),
+    )
+    return flags
+
+
+def invalidate_idp_permission_flags(user_id):
+    cache.delete(get_idp_permission_flags_cache_key(user_id))
+
+
+def get_idp_user_ready_cache_key(user_uuid):
+    return 'tahoe_idp.helpers.idp_user_ready.{user_uuid}'.format(user_uuid=user_uuid)
+
+
+def set_idp_user_ready(idp_user):
+    """
+    Signal that the IdP user has a username, from a FusionAuth `user.create` or `user.update` webhook event.
+    """
+    if idp_user.get('id') and idp_user.get('username'):
+        cache.set(get_idp_user_ready_cache_key(idp_user['id']), idp_user, timeout=IDP_USER_READY_TIMEOUT)
+
+
+def wait_for_idp_user_ready(user_uuid, timeout, poll_interval=0.1):
+    """
+    Wait up to `timeout` seconds for `set_idp_user_ready` to be called for the user.
+
+    Only the cache is polled, the IdP isn't called.
+
+    :return: the IdP user record, or None if the deadline is reached.
+    """
+    cache_key = get_idp_user_ready_cache_key(user_uuid)
+    deadline = time.monotonic() + timeout
+    while True:
+        idp_user = cache.get(cache_key)
+        if idp_user is not None or time.monotonic() >= deadline:
+            return idp_user
+        time.sleep(poll_interval)
 
 
 def is_valid_redirect_url(redirect_to, request_host, require_https):
     """
     Verify that the given URL if valid or not
 
+    LOGIN_REDIRECT_WHITELIST entries can be exact hosts or wildcards such as `*.example.com`.
+
     :param redirect_to: The URL in question
     :param request_host: Originating hostname of the request. This is always considered an acceptable redirect target.
     :param require_https: Whether HTTPs should be required in the redirect URL.
     :return: <True> if valid. <False> otherwise
     """
-    login_redirect_whitelist = set(getattr(settings, 'LOGIN_REDIRECT_WHITELIST', []))
-    login_redirect_whitelist.add(request_host)
+    allowed_hosts = get_redirect_whitelist().allowed_hosts(request_host)
 
     is_safe_url = http.is_safe_url(
-        redirect_to, allowed_hosts=login_redirect_whitelist, require_https=require_https
+        redirect_to, allowed_hosts=allowed_hosts, require_https=require_https
     )
     return is_safe_url
 
@@ -0,0 +1,184 @@
+"""
+Transactional outbox for syncing user changes to the IdP.
+
+When `settings.TAHOE_IDP_SYNC_OUTBOX_ENABLED` is set, user updates are written to the `IdpSyncOutboxEntry` table
+instead of being sent inline, and the `drain_idp_sync_outbox` command sends them in batches. Entries of the same
+user are sent in order: a failed entry blocks the later entries of its user until it's retried successfully or
+given up on after `max_attempts`. Entries without a site configuration e.g. of users saved outside of a request
+are given up on right away, since the IdP tenant is unknown.
+
+When `settings.TAHOE_IDP_BUFFER_LAST_LOGIN` is set, the last login updates of `api.update_tahoe_user_id` are
+buffered in the outbox too, keeping a single pending entry per user with the newest timestamp.
+"""
+
+from datetime import timedelta
+import json
+import logging
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from tahoe_idp import helpers
+from tahoe_idp.models import IdpSyncOutboxEntry
+from tahoe_idp.rate_limiting import batch_traffic
+
+
+log = logging.getLogger(__name__)
+
+RETRY_DELAY_SECONDS = 60
+MAX_RETRY_DELAY_SECONDS = 3600
+
+
+def is_outbox_enabled():
+    return getattr(settings, 'TAHOE_IDP_SYNC_OUTBOX_ENABLED', False)
+
+
+def is_last_login_buffer_enabled():
+    return getattr(settings, 'TAHOE_IDP_BUFFER_LAST_LOGIN', False)
+
+
+def enqueue_user_update(user, properties):
+    """
+    Store a PATCH /api/user/{userId} request to be sent by `drain_outbox`.
+    """
+    return IdpSyncOutboxEntry.objects.create(
+        user=user, site=helpers.get_current_site(), properties=json.dumps(properties),
+    )
+
+
+def enqueue_last_login(user, properties):
+    """
+    Store a last login update, replacing the pending last login update of the user if any.
+
+    The user row is locked while coalescing, so concurrent logins of the user don't both create an entry.
+    """
+    serialized_properties = json.dumps(properties)
+    with transaction.atomic():
+        list(get_user_model().objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+        is_coalesced = IdpSyncOutboxEntry.objects.filter(
+            user=user, kind=IdpSyncOutboxEntry.KIND_LAST_LOGIN, failed_on__isnull=True,
+        ).update(properties=serialized_properties)
+
+        if not is_coalesced:
+            IdpSyncOutboxEntry.objects.create(
+                user=user,
+                site=helpers.get_current_site(),
+                kind=IdpSyncOutboxEntry.KIND_LAST_LOGIN,
+                properties=serialized_properties,
+            )
+
+
+def update_enqueued_user_update(entry, properties):
+    """
+    Replace the request of an entry that wasn't sent yet.
+    """
+    entry.properties = json.dumps(properties)
+    IdpSyncOutboxEntry.objects.filter(pk=entry.pk).update(properties=entry.properties)
+
+
+def get_retry_delay(attempts):
+    """
+    Exponential backoff: 1, 2, 4... minutes up to an hour.
+    """
+    return timedelta(seconds=min(RETRY_DELAY_SECONDS * 2 ** (attempts - 1), MAX_RETRY_DELAY_SECONDS))
+
+
+def get_ready_entries(now):
+    """
+    Get the entries that can be sent now, oldest first.
+
+    Entries waiting for a retry, and the later entries of their users, are excluded in SQL so they don't fill
+    the batches and stall the other users.
+    """
+    earlier_entries_in_backoff = IdpSyncOutboxEntry.objects.filter(
+        user_id=OuterRef('user_id'),
+        id__lt=OuterRef('id'),
+        failed_on__isnull=True,
+        next_attempt_on__gt=now,
+    )
+    return IdpSyncOutboxEntry.objects.annotate(
+        is_blocked=Exists(earlier_entries_in_backoff),
+    ).filter(
+        failed_on__isnull=True,
+        next_attempt_on__lte=now,
+        is_blocked=False,
+    ).select_related('user', 'site').order_by('id')
+
+
+def get_entry_site_configuration(entry):
+    """
+    Get the site configuration to send an entry with, or None if e.g. the user was saved outside of a request.
+    """
+    if entry.site is None:
+        return None
+    try:
+        return helpers.get_site_configuration(entry.site)
+    except ObjectDoesNotExist:
+        return None
+
+
+def drain_outbox(batch_size=100, max_attempts=5):
+    """
+    Send a batch of pending outbox entries to the IdP.
+
+    :return: dict with the number of `sent`, `retried` and `failed` entries.
+    """
+    from tahoe_idp import api  # Avoid circular imports
+    from requests import exceptions as requests_exceptions
+
+    now = timezone.now()
+    result = {
+        'sent': 0,
+        'retried': 0,
+        'failed': 0,
+    }
+    blocked_user_ids = set()
+
+    for entry in get_ready_entries(now)[:batch_size]:
+        if entry.user_id in blocked_user_ids:
+            # Keep the updates of the user in order after a failure in this batch
+            continue
+
+        # The command runs outside of the requests of the site, so its configuration is passed explicitly
+        site_configuration = get_entry_site_configuration(entry)
+        if site_configuration is None:
+            log.error('Giving up on IdP sync of user {user_id}: the entry has no site configuration'.format(
+                user_id=entry.user_id,
+            ))
+            entry.last_error = 'No site configuration'
+            entry.failed_on = now
+            entry.save(update_fields=['last_error', 'failed_on'])
+            result['failed'] += 1
+            continue
+
+        try:
+            with batch_traffic():
+                api.update_user(entry.user, json.loads(entry.properties), site_configuration=site_configuration)
+        except Exception as exc:
+            if not isinstance(exc, requests_exceptions.RequestException):
+                # e.g. the IdP is disabled or misconfigured for the site, retried like an IdP error
+                log.exception('Could not sync user {user_id} to the IdP'.format(user_id=entry.user_id))
+            entry.attempts += 1
+            entry.last_error = str(exc) or exc.__class__.__name__
+            if entry.attempts >= max_attempts:
+                log.error('Giving up on IdP sync of user {user_id} after {attempts} attempts: {error}'.format(
+                    user_id=entry.user_id, attempts=entry.attempts, error=exc,
+                ))
+                entry.failed_on = now
+                result['failed'] += 1
+            else:
+                entry.next_attempt_on = now + get_retry_delay(entry.attempts)
+                blocked_user_ids.add(entry.user_id)
+                result['retried'] += 1
+            # Don't overwrite the properties, a newer last login may have been coalesced into the entry meanwhile
+            entry.save(update_fields=['attempts', 'last_error', 'failed_on', 'next_attempt_on'])
+        else:
+            # Keep the entry pending if a newer last login was coalesced into it while sending
+            IdpSyncOutboxEntry.objects.filter(pk=entry.pk, properties=entry.properties).delete()
+            result['sent'] += 1
+
+    return result
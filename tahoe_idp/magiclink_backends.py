@@ -1,9 +1,13 @@
 import logging
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.http import HttpRequest
 
-from tahoe_idp.models import MagicLink, MagicLinkError
+from tahoe_idp.magiclink_storage import get_magiclink_storage
+from tahoe_idp.magiclink_throttling import is_verification_blocked, record_verification_failure
+from tahoe_idp.models import MagicLinkError, get_auth_user_fields
 
 User = get_user_model()
 log = logging.getLogger(__name__)
@@ -27,16 +31,21 @@ class MagicLinkBackend:
             log.warning('username not supplied with token')
             return
 
-        try:
-            magiclink = MagicLink.objects.get(token=token)
-        except MagicLink.DoesNotExist:
-            log.debug('MagicLink with token "{token}" not found'.format(token=token))
+        if is_verification_blocked(request, token):
+            log.warning('MagicLink verification throttled for {username}'.format(username=username))
+            return
+
+        magiclink = get_magiclink_storage().get_usable(token)
+        if not magiclink:
+            log.debug('Usable MagicLink with token "{token}" not found'.format(token=token))
+            record_verification_failure(request, token)
             return
 
         try:
             user = magiclink.get_user_with_validate(request, username)
         except MagicLinkError as error:
             log.debug(error)
+            record_verification_failure(request, token)
             return
 
         log.info('{username} authenticated via MagicLink'.format(username=user.username))
@@ -45,4 +54,32 @@ class MagicLinkBackend:
 
     @staticmethod
     def get_user(user_id):
-        return User.objects.filter(pk=user_id).first()
+        """
+        Load the user of the session with the columns needed for auth only.
+
+        The user is cached for MAGICLINK_GET_USER_CACHE_TIMEOUT seconds when set, since this runs on every request.
+        """
+        cache_timeout = settings.MAGICLINK_GET_USER_CACHE_TIMEOUT
+        cache_key = get_user_cache_key(user_id)
+        if cache_timeout:
+            user = cache.get(cache_key)
+            if user is not None:
+                return user
+
+        user = User.objects.only(*get_auth_user_fields()).filter(pk=user_id).first()
+
+        if cache_timeout and user is not None:
+            cache.set(cache_key, user, timeout=cache_timeout)
+
+        return user
+
+
+def get_user_cache_key(user_id):
+    return 'tahoe_idp.magiclink_backends.user.{user_id}'.format(user_id=user_id)
+
+
+def invalidate_user_cache(user_id):
+    """
+    Remove the user from the `MagicLinkBackend.get_user` cache.
+    """
+    cache.delete(get_user_cache_key(user_id))
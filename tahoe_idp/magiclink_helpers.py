@@ -1,38 +1,100 @@
-from datetime import timedelta
 import logging
 
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
 from django.http import HttpRequest
-from django.utils import timezone
 from django.utils.crypto import get_random_string
+from tahoe_idp import api
 from tahoe_idp.helpers import import_from_path
-from tahoe_idp.models import MagicLink, MagicLinkError
+from tahoe_idp.magiclink_storage import get_magiclink_storage
+from tahoe_idp.models import MagicLink
+from tahoe_idp.settings_cache import cached_until_setting_changed
 
 log = logging.getLogger(__name__)
 
+STUDIO_SESSION_MARKER_SALT = 'tahoe_idp.magiclink_helpers.studio_session'
+
 
 def create_magiclink(
     username: str,
     request: HttpRequest,
     redirect_url: str = None,
 ) -> MagicLink:
-    limit = timezone.now() - timedelta(seconds=settings.MAGICLINK_LOGIN_REQUEST_TIME_LIMIT)  # NOQA: E501
-    over_limit = MagicLink.objects.filter(username=username, created_on__gte=limit)
-    if over_limit:
-        raise MagicLinkError('Too many magic login requests')
-
-    # Only the last magic link is usable per user
-    MagicLink.objects.filter(username=username, used=False).update(used=True)
-
-    expiry = timezone.now() + timedelta(seconds=settings.MAGICLINK_AUTH_TIMEOUT)
-    magic_link = MagicLink.objects.create(
-        username=username,
-        token=get_random_string(length=settings.MAGICLINK_TOKEN_LENGTH),
-        expiry=expiry,
-        redirect_url=redirect_url,
-        created_on=timezone.now(),
-    )
-    return magic_link
+    return get_magiclink_storage().create(username, redirect_url=redirect_url)
+
+
+def create_magiclinks(usernames, redirect_url=None):
+    """
+    Issue magic links for many users in a single batch.
+
+    Follows the same rate-limit and invalidation rules as `create_magiclink`, but users who requested a link
+    within MAGICLINK_LOGIN_REQUEST_TIME_LIMIT are skipped instead of failing the whole batch.
+
+    :param usernames: iterable of usernames, duplicates are ignored
+    :param redirect_url: where to redirect the users after logging in
+    :return: OrderedDict of {username: MagicLink} for the issued links
+    """
+    return get_magiclink_storage().bulk_create(usernames, redirect_url=redirect_url)
+
+
+@cached_until_setting_changed('MAGICLINK_STUDIO_PERMISSION_METHOD')
+def get_studio_permission_method():
+    """
+    Resolve the MAGICLINK_STUDIO_PERMISSION_METHOD callable once per process.
+
+    Raises `ImproperlyConfigured` if the method can't be imported or is not callable.
+
+    :return: the callable, or None if MAGICLINK_STUDIO_PERMISSION_METHOD is not set
+    """
+    method_path = settings.MAGICLINK_STUDIO_PERMISSION_METHOD
+    if not method_path:
+        return None
+
+    try:
+        method = import_from_path(method_path)
+    except (ImportError, AttributeError, ValueError) as err:
+        raise ImproperlyConfigured('"MAGICLINK_STUDIO_PERMISSION_METHOD" cannot be imported: {details}'.format(
+            details=str(err),
+        ))
+
+    if not callable(method):
+        raise ImproperlyConfigured('"MAGICLINK_STUDIO_PERMISSION_METHOD" must be a callable')
+
+    return method
+
+
+def get_studio_permission_version(user):
+    """
+    Get the version of the user's Studio permission verdicts, which is part of the verdict cache key.
+
+    The version includes the IdP data version of the user's role flags, so verdicts are recomputed after
+    the roles change in the IdP.
+    """
+    version = cache.get(_studio_permission_cache_key('version', user.id), 0)
+    idp_flags = api.get_idp_permission_flags(user)
+    if idp_flags and idp_flags['data_version']:
+        version = '{version}.{data_version}'.format(version=version, data_version=idp_flags['data_version'])
+    return version
+
+
+def invalidate_studio_permission_cache(user_id):
+    """
+    Invalidate the cached Studio permission verdicts of the user by bumping their version.
+    """
+    version_key = _studio_permission_cache_key('version', user_id)
+    if not cache.add(version_key, 1, timeout=None):
+        try:
+            cache.incr(version_key)
+        except ValueError:  # Evicted between `add` and `incr`
+            cache.set(version_key, 1, timeout=None)
+
+
+def _studio_permission_cache_key(kind, user_id, version=None):
+    key = 'tahoe_idp.magiclink_helpers.studio_permission.{kind}.{user_id}'.format(kind=kind, user_id=user_id)
+    if version is not None:
+        key = '{key}.{version}'.format(key=key, version=version)
+    return key
 
 
 def is_studio_allowed_for_user(user):
@@ -41,23 +103,119 @@ def is_studio_allowed_for_user(user):
     set in MAGICLINK_STUDIO_PERMISSION_METHOD
 
     * If there is no method set; the helper will check for is_staff and is_superuser permissions
-    * If MAGICLINK_STUDIO_PERMISSION_METHOD is set but failed to be loaded for any reason; the helper
-        will return <False> silently
+    * If MAGICLINK_STUDIO_PERMISSION_METHOD is set but can't be loaded; `ImproperlyConfigured` is raised
+    * If the external method fails for any reason; the helper will return <False>
+    * Verdicts of the external method are cached for MAGICLINK_STUDIO_PERMISSION_CACHE_TIMEOUT seconds when set
 
     :param user:
     :return: <True> if allowed, <False> otherwise
     """
-    if not settings.MAGICLINK_STUDIO_PERMISSION_METHOD:
+    external_method = get_studio_permission_method()
+    if not external_method:
         return user and (user.is_staff or user.is_superuser)
 
+    cache_timeout = settings.MAGICLINK_STUDIO_PERMISSION_CACHE_TIMEOUT
+    if cache_timeout:
+        cache_key = _studio_permission_cache_key('verdict', user.id, get_studio_permission_version(user))
+        result = cache.get(cache_key)
+        if result is not None:
+            return result
+
     try:
-        external_method = import_from_path(settings.MAGICLINK_STUDIO_PERMISSION_METHOD)
         result = external_method(user)
     except Exception as err:
         log.warning('tahoue_idp.is_studio_allowed_for_user failed for user {username}: {details}'.format(
             username=user.username,
             details=str(err))
         )
-        result = False
+        return False
+
+    if cache_timeout:
+        cache.set(cache_key, result, timeout=cache_timeout)
 
     return result
+
+
+def get_studio_session_marker_age():
+    """
+    Get the lifetime of the Studio session marker, which doesn't outlive the Studio session.
+    """
+    return min(settings.MAGICLINK_STUDIO_SESSION_COOKIE_AGE, settings.SESSION_COOKIE_AGE)
+
+
+def _studio_session_marker_cache_key(marker_id):
+    return 'tahoe_idp.magiclink_helpers.studio_session_marker.{marker_id}'.format(marker_id=marker_id)
+
+
+def set_studio_session_marker(request, response, user):
+    """
+    Set a signed cookie, shared between LMS and Studio, marking that the user has a Studio session.
+
+    The marker id in the cookie is registered in the cache for the lifetime of the Studio session, and unregistered
+    on logout by `revoke_studio_session_marker`, so the marker is only valid while the Studio session is.
+
+    Does nothing unless MAGICLINK_STUDIO_SESSION_COOKIE_DOMAIN is set.
+    """
+    if not settings.MAGICLINK_STUDIO_SESSION_COOKIE_DOMAIN:
+        return
+
+    marker_id = get_random_string(32)
+    max_age = get_studio_session_marker_age()
+    cache.set(_studio_session_marker_cache_key(marker_id), user.pk, timeout=max_age)
+
+    response.set_signed_cookie(
+        settings.MAGICLINK_STUDIO_SESSION_COOKIE_NAME,
+        '{username}:{marker_id}'.format(username=user.username, marker_id=marker_id),
+        salt=STUDIO_SESSION_MARKER_SALT,
+        max_age=max_age,
+        domain=settings.MAGICLINK_STUDIO_SESSION_COOKIE_DOMAIN,
+        secure=request.is_secure(),
+        httponly=True,
+        samesite='Lax',
+    )
+
+
+def _get_studio_session_marker(request):
+    """
+    Read the signed marker cookie.
+
+    :return: (username, marker_id), or (None, None) if the cookie is missing or invalid
+    """
+    value = request.get_signed_cookie(
+        settings.MAGICLINK_STUDIO_SESSION_COOKIE_NAME,
+        default=None,
+        salt=STUDIO_SESSION_MARKER_SALT,
+        max_age=get_studio_session_marker_age(),
+    )
+    if not value or ':' not in value:
+        return None, None
+    username, marker_id = value.rsplit(':', 1)
+    return username, marker_id
+
+
+def has_studio_session_marker(request):
+    """
+    Check if the request carries a valid Studio session marker for the logged in user.
+
+    :return: <True> if the marker is valid, not revoked and belongs to `request.user`, <False> otherwise
+    """
+    if not settings.MAGICLINK_STUDIO_SESSION_COOKIE_DOMAIN:
+        return False
+
+    username, marker_id = _get_studio_session_marker(request)
+    if not marker_id or username != request.user.username:
+        return False
+
+    return cache.get(_studio_session_marker_cache_key(marker_id)) == request.user.pk
+
+
+def revoke_studio_session_marker(request):
+    """
+    Invalidate the Studio session marker of the request, on logout from LMS or Studio.
+    """
+    if not settings.MAGICLINK_STUDIO_SESSION_COOKIE_DOMAIN or request is None:
+        return
+
+    _username, marker_id = _get_studio_session_marker(request)
+    if marker_id:
+        cache.delete(_studio_session_marker_cache_key(marker_id))
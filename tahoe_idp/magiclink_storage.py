@@ -0,0 +1,255 @@
+"""
+Pluggable storage for magic links.
+
+The storage is selected by `settings.MAGICLINK_STORAGE_BACKEND` which is a path in the form
+"module.submodule:ClassName". Two backends are shipped:
+
+ * `DatabaseMagicLinkStorage`: stores the links in the `MagicLink` table (default).
+ * `CacheMagicLinkStorage`: stores the links in a Django cache (e.g. Redis) and relies on the native cache TTLs
+   to expire them, which keeps high-volume Studio logins off the primary database.
+"""
+
+from collections import OrderedDict
+from datetime import timedelta
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from tahoe_idp.helpers import import_from_path
+from tahoe_idp.models import MagicLink, MagicLinkError
+
+
+def get_magiclink_storage():
+    """
+    Get an instance of the configured magic link storage backend.
+    """
+    storage_class = import_from_path(settings.MAGICLINK_STORAGE_BACKEND)
+    return storage_class()
+
+
+class BaseMagicLinkStorage:
+    """
+    Interface for magic link storage backends.
+    """
+
+    def build(self, username, redirect_url=None):
+        """
+        Build a new (unsaved) magic link for the given username.
+        """
+        now = timezone.now()
+        return MagicLink(
+            username=username,
+            token=get_random_string(length=settings.MAGICLINK_TOKEN_LENGTH),
+            expiry=now + timedelta(seconds=settings.MAGICLINK_AUTH_TIMEOUT),
+            redirect_url=redirect_url,
+            created_on=now,
+        )
+
+    def create(self, username, redirect_url=None):
+        """
+        Create and store a magic link for the given username.
+
+        Only the last magic link is usable per user. Raises `MagicLinkError` if a link was requested for the same
+        user within `MAGICLINK_LOGIN_REQUEST_TIME_LIMIT` seconds.
+        """
+        raise NotImplementedError('Implement in subclass')
+
+    def bulk_create(self, usernames, redirect_url=None):
+        """
+        Create and store magic links for many usernames at once with the same semantics as `create`.
+
+        Usernames that hit the request time limit are skipped.
+
+        :return: OrderedDict of {username: MagicLink} for the created links.
+        """
+        magic_links = OrderedDict()
+        for username in OrderedDict.fromkeys(usernames):
+            try:
+                magic_links[username] = self.create(username, redirect_url=redirect_url)
+            except MagicLinkError:
+                pass
+        return magic_links
+
+    def get(self, token):
+        """
+        Get the magic link of the given token, or None if it does not exist.
+        """
+        raise NotImplementedError('Implement in subclass')
+
+    def get_usable(self, token):
+        """
+        Get the magic link of the given token only if it's neither used nor expired, otherwise None.
+        """
+        raise NotImplementedError('Implement in subclass')
+
+    def mark_used(self, magic_link):
+        """
+        Mark the given magic link as used so it can't be used again.
+        """
+        raise NotImplementedError('Implement in subclass')
+
+
+class DatabaseMagicLinkStorage(BaseMagicLinkStorage):
+    """
+    Store magic links in the `MagicLink` database table.
+    """
+
+    # Keep `IN (...)` queries and inserts within the database parameter limits
+    BATCH_SIZE = 500
+
+    def create(self, username, redirect_url=None):
+        limit = timezone.now() - timedelta(seconds=settings.MAGICLINK_LOGIN_REQUEST_TIME_LIMIT)
+        over_limit = MagicLink.objects.filter(username=username, created_on__gte=limit)
+        if over_limit:
+            raise MagicLinkError('Too many magic login requests')
+
+        # Only the last magic link is usable per user
+        MagicLink.objects.filter(username=username, used=False).update(used=True)
+
+        magic_link = self.build(username, redirect_url=redirect_url)
+        magic_link.save()
+        return magic_link
+
+    def bulk_create(self, usernames, redirect_url=None):
+        usernames = list(OrderedDict.fromkeys(usernames))
+        limit = timezone.now() - timedelta(seconds=settings.MAGICLINK_LOGIN_REQUEST_TIME_LIMIT)
+
+        with transaction.atomic():
+            over_limit = set()
+            for usernames_batch in _batches(usernames, self.BATCH_SIZE):
+                over_limit.update(MagicLink.objects.filter(
+                    username__in=usernames_batch, created_on__gte=limit,
+                ).values_list('username', flat=True))
+
+            allowed_usernames = [username for username in usernames if username not in over_limit]
+
+            # Only the last magic link is usable per user
+            for usernames_batch in _batches(allowed_usernames, self.BATCH_SIZE):
+                MagicLink.objects.filter(username__in=usernames_batch, used=False).update(used=True)
+
+            magic_links = [self.build(username, redirect_url=redirect_url) for username in allowed_usernames]
+            MagicLink.objects.bulk_create(magic_links, batch_size=self.BATCH_SIZE)
+
+        return OrderedDict((magic_link.username, magic_link) for magic_link in magic_links)
+
+    def get(self, token):
+        return MagicLink.objects.filter(token=token).first()
+
+    def get_usable(self, token):
+        # Filter in SQL so invalid tokens cost a single indexed miss
+        return MagicLink.objects.filter(token=token, used=False, expiry__gt=timezone.now()).first()
+
+    def mark_used(self, magic_link):
+        magic_link.used = True
+        magic_link.save()
+
+
+class CacheMagicLinkStorage(BaseMagicLinkStorage):
+    """
+    Store magic links in the Django cache configured by `MAGICLINK_STORAGE_CACHE`.
+
+    Links expire natively after `MAGICLINK_AUTH_TIMEOUT` seconds, and the request rate limit is a cache entry that
+    expires after `MAGICLINK_LOGIN_REQUEST_TIME_LIMIT` seconds.
+    """
+
+    KEY_PREFIX = 'tahoe_idp.magiclink'
+
+    def __init__(self):
+        self.cache = caches[settings.MAGICLINK_STORAGE_CACHE]
+
+    def _key(self, kind, value):
+        """
+        Build a cache key. Values are hashed because both tokens and usernames are user input.
+        """
+        return '{prefix}.{kind}.{digest}'.format(
+            prefix=self.KEY_PREFIX,
+            kind=kind,
+            digest=hashlib.sha256(value.encode('utf-8')).hexdigest(),
+        )
+
+    def _serialize(self, magic_link):
+        return {
+            'username': magic_link.username,
+            'token': magic_link.token,
+            'expiry': magic_link.expiry,
+            'redirect_url': magic_link.redirect_url,
+            'used': magic_link.used,
+            'created_on': magic_link.created_on,
+        }
+
+    def create(self, username, redirect_url=None):
+        is_allowed = self.cache.add(
+            self._key('throttle', username), True, timeout=settings.MAGICLINK_LOGIN_REQUEST_TIME_LIMIT,
+        )
+        if not is_allowed:
+            raise MagicLinkError('Too many magic login requests')
+
+        # Only the last magic link is usable per user
+        user_key = self._key('user', username)
+        previous_token = self.cache.get(user_key)
+        if previous_token:
+            self.cache.delete(self._key('token', previous_token))
+
+        magic_link = self.build(username, redirect_url=redirect_url)
+        self.cache.set_many({
+            self._key('token', magic_link.token): self._serialize(magic_link),
+            user_key: magic_link.token,
+        }, timeout=settings.MAGICLINK_AUTH_TIMEOUT)
+        return magic_link
+
+    def bulk_create(self, usernames, redirect_url=None):
+        allowed_usernames = [
+            username for username in OrderedDict.fromkeys(usernames)
+            if self.cache.add(
+                self._key('throttle', username), True, timeout=settings.MAGICLINK_LOGIN_REQUEST_TIME_LIMIT,
+            )
+        ]
+
+        # Only the last magic link is usable per user
+        previous_tokens = self.cache.get_many([self._key('user', username) for username in allowed_usernames])
+        self.cache.delete_many([self._key('token', token) for token in previous_tokens.values()])
+
+        magic_links = OrderedDict()
+        cache_entries = {}
+        for username in allowed_usernames:
+            magic_link = self.build(username, redirect_url=redirect_url)
+            magic_links[username] = magic_link
+            cache_entries[self._key('token', magic_link.token)] = self._serialize(magic_link)
+            cache_entries[self._key('user', username)] = magic_link.token
+
+        self.cache.set_many(cache_entries, timeout=settings.MAGICLINK_AUTH_TIMEOUT)
+        return magic_links
+
+    def get(self, token):
+        data = self.cache.get(self._key('token', token))
+        if data is None:
+            return None
+        return MagicLink(**data)
+
+    def get_usable(self, token):
+        magic_link = self.get(token)
+        if magic_link is None or magic_link.used or magic_link.expiry <= timezone.now():
+            return None
+        return magic_link
+
+    def mark_used(self, magic_link):
+        magic_link.used = True
+        token_key = self._key('token', magic_link.token)
+        remaining_seconds = int((magic_link.expiry - timezone.now()).total_seconds())
+        if remaining_seconds > 0:
+            # Keep the used link until it expires, so the redirect URL can still be read after login
+            self.cache.set(token_key, self._serialize(magic_link), timeout=remaining_seconds)
+        else:
+            self.cache.delete(token_key)
+
+
+def _batches(items, size):
+    """
+    Split a list into lists of at most `size` items.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
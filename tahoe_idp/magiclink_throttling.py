@@ -0,0 +1,86 @@
+"""
+Cache-backed throttling of magic link verifications.
+
+Failed verifications are counted per client IP, and rejected tokens are remembered for a short while, so floods of
+invalid tokens are rejected from the cache before reaching the database.
+
+Failures aren't counted per username: anyone could otherwise lock a user out by sending bogus tokens for their
+username. The client IP is read from MAGICLINK_VERIFY_CLIENT_IP_HEADER, which should be set behind a load balancer
+since REMOTE_ADDR is then the address of the load balancer.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+KEY_PREFIX = 'tahoe_idp.magiclink_throttling'
+
+
+def _key(kind, value):
+    """
+    Build a cache key. Values are hashed because tokens, usernames and IPs are user input.
+    """
+    return '{prefix}.{kind}.{digest}'.format(
+        prefix=KEY_PREFIX,
+        kind=kind,
+        digest=hashlib.sha256(value.encode('utf-8')).hexdigest(),
+    )
+
+
+def get_client_ip(request):
+    """
+    Get the client IP from MAGICLINK_VERIFY_CLIENT_IP_HEADER.
+
+    Proxies append to headers such as X-Forwarded-For, so the entries added by the client are ignored: the address
+    is taken from the right, skipping the MAGICLINK_VERIFY_TRUSTED_PROXY_COUNT entries added by the inner proxies.
+    """
+    header_value = request and request.META.get(settings.MAGICLINK_VERIFY_CLIENT_IP_HEADER)
+    if not header_value:
+        return None
+
+    addresses = [address.strip() for address in header_value.split(',') if address.strip()]
+    if not addresses:
+        return None
+    return addresses[max(len(addresses) - 1 - settings.MAGICLINK_VERIFY_TRUSTED_PROXY_COUNT, 0)]
+
+
+def _failure_key(request):
+    ip_address = get_client_ip(request)
+    return _key('ip', ip_address) if ip_address else None
+
+
+def is_verification_blocked(request, token):
+    """
+    Check if the verification should be rejected without looking up the token.
+
+    :return: <True> if the token was recently rejected or the client IP reached MAGICLINK_VERIFY_FAILURE_LIMIT
+        failures, <False> otherwise
+    """
+    token_key = _key('token', token)
+    failure_key = _failure_key(request) if settings.MAGICLINK_VERIFY_FAILURE_LIMIT else None
+    cached_values = cache.get_many([key for key in (token_key, failure_key) if key])
+
+    if cached_values.get(token_key):
+        return True
+
+    if failure_key:
+        return cached_values.get(failure_key, 0) >= settings.MAGICLINK_VERIFY_FAILURE_LIMIT
+
+    return False
+
+
+def record_verification_failure(request, token):
+    """
+    Remember the rejected token and count the failure for the client IP.
+    """
+    cache.set(_key('token', token), True, timeout=settings.MAGICLINK_REJECTED_TOKEN_CACHE_TIMEOUT)
+
+    failure_key = _failure_key(request) if settings.MAGICLINK_VERIFY_FAILURE_LIMIT else None
+    # The window starts with the first failure and is not extended by later ones
+    if failure_key and not cache.add(failure_key, 1, timeout=settings.MAGICLINK_VERIFY_FAILURE_WINDOW):
+        try:
+            cache.incr(failure_key)
+        except ValueError:  # Expired between `add` and `incr`
+            cache.set(failure_key, 1, timeout=settings.MAGICLINK_VERIFY_FAILURE_WINDOW)
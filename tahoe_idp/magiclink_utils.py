@@ -1,3 +1,7 @@
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.http import HttpRequest
 from django.urls import reverse
 from django.urls.exceptions import NoReverseMatch
 
@@ -11,3 +15,19 @@ def get_url_path(url: str) -> str:
         return reverse(url)
     except NoReverseMatch:
         return url
+
+
+def get_studio_url(request: HttpRequest = None, path: str = '/', secure: bool = False) -> str:
+    """
+    Build an absolute Studio URL for the given path using MAGICLINK_STUDIO_DOMAIN.
+
+    The scheme follows the request if given, otherwise `secure` is used. Absolute URLs are returned as-is.
+    """
+    if request is not None:
+        secure = request.is_secure()
+
+    scheme = secure and 'https' or 'http'
+    return urljoin(
+        '{scheme}://{studio_domain}'.format(scheme=scheme, studio_domain=settings.MAGICLINK_STUDIO_DOMAIN),
+        path
+    )
@@ -10,9 +10,14 @@ from django.views.decorators.cache import never_cache
 from django.views.generic import TemplateView, View
 
 from tahoe_idp.helpers import is_valid_redirect_url
-from tahoe_idp.magiclink_helpers import create_magiclink, is_studio_allowed_for_user
-from tahoe_idp.magiclink_utils import get_url_path
-from tahoe_idp.models import MagicLink
+from tahoe_idp.magiclink_helpers import (
+    create_magiclink,
+    has_studio_session_marker,
+    is_studio_allowed_for_user,
+    set_studio_session_marker,
+)
+from tahoe_idp.magiclink_storage import get_magiclink_storage
+from tahoe_idp.magiclink_utils import get_studio_url, get_url_path
 
 log = logging.getLogger(__name__)
 
@@ -32,12 +37,13 @@ class LoginVerify(TemplateView):
         log.warning('Magic link login successful for %s', username)
 
         response = self.login_complete_action()
+        set_studio_session_marker(request, response, user)
 
         return response
 
     def login_complete_action(self) -> HttpResponseRedirect:
         token = self.request.GET.get('token')
-        magiclink = MagicLink.objects.get(token=token)
+        magiclink = get_magiclink_storage().get(token)
         return HttpResponseRedirect(magiclink.redirect_url or settings.LOGIN_REDIRECT_URL)
 
 
@@ -56,6 +62,10 @@ class StudioLoginAPIView(View):
         if next_url and not is_valid_redirect_url(next_url, request.get_host(), request.is_secure()):
             next_url = None
 
+        if has_studio_session_marker(request):
+            # The user is already logged into Studio, skip the magic link round trip
+            return redirect(get_studio_url(request, next_url or '/'), permanent=False)
+
         magic_link = create_magiclink(username=username, request=request, redirect_url=next_url)
 
         url = magic_link.generate_url(request)
@@ -0,0 +1,52 @@
+"""
+Send the pending user updates of the IdP sync outbox, see `tahoe_idp.idp_sync_outbox`.
+
+Run a single instance of this command e.g. from a cron job, or with --loop-interval as a long-running worker.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from tahoe_idp.idp_sync_outbox import drain_outbox
+
+
+class Command(BaseCommand):
+    help = 'Send the pending user updates of the IdP sync outbox in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of outbox entries processed per batch.',
+        )
+        parser.add_argument(
+            '--max-attempts',
+            type=int,
+            default=5,
+            help='Number of failed attempts before giving up on an entry.',
+        )
+        parser.add_argument(
+            '--loop-interval',
+            type=int,
+            default=0,
+            help='Keep running and check the outbox every N seconds. Drain once and exit by default.',
+        )
+
+    def drain(self, options):
+        """
+        Process batches until no more entries can be sent now.
+        """
+        while True:
+            result = drain_outbox(batch_size=options['batch_size'], max_attempts=options['max_attempts'])
+            if any(result.values()):
+                self.stdout.write('Sent {sent}, retrying {retried}, failed {failed} IdP sync entries'.format(**result))
+            if not result['sent']:
+                return
+
+    def handle(self, *args, **options):
+        self.drain(options)
+        while options['loop_interval']:
+            time.sleep(options['loop_interval'])
+            self.drain(options)
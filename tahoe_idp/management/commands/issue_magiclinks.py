@@ -0,0 +1,75 @@
+"""
+Issue Studio magic links for many users in a single batch.
+
+Prints one `username,url` line per issued link.
+"""
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from tahoe_idp.magiclink_helpers import create_magiclinks
+from tahoe_idp.magiclink_storage import DatabaseMagicLinkStorage, _batches
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Issue Studio magic links for a list of usernames and print the generated URLs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Usernames to issue magic links for.')
+        parser.add_argument(
+            '--file',
+            dest='usernames_file',
+            help='Path of a file with one username per line.',
+        )
+        parser.add_argument(
+            '--redirect-url',
+            dest='redirect_url',
+            default=None,
+            help='Where to redirect the users after logging into Studio.',
+        )
+        parser.add_argument(
+            '--secure',
+            action='store_true',
+            help='Generate https:// URLs.',
+        )
+
+    def get_usernames(self, options):
+        usernames = list(options['usernames'])
+        if options['usernames_file']:
+            with open(options['usernames_file'], encoding='utf-8') as usernames_file:
+                usernames.extend(line.strip() for line in usernames_file if line.strip())
+
+        if not usernames:
+            raise CommandError('Provide usernames as arguments or with --file.')
+
+        return usernames
+
+    def handle(self, *args, **options):
+        usernames = self.get_usernames(options)
+
+        existing_usernames = set()
+        # Keep the `IN` lists under the query parameters limit of the database e.g. SQLite
+        for usernames_batch in _batches(usernames, DatabaseMagicLinkStorage.BATCH_SIZE):
+            existing_usernames.update(
+                User.objects.filter(username__in=usernames_batch).values_list('username', flat=True)
+            )
+        for username in usernames:
+            if username not in existing_usernames:
+                self.stderr.write('Skipped {username}: user does not exist'.format(username=username))
+
+        magic_links = create_magiclinks(
+            [username for username in usernames if username in existing_usernames],
+            redirect_url=options['redirect_url'],
+        )
+
+        for username in existing_usernames.difference(magic_links):
+            self.stderr.write('Skipped {username}: too many magic login requests'.format(username=username))
+
+        for username, magic_link in magic_links.items():
+            self.stdout.write('{username},{url}'.format(
+                username=username,
+                url=magic_link.generate_url(secure=options['secure']),
+            ))
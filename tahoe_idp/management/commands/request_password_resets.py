@@ -0,0 +1,120 @@
+"""
+Send password reset emails to many users at a paced rate e.g. when migrating a tenant.
+
+The IdP tenant is the one of the `--site` configuration, since the command runs outside of the site's requests.
+
+Sent emails are appended to the checkpoint file, so re-running the command after an interruption skips them.
+"""
+
+import os
+
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+
+from tahoe_idp import helpers
+from tahoe_idp.api import request_password_resets
+
+
+class Command(BaseCommand):
+    help = 'Request IdP password reset emails for a list of emails at a limited rate.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('emails', nargs='*', help='Emails to send password resets to.')
+        parser.add_argument(
+            '--site',
+            dest='site_domain',
+            required=True,
+            help='Domain of the site whose IdP tenant the users belong to.',
+        )
+        parser.add_argument(
+            '--file',
+            dest='emails_file',
+            help='Path of a file with one email per line.',
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=10,
+            help='Maximum number of password reset requests per second.',
+        )
+        parser.add_argument(
+            '--burst',
+            type=int,
+            default=1,
+            help='Maximum number of requests sent back to back.',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            dest='checkpoint_file',
+            help='Path of a file recording the sent emails, which are skipped when resuming.',
+        )
+
+    def get_emails(self, options):
+        emails = list(options['emails'])
+        if options['emails_file']:
+            with open(options['emails_file'], encoding='utf-8') as emails_file:
+                emails.extend(line.strip() for line in emails_file if line.strip())
+
+        if not emails:
+            raise CommandError('Provide emails as arguments or with --file.')
+
+        return emails
+
+    def get_site_configuration(self, site_domain):
+        try:
+            site = Site.objects.get(domain=site_domain)
+        except Site.DoesNotExist:
+            raise CommandError('Site "{domain}" does not exist.'.format(domain=site_domain))
+
+        return helpers.get_site_configuration(site)
+
+    def get_sent_emails(self, checkpoint_file):
+        if not checkpoint_file or not os.path.exists(checkpoint_file):
+            return set()
+
+        with open(checkpoint_file, encoding='utf-8') as sent_emails_file:
+            return {line.strip().lower() for line in sent_emails_file if line.strip()}
+
+    def handle(self, *args, **options):
+        emails = self.get_emails(options)
+        if options['rate'] <= 0:
+            raise CommandError('--rate must be a positive number.')
+        if options['burst'] < 1:
+            raise CommandError('--burst must be at least 1.')
+        site_configuration = self.get_site_configuration(options['site_domain'])
+
+        sent_emails = self.get_sent_emails(options['checkpoint_file'])
+        pending_emails = [email for email in emails if email.lower() not in sent_emails]
+        if sent_emails:
+            self.stdout.write('Skipping {count} emails already in the checkpoint'.format(
+                count=len(emails) - len(pending_emails),
+            ))
+
+        checkpoint = open(options['checkpoint_file'], 'a', encoding='utf-8') if options['checkpoint_file'] else None
+        try:
+            def on_result(email, succeeded):
+                if succeeded and checkpoint:
+                    checkpoint.write(email + '\n')
+                    checkpoint.flush()
+
+            result = request_password_resets(
+                pending_emails,
+                rate=options['rate'],
+                burst=options['burst'],
+                on_result=on_result,
+                site_configuration=site_configuration,
+            )
+        finally:
+            if checkpoint:
+                checkpoint.close()
+
+        for email in result['failed']:
+            self.stderr.write('Failed {email}'.format(email=email))
+
+        elapsed_seconds = result['elapsed_seconds']
+        self.stdout.write('Sent {sent} password resets, {failed} failed in {seconds:.1f}s ({rate:.1f}/s)'.format(
+            sent=len(result['sent']),
+            failed=len(result['failed']),
+            seconds=elapsed_seconds,
+            rate=len(result['sent']) / elapsed_seconds if elapsed_seconds else 0,
+        ))
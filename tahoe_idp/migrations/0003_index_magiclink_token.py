@@ -0,0 +1,18 @@
+# Generated by Django 2.2.23 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tahoe_idp', '0002_allow_null_redirect_url'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='magiclink',
+            name='token',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+    ]
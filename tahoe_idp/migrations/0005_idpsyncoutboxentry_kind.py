@@ -0,0 +1,18 @@
+# Generated by Django 2.2.23 on 2026-10-19 13:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tahoe_idp', '0004_idp_sync_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idpsyncoutboxentry',
+            name='kind',
+            field=models.CharField(choices=[('user_update', 'User update'), ('last_login', 'Last login')], default='user_update', max_length=32),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.23 on 2026-10-19 13:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0002_alter_domain_unique'),
+        ('tahoe_idp', '0005_idpsyncoutboxentry_kind'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idpsyncoutboxentry',
+            name='site',
+            field=models.ForeignKey(blank=True, help_text='Site of the user change, its configuration is used to call the IdP of the tenant', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='sites.Site'),
+        ),
+    ]
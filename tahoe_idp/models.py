@@ -1,4 +1,5 @@
-from urllib.parse import urlencode, urljoin
+from functools import lru_cache
+from urllib.parse import urlencode
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -8,8 +9,31 @@ from django.http import HttpRequest
 from django.urls import reverse
 from django.utils import timezone
 
+from tahoe_idp.magiclink_utils import get_studio_url
+
 User = get_user_model()
 
+# Columns needed to log a user in and to check their permissions in Studio
+AUTH_USER_FIELDS = (
+    'id',
+    'username',
+    'password',
+    'email',
+    'is_active',
+    'is_staff',
+    'is_superuser',
+    'last_login',
+)
+
+
+@lru_cache(maxsize=None)
+def get_auth_user_fields():
+    """
+    Get the AUTH_USER_FIELDS that exist on the configured user model.
+    """
+    model_fields = {field.name for field in User._meta.concrete_fields}
+    return tuple(field for field in AUTH_USER_FIELDS if field in model_fields)
+
 
 class MagicLinkError(Exception):
     pass
@@ -17,7 +41,7 @@ class MagicLinkError(Exception):
 
 class MagicLink(models.Model):
     username = models.CharField(max_length=254)
-    token = models.TextField()
+    token = models.CharField(max_length=255, db_index=True)
     expiry = models.DateTimeField()
     redirect_url = models.TextField(null=True)
     used = models.BooleanField(default=False)
@@ -26,7 +50,7 @@ class MagicLink(models.Model):
     def __str__(self):
         return '{username} - {expiry}'.format(username=self.username, expiry=self.expiry)
 
-    def generate_url(self, request: HttpRequest) -> str:
+    def generate_url(self, request: HttpRequest = None, secure: bool = False) -> str:
         url_path = reverse(settings.MAGICLINK_LOGIN_VERIFY_URL)
 
         params = {
@@ -36,17 +60,11 @@ class MagicLink(models.Model):
         query = urlencode(params)
 
         url_path = '{url_path}?{query}'.format(url_path=url_path, query=query)
-        scheme = request.is_secure() and 'https' or 'http'
-        url = urljoin(
-            '{scheme}://{studio_domain}'.format(scheme=scheme, studio_domain=settings.MAGICLINK_STUDIO_DOMAIN),
-            url_path
-        )
-        return url
-
-    def _validation_error(self, error_message):
-        self.used = True
-        self.save()
-        raise MagicLinkError(error_message)
+        return get_studio_url(request, url_path, secure=secure)
+
+    def _mark_used(self):
+        from tahoe_idp.magiclink_storage import get_magiclink_storage  # Avoid circular imports
+        get_magiclink_storage().mark_used(self)
 
     def get_user_with_validate(
         self,
@@ -60,11 +78,42 @@ class MagicLink(models.Model):
             raise MagicLinkError('username does not match')
 
         if timezone.now() > self.expiry:
-            self._validation_error('Magic link has expired')
+            raise MagicLinkError('Magic link has expired')
 
-        user = User.objects.get(username=self.username)
+        user = User.objects.only(*get_auth_user_fields()).get(username=self.username)
 
-        self.used = True
-        self.save()
+        self._mark_used()
 
         return user
+
+
+class IdpSyncOutboxEntry(models.Model):
+    """
+    A pending user update to be sent to the IdP by the `drain_idp_sync_outbox` command.
+
+    Entries are written in the same database transaction as the user change, so rolled back changes are never
+    sent and failed HTTP calls are retried. The site of the change is stored because the command runs outside of
+    the requests of the site.
+    """
+    KIND_USER_UPDATE = 'user_update'
+    KIND_LAST_LOGIN = 'last_login'
+    KIND_CHOICES = (
+        (KIND_USER_UPDATE, 'User update'),
+        (KIND_LAST_LOGIN, 'Last login'),
+    )
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    site = models.ForeignKey(
+        'sites.Site', null=True, blank=True, on_delete=models.CASCADE, related_name='+',
+        help_text='Site of the user change, its configuration is used to call the IdP of the tenant',
+    )
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES, default=KIND_USER_UPDATE)
+    properties = models.TextField(help_text='JSON body of the PATCH /api/user/{userId} request')
+    created_on = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_on = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    failed_on = models.DateTimeField(null=True, blank=True, help_text='Set when the entry is given up on')
+
+    def __str__(self):
+        return '{user_id} - {created_on}'.format(user_id=self.user_id, created_on=self.created_on)
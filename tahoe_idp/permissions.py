@@ -1,7 +1,21 @@
 """
 Permissions constants and utils for the tahoe-idp backend.
+
+Roles are mapped to capability bitmasks in a role registry, so all the permission flags of a user are computed
+with a single lookup per role. A user can have several roles by setting `user.data.platform_role` to a list.
 """
 
+import logging
+from types import MappingProxyType
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from tahoe_idp.settings_cache import cached_until_setting_changed
+
+
+log = logging.getLogger(__name__)
+
 
 IDP_ORG_ADMIN_ROLE = 'administrator'
 IDP_STUDIO_ROLE = 'staff'
@@ -12,32 +26,105 @@ IDP_DEFAULT_ROLE = 'learner'
 METADATE_ROLE_FIELD = 'platform_role'
 
 
+# Organization admin rights and API access
+CAPABILITY_ORGANIZATION_ADMIN = 1 << 0
+# Open edX Studio access with org-wide rights
+CAPABILITY_ORGANIZATION_STAFF = 1 << 1
+# Open edX Studio access with no org-wide rights
+CAPABILITY_COURSE_AUTHOR = 1 << 2
+
+CAPABILITIES = MappingProxyType({
+    'organization_admin': CAPABILITY_ORGANIZATION_ADMIN,
+    'organization_staff': CAPABILITY_ORGANIZATION_STAFF,
+    'course_author': CAPABILITY_COURSE_AUTHOR,
+})
+
+ROLE_CAPABILITIES = MappingProxyType({
+    IDP_ORG_ADMIN_ROLE: CAPABILITY_ORGANIZATION_ADMIN | CAPABILITY_ORGANIZATION_STAFF,
+    IDP_STUDIO_ROLE: CAPABILITY_ORGANIZATION_STAFF,
+    IDP_COURSE_AUTHOR: CAPABILITY_COURSE_AUTHOR,
+    IDP_DEFAULT_ROLE: 0,
+})
+
+
+@cached_until_setting_changed('TAHOE_IDP_EXTRA_ROLES')
+def get_role_registry():
+    """
+    Get the role to capabilities mapping: built-in roles plus the ones in `settings.TAHOE_IDP_EXTRA_ROLES`.
+
+    The read-only registry is built on first use rather than at import, so importing the module doesn't read
+    settings that the Open edX plugin settings may still be changing, and tests can override the setting.
+
+    TAHOE_IDP_EXTRA_ROLES maps role names to lists of capability names, for example:
+        {"observer": ["course_author"]}
+    """
+    registry = dict(ROLE_CAPABILITIES)
+    for role, capability_names in getattr(settings, 'TAHOE_IDP_EXTRA_ROLES', {}).items():
+        capabilities = 0
+        for capability_name in capability_names:
+            if capability_name not in CAPABILITIES:
+                raise ImproperlyConfigured('Unknown capability "{capability}" for role "{role}" in '
+                                           '`TAHOE_IDP_EXTRA_ROLES`'.format(capability=capability_name, role=role))
+            capabilities |= CAPABILITIES[capability_name]
+        registry[role.lower()] = capabilities
+    return MappingProxyType(registry)
+
+
+def get_capabilities(roles):
+    """
+    Get the combined capabilities bitmask of a role or a list of roles. Unknown roles have no capabilities.
+
+    Roles that aren't strings e.g. `null` in the IdP data are ignored.
+    """
+    if not isinstance(roles, (list, tuple)):
+        roles = [roles]
+
+    registry = get_role_registry()
+    capabilities = 0
+    for role in roles:
+        if not isinstance(role, str):
+            log.warning('Ignoring the IdP role {role!r} which is not a string'.format(role=role))
+            continue
+        capabilities |= registry.get(role.lower(), 0)
+    return capabilities
+
+
+def get_capability_flags(capabilities):
+    """
+    Get the permission flags of a capabilities bitmask.
+    """
+    return {
+        'is_organization_admin': bool(capabilities & CAPABILITY_ORGANIZATION_ADMIN),
+        'is_organization_staff': bool(capabilities & CAPABILITY_ORGANIZATION_STAFF),
+        'is_course_author': bool(capabilities & CAPABILITY_COURSE_AUTHOR),
+    }
+
+
 def is_organization_admin(role):
     """
     Checks if organization admin, which grants admin rights and API access.
     """
-    role = role.lower()
-    return role == IDP_ORG_ADMIN_ROLE
+    return bool(get_capabilities(role) & CAPABILITY_ORGANIZATION_ADMIN)
 
 
 def is_organization_staff(role):
     """
     Check if the role has Staff access which grants access to Open edX Studio.
     """
-    role = role.lower()
-    return role == IDP_STUDIO_ROLE or is_organization_admin(role)
+    return bool(get_capabilities(role) & CAPABILITY_ORGANIZATION_STAFF)
 
 
 def is_course_author(role):
     """
     Check if the role has Studio access which grants access to Open edX Studio but no org-wide access.
     """
-    role = role.lower()
-    return role == IDP_COURSE_AUTHOR
+    return bool(get_capabilities(role) & CAPABILITY_COURSE_AUTHOR)
 
 
 def get_role_with_default(user_data):
     """
     Helper to get role from `user.data.platform_role` and default to Learner.
+
+    The role may be a single role string or a list of roles.
     """
-    return user_data.get(METADATE_ROLE_FIELD, IDP_DEFAULT_ROLE)
+    return user_data.get(METADATE_ROLE_FIELD) or IDP_DEFAULT_ROLE
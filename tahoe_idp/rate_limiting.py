@@ -0,0 +1,186 @@
+"""
+Rate limiting utils for paced bulk calls to the IdP.
+
+`TokenBucket` paces the calls of a single process. `ClusterRateLimiter` counts the calls of all the workers
+sharing the Django cache, and is applied to every FusionAuth call by `api_client.TahoeIdpApiClient` with separate
+budgets for interactive and batch traffic, see `settings.TAHOE_IDP_API_RATE_LIMITS`.
+"""
+
+import contextlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from tahoe_idp.settings_cache import cached_until_setting_changed
+
+
+log = logging.getLogger(__name__)
+
+TRAFFIC_INTERACTIVE = 'interactive'
+TRAFFIC_BATCH = 'batch'
+
+# Interactive calls e.g. logins go ahead over the budget rather than holding a request thread for longer
+INTERACTIVE_MAX_WAIT_SECONDS = 1
+
+_traffic = threading.local()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing `rate` calls per second with bursts of up to `capacity` calls.
+    """
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError('The rate must be a positive number')
+        if capacity < 1:
+            raise ValueError('The capacity must be at least 1')
+
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.updated_at = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self):
+        """
+        Take a token if one is available.
+
+        :return: <True> if a token was taken, <False> otherwise.
+        """
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        """
+        Take a token, waiting until one is available.
+        """
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            self.sleep(wait_seconds)
+
+
+class ClusterRateLimiter:
+    """
+    Allow `limit` calls per `window` seconds across all the processes sharing the Django cache.
+
+    Calls are counted in fixed windows with the atomic `cache.add()` and `cache.incr()`, which are supported by
+    Redis and Memcached.
+
+    `acquire()` waits for at most `max_wait` seconds if set, since a waiting call can lose the race for the next
+    windows to the other workers indefinitely.
+    """
+
+    def __init__(self, name, limit, window=1, max_wait=None, clock=time.time, sleep=time.sleep):
+        if limit < 1:
+            raise ValueError('The limit must be at least 1')
+        if window <= 0:
+            raise ValueError('The window must be a positive number')
+        if max_wait is not None and max_wait < 0:
+            raise ValueError('The max wait must not be negative')
+
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.max_wait = max_wait
+        self.clock = clock
+        self.sleep = sleep
+
+    def _get_cache_key(self, window_index):
+        return 'tahoe_idp.rate_limiting.{name}.{window_index}'.format(name=self.name, window_index=window_index)
+
+    def _count_call(self, cache_key):
+        # Expire the counter once its window is over, the extra window covers clock differences between workers
+        timeout = int(self.window * 2) + 1
+        if cache.add(cache_key, 1, timeout=timeout):
+            return 1
+        try:
+            return cache.incr(cache_key)
+        except ValueError:
+            # The counter expired between `add()` and `incr()`
+            cache.add(cache_key, 1, timeout=timeout)
+            return 1
+
+    def try_acquire(self):
+        """
+        Count a call if the budget of the current window isn't used up.
+
+        :return: <True> if the call is allowed, <False> otherwise.
+        """
+        window_index = int(self.clock() // self.window)
+        return self._count_call(self._get_cache_key(window_index)) <= self.limit
+
+    def acquire(self):
+        """
+        Count a call, waiting for the next windows until the budget allows it or `max_wait` is over.
+
+        :return: <True> if the call is allowed, <False> if the budget is still used up after `max_wait`.
+        """
+        deadline = None if self.max_wait is None else self.clock() + self.max_wait
+        while not self.try_acquire():
+            now = self.clock()
+            if deadline is not None and now >= deadline:
+                return False
+            wait_seconds = (now // self.window + 1) * self.window - now
+            if deadline is not None:
+                wait_seconds = min(wait_seconds, deadline - now)
+            self.sleep(wait_seconds)
+        return True
+
+
+def get_traffic():
+    """
+    Get the traffic class of the current thread, `TRAFFIC_BATCH` inside `batch_traffic()`.
+    """
+    return getattr(_traffic, 'value', TRAFFIC_INTERACTIVE)
+
+
+@contextlib.contextmanager
+def batch_traffic():
+    """
+    Mark the IdP API clients created in the block as batch traffic, which has its own rate limit budget.
+
+    The traffic class is captured when the client is created, so clients shared with worker threads keep it.
+    """
+    previous_traffic = get_traffic()
+    _traffic.value = TRAFFIC_BATCH
+    try:
+        yield
+    finally:
+        _traffic.value = previous_traffic
+
+
+@cached_until_setting_changed('TAHOE_IDP_API_RATE_LIMITS')
+def get_api_rate_limiter(traffic):
+    """
+    Get the cluster-wide rate limiter of a traffic class, or None if it's not limited.
+
+    Interactive calls wait for at most `INTERACTIVE_MAX_WAIT_SECONDS`, batch calls until the budget allows them.
+
+    TAHOE_IDP_API_RATE_LIMITS maps the traffic classes to their number of calls per second, for example:
+        {"interactive": 80, "batch": 20}
+    """
+    limit = getattr(settings, 'TAHOE_IDP_API_RATE_LIMITS', {}).get(traffic)
+    if not limit:
+        return None
+    max_wait = INTERACTIVE_MAX_WAIT_SECONDS if traffic == TRAFFIC_INTERACTIVE else None
+    return ClusterRateLimiter('api.{traffic}'.format(traffic=traffic), limit, max_wait=max_wait)
@@ -2,9 +2,84 @@
 Signal receivers for tahoe-idp Django app.
 """
 
+import logging
+import threading
+
 from django.contrib.auth.models import User
+from django.db import transaction
+
+from . import api, constants, helpers, idp_sync_outbox
+from .magiclink_backends import invalidate_user_cache
+from .magiclink_helpers import invalidate_studio_permission_cache, revoke_studio_session_marker
+
+
+log = logging.getLogger(__name__)
+
+# Syncs waiting for the current transaction to commit, per thread: {user_id: PendingUserSync}
+_pending_user_syncs = threading.local()
+
+
+class PendingUserSync:
+    """
+    The IdP changes of a user accumulated during a transaction, sent once when it's committed.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.user_update_dict = {}
+        self.outbox_entry = None
+
+    def __call__(self):
+        """
+        The `on_commit` callback.
+        """
+        pending_user_syncs = _get_pending_user_syncs()
+        if pending_user_syncs.get(self.user.pk) is self:
+            del pending_user_syncs[self.user.pk]
+
+        if self.outbox_entry is None:
+            try:
+                api.update_user(self.user, {
+                        'user': self.user_update_dict
+                    }
+                )
+            except Exception:
+                # The change is already committed, and raising would skip the `on_commit` callbacks of other apps
+                log.exception('Could not sync the changes of user {user_id} to the IdP'.format(user_id=self.user.pk))
+
+    def is_registered(self):
+        """
+        Check if the callback is still waiting for the commit, it's dropped if the transaction is rolled back.
+        """
+        connection = transaction.get_connection()
+        # The entries hold the savepoint ids and the callback, and more in later Django versions
+        return any(self in run_on_commit for run_on_commit in connection.run_on_commit)
+
+
+def _get_pending_user_syncs():
+    if not hasattr(_pending_user_syncs, 'users'):
+        _pending_user_syncs.users = {}
+    return _pending_user_syncs.users
+
+
+def _get_pending_user_sync(user):
+    """
+    Get the sync of the user waiting for the current transaction to commit, or None.
+
+    Syncs whose callback was dropped by a rollback are forgotten, so they don't stay in the thread for its lifetime.
+    """
+    pending_user_syncs = _get_pending_user_syncs()
+    if not transaction.get_connection().run_on_commit:
+        # No callback waits for a commit e.g. outside of a transaction, so the remaining syncs were rolled back
+        pending_user_syncs.clear()
+        return None
 
-from . import api, constants, helpers
+    pending_sync = pending_user_syncs.get(user.pk)
+    if pending_sync is not None and not pending_sync.is_registered():
+        # Dropped by the rollback of a savepoint
+        del pending_user_syncs[user.pk]
+        return None
+    return pending_sync
 
 
 def user_sync_to_idp(sender, instance, **kwargs):
@@ -15,6 +90,9 @@ def user_sync_to_idp(sender, instance, **kwargs):
 
     We want to keep the user record in the IdP up to date with any changes made via
     Account Settings, Django admin, or otherwise.
+
+    The changes are sent once when the transaction is committed, so saving a user several times in a transaction
+    results in a single IdP update with the final state, and rolled back changes are never sent.
     """
 
     # Not necessary to sync if just created.  Already in sync.
@@ -34,8 +112,44 @@ def user_sync_to_idp(sender, instance, **kwargs):
 
     if user_update_dict:
         user = instance if sender == User else instance.user
-        # will raise an Exception from raise_for_status if failure code
-        api.update_user(user, {
-                'user': user_update_dict
+        pending_sync = _get_pending_user_sync(user)
+        is_new_sync = pending_sync is None
+        if is_new_sync:
+            pending_sync = PendingUserSync(user)
+            _get_pending_user_syncs()[user.pk] = pending_sync
+
+        pending_sync.user_update_dict.update(user_update_dict)
+
+        if idp_sync_outbox.is_outbox_enabled():
+            # Sent by the `drain_idp_sync_outbox` command, only if the current transaction is committed
+            properties = {
+                'user': pending_sync.user_update_dict
             }
-        )
+            if pending_sync.outbox_entry is None:
+                pending_sync.outbox_entry = idp_sync_outbox.enqueue_user_update(user, properties)
+            else:
+                idp_sync_outbox.update_enqueued_user_update(pending_sync.outbox_entry, properties)
+
+        if is_new_sync:
+            # Runs immediately when not in a transaction
+            transaction.on_commit(pending_sync)
+
+
+def invalidate_magiclink_user_cache(sender, instance, **kwargs):
+    """
+    Drop the cached user of `MagicLinkBackend.get_user` and the cached Studio permission verdicts
+    when the user is saved or deleted.
+
+    Handles post_save and post_delete Signals from User
+    """
+    invalidate_user_cache(instance.pk)
+    invalidate_studio_permission_cache(instance.pk)
+
+
+def invalidate_studio_session_marker(sender, request, user, **kwargs):
+    """
+    Revoke the Studio session marker on logout, so Studio logins go through the magic link again.
+
+    Handles user_logged_out Signals
+    """
+    revoke_studio_session_marker(request)
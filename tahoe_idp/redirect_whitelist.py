@@ -0,0 +1,80 @@
+"""
+Precompiled matcher for `settings.LOGIN_REDIRECT_WHITELIST`.
+
+Entries are either exact hosts (e.g. "example.com") or wildcards matching any subdomain (e.g. "*.example.com").
+The whitelist is compiled once into a hash set for exact hosts and a suffix trie of domain labels for wildcards,
+so checking a host doesn't depend on the number of whitelisted entries.
+"""
+
+
+from django.conf import settings
+
+from tahoe_idp.settings_cache import cached_until_setting_changed
+
+
+# Marks a trie node that ends a wildcard entry
+_WILDCARD = object()
+
+
+class RedirectWhitelist:
+    """
+    Match hosts against exact and wildcard whitelist entries.
+    """
+
+    def __init__(self, entries):
+        self.exact_hosts = set()
+        self.wildcard_trie = {}
+
+        for entry in entries:
+            entry = entry.lower()
+            if entry.startswith('*.'):
+                node = self.wildcard_trie
+                for label in reversed(entry[2:].split('.')):
+                    node = node.setdefault(label, {})
+                node[_WILDCARD] = True
+            else:
+                self.exact_hosts.add(entry)
+
+    def __contains__(self, host):
+        host = host.lower()
+        if host in self.exact_hosts:
+            return True
+
+        labels = host.split('.')
+        node = self.wildcard_trie
+        # Walk the labels from the top-level domain, a wildcard needs at least one more label to match
+        for label in reversed(labels[1:]):
+            node = node.get(label)
+            if node is None:
+                return False
+            if _WILDCARD in node:
+                return True
+
+        return False
+
+    def allowed_hosts(self, request_host):
+        """
+        Get a container of the whitelisted hosts plus the request host, to be used with `is_safe_url`.
+        """
+        return _AllowedHosts(self, request_host)
+
+
+class _AllowedHosts:
+    """
+    The whitelist plus the originating host of the request.
+    """
+
+    def __init__(self, whitelist, request_host):
+        self.whitelist = whitelist
+        self.request_host = request_host
+
+    def __contains__(self, host):
+        return host == self.request_host or host in self.whitelist
+
+
+@cached_until_setting_changed('LOGIN_REDIRECT_WHITELIST')
+def get_redirect_whitelist():
+    """
+    Get the compiled LOGIN_REDIRECT_WHITELIST.
+    """
+    return RedirectWhitelist(getattr(settings, 'LOGIN_REDIRECT_WHITELIST', []))
@@ -10,7 +10,7 @@ def magiclink_settings(settings):
     Set MagicLink specific settings:
 
     MAGICLINK_LOGIN_FAILED_REDIRECT: where to redirect when the magic-link login fails
-    MAGICLINK_TOKEN_LENGTH: number of characters used to create a random token for the user
+    MAGICLINK_TOKEN_LENGTH: number of characters used to create a random token for the user, between 20 and 255
     MAGICLINK_AUTH_TIMEOUT: seconds for the generated magic-link before it becomes expired
     MAGICLINK_LOGIN_REQUEST_TIME_LIMIT: seconds to pass before allowing to generate a new magic-link for the same user
     MAGICLINK_LOGIN_VERIFY_URL: URL to be used to verify the validity of the magic-link. Keep it on default
@@ -18,11 +18,34 @@ def magiclink_settings(settings):
     MAGICLINK_STUDIO_DOMAIN: Studio domain to be used by magic-link views
     MAGICLINK_STUDIO_PERMISSION_METHOD: path of the method to be used to check if the user is permitted to use
         magic-links to studio or not. The path must be in the form: "module.submodule:method". It should also be in
-        the form: def method(user)
+        the form: def method(user). The method is resolved at startup and `ImproperlyConfigured` is raised if it
+        can't be imported
+    MAGICLINK_STUDIO_PERMISSION_CACHE_TIMEOUT: seconds to cache the verdicts of MAGICLINK_STUDIO_PERMISSION_METHOD
+        per user. Use 0 to disable the cache
+    MAGICLINK_STORAGE_BACKEND: path of the class used to store magic-links in the form "module.submodule:Class".
+        Use "tahoe_idp.magiclink_storage:CacheMagicLinkStorage" to keep magic-links in the cache instead of the database
+    MAGICLINK_STORAGE_CACHE: name of the Django cache used by the cache storage backend
+    MAGICLINK_STUDIO_SESSION_COOKIE_DOMAIN: domain shared by LMS and Studio (e.g. ".example.com") for the signed
+        cookie that marks an existing Studio session. Studio logins skip the magic-link when the marker is valid.
+        Leave it empty to always go through the magic-link
+    MAGICLINK_STUDIO_SESSION_COOKIE_NAME: name of the Studio session marker cookie
+    MAGICLINK_STUDIO_SESSION_COOKIE_AGE: seconds before the Studio session marker expires, capped at
+        SESSION_COOKIE_AGE. The marker is also revoked on logout
+    MAGICLINK_GET_USER_CACHE_TIMEOUT: seconds to cache the user loaded by MagicLinkBackend on every Studio request.
+        Use 0 to disable the cache
+    MAGICLINK_VERIFY_FAILURE_LIMIT: failed magic-link verifications allowed per client IP within
+        MAGICLINK_VERIFY_FAILURE_WINDOW before further verifications are rejected from the cache. Disabled with 0,
+        the default. Set MAGICLINK_VERIFY_CLIENT_IP_HEADER first when running behind a load balancer
+    MAGICLINK_VERIFY_CLIENT_IP_HEADER: request.META key of the client IP e.g. "HTTP_X_FORWARDED_FOR"
+    MAGICLINK_VERIFY_TRUSTED_PROXY_COUNT: number of proxies appending to MAGICLINK_VERIFY_CLIENT_IP_HEADER after
+        the one that saw the client, the client IP is read from the right of the header skipping their entries
+    MAGICLINK_VERIFY_FAILURE_WINDOW: seconds during which failed verifications are counted
+    MAGICLINK_REJECTED_TOKEN_CACHE_TIMEOUT: seconds to remember rejected tokens and reject them from the cache
     """
     settings.MAGICLINK_LOGIN_FAILED_REDIRECT = getattr(settings, 'MAGICLINK_LOGIN_FAILED_REDIRECT', '')
 
     minimum_token_length = 20
+    maximum_token_length = 255  # MagicLink.token max_length
     default_token_length = 50
 
     try:
@@ -30,7 +53,7 @@ def magiclink_settings(settings):
     except ValueError:
         raise ImproperlyConfigured('"MAGICLINK_TOKEN_LENGTH" must be an integer')
 
-    settings.MAGICLINK_TOKEN_LENGTH = max(token_length, minimum_token_length)
+    settings.MAGICLINK_TOKEN_LENGTH = min(max(token_length, minimum_token_length), maximum_token_length)
 
     try:
         # In seconds
@@ -48,3 +71,41 @@ def magiclink_settings(settings):
     settings.MAGICLINK_STUDIO_DOMAIN = getattr(settings, 'MAGICLINK_STUDIO_DOMAIN', 'studio.example.com')
 
     settings.MAGICLINK_STUDIO_PERMISSION_METHOD = getattr(settings, 'MAGICLINK_STUDIO_PERMISSION_METHOD', None)
+
+    settings.MAGICLINK_STORAGE_BACKEND = getattr(
+        settings, 'MAGICLINK_STORAGE_BACKEND', 'tahoe_idp.magiclink_storage:DatabaseMagicLinkStorage',
+    )
+
+    settings.MAGICLINK_STORAGE_CACHE = getattr(settings, 'MAGICLINK_STORAGE_CACHE', 'default')
+
+    settings.MAGICLINK_STUDIO_SESSION_COOKIE_DOMAIN = getattr(settings, 'MAGICLINK_STUDIO_SESSION_COOKIE_DOMAIN', None)
+
+    settings.MAGICLINK_STUDIO_SESSION_COOKIE_NAME = getattr(
+        settings, 'MAGICLINK_STUDIO_SESSION_COOKIE_NAME', 'tahoe_idp_studio_session',
+    )
+
+    try:
+        settings.MAGICLINK_STUDIO_SESSION_COOKIE_AGE = int(
+            getattr(settings, 'MAGICLINK_STUDIO_SESSION_COOKIE_AGE', 3600)
+        )
+    except ValueError:
+        raise ImproperlyConfigured('"MAGICLINK_STUDIO_SESSION_COOKIE_AGE" must be an integer')
+
+    settings.MAGICLINK_VERIFY_CLIENT_IP_HEADER = getattr(settings, 'MAGICLINK_VERIFY_CLIENT_IP_HEADER', 'REMOTE_ADDR')
+
+    try:
+        settings.MAGICLINK_GET_USER_CACHE_TIMEOUT = int(getattr(settings, 'MAGICLINK_GET_USER_CACHE_TIMEOUT', 0))
+    except ValueError:
+        raise ImproperlyConfigured('"MAGICLINK_GET_USER_CACHE_TIMEOUT" must be an integer')
+
+    for setting_name, default_value in (
+        ('MAGICLINK_VERIFY_FAILURE_LIMIT', 0),
+        ('MAGICLINK_VERIFY_FAILURE_WINDOW', 300),
+        ('MAGICLINK_VERIFY_TRUSTED_PROXY_COUNT', 0),
+        ('MAGICLINK_REJECTED_TOKEN_CACHE_TIMEOUT', 60),
+        ('MAGICLINK_STUDIO_PERMISSION_CACHE_TIMEOUT', 0),
+    ):
+        try:
+            setattr(settings, setting_name, int(getattr(settings, setting_name, default_value)))
+        except ValueError:
+            raise ImproperlyConfigured('"{}" must be an integer'.format(setting_name))
@@ -0,0 +1,27 @@
+"""
+Process-wide caching of objects built from Django settings e.g. compiled whitelists or resolved callables.
+"""
+
+from functools import lru_cache
+
+from django.core.signals import setting_changed
+
+
+def cached_until_setting_changed(*setting_names):
+    """
+    Cache the results of a function for the process, until one of `setting_names` is changed.
+
+    Settings only change at runtime in tests e.g. with `override_settings`, which sends `setting_changed`.
+    The decorated function keeps the `cache_clear()` of `lru_cache`.
+    """
+    def decorator(func):
+        cached_func = lru_cache(maxsize=None)(func)
+
+        def clear_cache(setting, **kwargs):
+            if setting in setting_names:
+                cached_func.cache_clear()
+
+        setting_changed.connect(clear_cache, weak=False)
+        return cached_func
+
+    return decorator
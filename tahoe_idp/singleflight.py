@@ -0,0 +1,66 @@
+"""
+In-process de-duplication of concurrent identical calls, after Go's `golang.org/x/sync/singleflight`.
+
+Threads calling `Group.do` with the same key while a call is in flight wait for it and share its result,
+so a burst of identical reads e.g. from several tabs resuming the login pipeline makes a single IdP request.
+"""
+
+import threading
+
+
+class _Call:
+    """
+    An in-flight call and its outcome.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0
+        self.result = None
+        self.exception = None
+
+
+class Group:
+    """
+    A namespace of keys whose concurrent calls are de-duplicated.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Call `fn(*args, **kwargs)` unless a call with the same key is in flight, in which case wait for its outcome.
+
+        Exceptions of the call are raised in all the waiting threads.
+
+        :return: (result, shared) where `shared` is <True> if the result is also returned to other threads.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.waiters += 1
+
+        if not is_leader:
+            call.done.wait()
+            if call.exception is not None:
+                raise call.exception
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as exc:
+            call.exception = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        # No thread can join the call after it's removed from `_calls`
+        return call.result, call.waiters > 0
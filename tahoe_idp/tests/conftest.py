@@ -2,11 +2,16 @@
 Pytest helpers.
 """
 
+from importlib import import_module
+
 import pytest
 
+from django.core.cache import cache
 from site_config_client.openedx.test_helpers import override_site_config
 
+import tahoe_idp
 import tahoe_idp.helpers
+from tahoe_idp.apps import TahoeIdpConfig
 
 MOCK_TENANT_ID = '479d8c4e-d441-11ec-8ebb-6f8318ddff9a'
 MOCK_CLIENT_ID = 'a-key'
@@ -14,12 +19,22 @@ MOCK_CLIENT_SECRET = 'a-secret-key'
 MOCK_DEFAULT_IDP_HINT = '6f60f5bb-82e5-41a1-911d-7a4cd94810f5'
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """
+    Start every test with an empty cache, so cached magic links and API results don't leak between tests.
+    """
+    cache.clear()
+    yield
+    cache.clear()
+
+
 @pytest.fixture(scope='function')
 def mock_tahoe_idp_settings(monkeypatch, settings):
     """
     Mock configs to enable Tahoe IdP and set TAHOE_IDP_CONFIGS.
     """
-    def mock_is_tahoe_idp_enabled():
+    def mock_is_tahoe_idp_enabled(site_configuration=None):
         """Mock for `is_tahoe_idp_enabled` to return always True."""
         return True
 
@@ -51,3 +66,33 @@ def mock_tahoe_idp_api_settings(test_func, add_idp_hint=False):
 
 def mock_tahoe_idp_api_settings_with_idp_hint(test_func):
     return mock_tahoe_idp_api_settings(test_func=test_func, add_idp_hint=True)
+
+
+@pytest.fixture
+def lms_signal_receivers():
+    """
+    Connect the receivers of the LMS `signals_config` like the Open edX plugin manager does.
+
+    Receivers of senders that only exist in Open edX, e.g. `UserProfile`, are skipped.
+    """
+    signals_config = TahoeIdpConfig.plugin_app['signals_config']['lms.djangoapp']
+    receivers_module = import_module('{}.{}'.format(tahoe_idp.__name__, signals_config['relative_path']))
+    connected = []
+    for receiver_config in signals_config['receivers']:
+        signal_module_path, signal_name = receiver_config['signal_path'].rsplit('.', 1)
+        signal = getattr(import_module(signal_module_path), signal_name)
+        sender = None
+        if 'sender_path' in receiver_config:
+            sender_module_path, sender_name = receiver_config['sender_path'].rsplit('.', 1)
+            try:
+                sender = getattr(import_module(sender_module_path), sender_name)
+            except ImportError:
+                continue
+        receiver = getattr(receivers_module, receiver_config['receiver_func_name'])
+        signal.connect(receiver, sender=sender, weak=False)
+        connected.append((signal, receiver, sender))
+
+    yield
+
+    for signal, receiver, sender in connected:
+        signal.disconnect(receiver, sender=sender)
@@ -2,9 +2,11 @@
 Tests for the external `api` helpers module.
 """
 from datetime import datetime
+import re
 
 import pytest
 from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
 from django.core.exceptions import MultipleObjectsReturned
 from requests import HTTPError
 from social_django.models import UserSocialAuth
@@ -12,14 +14,19 @@ from unittest.mock import patch
 
 from tahoe_idp.api import (
     deactivate_user,
+    deactivate_users,
+    get_idp_permission_flags,
     get_logout_url,
     get_tahoe_idp_id_by_user,
+    iter_idp_users,
     request_password_reset,
+    request_password_resets,
     update_tahoe_user_id,
     update_user,
     update_user_email,
 )
 from tahoe_idp.constants import BACKEND_NAME
+from tahoe_idp.helpers import cache_idp_user, get_idp_user_cache_key
 
 
 from .conftest import mock_tahoe_idp_api_settings
@@ -98,6 +105,32 @@ def test_password_reset_helper_unauthorized(requests_mock):
         request_password_reset('someone@example.com')
 
 
+@patch('tahoe_idp.api.TokenBucket')
+@patch('tahoe_idp.api.request_password_reset')
+def test_request_password_resets(mock_reset, mock_bucket):
+    """
+    Emails are deduplicated, paced by the token bucket and failures are reported.
+    """
+    mock_reset.side_effect = [None, HTTPError('501 Server Error'), None]
+    results = []
+
+    result = request_password_resets(
+        ['a@example.com', 'b@example.com', 'A@example.com ', '', 'c@example.com'],
+        rate=5,
+        burst=2,
+        on_result=lambda email, succeeded: results.append((email, succeeded)),
+        site_configuration='site-configuration',
+    )
+
+    mock_bucket.assert_called_once_with(rate=5, capacity=2)
+    assert mock_bucket.return_value.acquire.call_count == 3
+    assert result['sent'] == ['a@example.com', 'c@example.com']
+    assert result['failed'] == ['b@example.com']
+    assert result['elapsed_seconds'] >= 0
+    assert results == [('a@example.com', True), ('b@example.com', False), ('c@example.com', True)]
+    assert {call[1]['site_configuration'] for call in mock_reset.call_args_list} == {'site-configuration'}
+
+
 def test_get_tahoe_idp_id_by_user():
     """
     Tests for `get_tahoe_idp_id_by_user` validation and errors.
@@ -132,6 +165,44 @@ def test_get_tahoe_idp_id_by_user_two_idp_ids():
         get_tahoe_idp_id_by_user(user=user_with_two_ids)
 
 
+def test_get_idp_permission_flags(django_assert_num_queries):
+    """
+    Ensure the flags are read from `UserSocialAuth.extra_data` once and then cached.
+    """
+    user, social = user_with_social_factory(social_uid='bd7793e40ca2d0ca')
+    social.extra_data = {'tahoe_idp_capabilities': 3, 'tahoe_idp_data_version': 1634567890123}
+    social.save()
+
+    expected_flags = {
+        'is_organization_admin': True,
+        'is_organization_staff': True,
+        'is_course_author': False,
+        'capabilities': 3,
+        'data_version': 1634567890123,
+    }
+    with django_assert_num_queries(1):
+        assert get_idp_permission_flags(user) == expected_flags
+        assert get_idp_permission_flags(user) == expected_flags, 'Should be cached'
+
+
+def test_get_idp_permission_flags_not_stored(django_assert_num_queries):
+    """
+    Ensure users without stored flags get None, and the miss is cached too.
+    """
+    assert get_idp_permission_flags(None) is None
+    assert get_idp_permission_flags(AnonymousUser()) is None
+
+    user_without_idp_id = user_factory()
+    user_with_old_login, _social = user_with_social_factory(social_uid='bd7793e40ca2d0ca', user_kwargs={
+        'username': 'old_login',
+    })
+
+    with django_assert_num_queries(2):
+        assert get_idp_permission_flags(user_without_idp_id) is None
+        assert get_idp_permission_flags(user_with_old_login) is None, 'Logged in before the flags were stored'
+        assert get_idp_permission_flags(user_without_idp_id) is None
+
+
 @mock_tahoe_idp_api_settings
 def test_update_user_helper(requests_mock):
     """
@@ -152,6 +223,20 @@ def test_update_user_helper(requests_mock):
     assert response.status_code == 200, 'should succeed: {}'.format(response.content.decode('utf-8'))
 
 
+@mock_tahoe_idp_api_settings
+def test_update_user_invalidates_cached_idp_user(requests_mock):
+    """
+    The cached FusionAuth user record is dropped after a local write.
+    """
+    user_uuid = 'c80f5080-d50c-11ec-b5e5-5b30b2c6a1d9'
+    requests_mock.patch('https://domain/api/user/{user_uuid}'.format(user_uuid=user_uuid), text='{}')
+    user, _social = user_with_social_factory(social_uid=user_uuid)
+    cache_idp_user({'id': user_uuid, 'email': 'old_email@example.local'})
+
+    update_user(user, {'email': 'new_email@example.local'})
+    assert cache.get(get_idp_user_cache_key(user_uuid)) is None
+
+
 @mock_tahoe_idp_api_settings
 def test_failed_update_user_helper(requests_mock, caplog):
     """
@@ -247,3 +332,138 @@ def test_deactivate_user_helper(requests_mock):
     )
     response = deactivate_user(user_uuid)
     assert response.status_code == 200, 'should succeed: {}'.format(response.content.decode('utf-8'))
+
+
+@mock_tahoe_idp_api_settings
+def test_iter_idp_users(requests_mock):
+    """
+    Users are fetched page by page and yielded as compact records.
+    """
+    search_mock = requests_mock.post('https://domain/api/user/search', [
+        {'json': {'total': 3, 'users': [
+            {'id': 'id-1', 'email': 'a@example.com', 'username': 'a', 'tenantId': 'tenant', 'insertInstant': 10},
+            {'id': 'id-2', 'email': 'b@example.com', 'username': 'b', 'tenantId': 'tenant', 'insertInstant': 20},
+        ]}},
+        {'json': {'total': 1, 'users': [
+            {'id': 'id-3', 'email': 'c@example.com', 'username': 'c', 'tenantId': 'tenant', 'insertInstant': 30},
+        ]}},
+    ])
+
+    idp_users = iter_idp_users('data.platform_role:staff', page_size=2, fields=('id', 'username'))
+    assert not search_mock.called, 'Should be lazy'
+
+    assert list(idp_users) == [
+        {'id': 'id-1', 'username': 'a'},
+        {'id': 'id-2', 'username': 'b'},
+        {'id': 'id-3', 'username': 'c'},
+    ]
+    searches = [request.json()['search'] for request in search_mock.request_history]
+    assert [search['startRow'] for search in searches] == [0, 0]
+    assert [search['queryString'] for search in searches] == [
+        'data.platform_role:staff',
+        '(data.platform_role:staff) AND (insertInstant:{20 TO *} OR (insertInstant:20 AND id:{"id-2" TO *}))',
+    ]
+    assert searches[0]['numberOfResults'] == 2
+
+
+@mock_tahoe_idp_api_settings
+def test_iter_idp_users_past_results_window(requests_mock):
+    """
+    Users past the 10,000 results window of Elasticsearch are fetched too.
+    """
+    all_idp_users = [
+        # Users created in the same millisecond are ordered by id
+        {'id': 'id-{:05d}'.format(i), 'insertInstant': 1000 + i // 3} for i in range(10500)
+    ]
+    after_last_user = re.compile(r'insertInstant:\{(\d+) TO \*\} OR \(insertInstant:\d+ AND id:\{"(.+)" TO \*\}\)')
+
+    def search(request, context):
+        search = request.json()['search']
+        if search['startRow'] + search['numberOfResults'] > 10000:
+            context.status_code = 400
+            return {'generalErrors': [{'code': '[QueryTooLarge]'}]}
+        idp_users = all_idp_users
+        match = after_last_user.search(search['queryString'])
+        if match:
+            last_sort_key = (int(match.group(1)), match.group(2))
+            idp_users = [
+                idp_user for idp_user in idp_users if (idp_user['insertInstant'], idp_user['id']) > last_sort_key
+            ]
+        start_row = search['startRow']
+        return {'total': len(idp_users), 'users': idp_users[start_row:start_row + search['numberOfResults']]}
+
+    search_mock = requests_mock.post('https://domain/api/user/search', json=search)
+
+    idp_users = list(iter_idp_users(page_size=1000, fields=('id',)))
+    assert idp_users == [{'id': idp_user['id']} for idp_user in all_idp_users]
+    assert search_mock.call_count == 11
+
+
+@mock_tahoe_idp_api_settings
+def test_iter_idp_users_empty(requests_mock):
+    search_mock = requests_mock.post('https://domain/api/user/search', json={'total': 0})
+    assert list(iter_idp_users()) == []
+    assert search_mock.call_count == 1
+
+
+@mock_tahoe_idp_api_settings
+def test_iter_idp_users_error(requests_mock):
+    requests_mock.post('https://domain/api/user/search', status_code=401, text='unauthorized')
+    with pytest.raises(HTTPError, match='401 Client Error'):
+        list(iter_idp_users())
+
+
+@mock_tahoe_idp_api_settings
+def test_deactivate_users_bulk(requests_mock):
+    """
+    Users are deactivated in chunks with the bulk endpoint, missing ids are reported as failed.
+    """
+    bulk_mock = requests_mock.delete('https://domain/api/user/bulk', [
+        {'json': {'dryRun': False, 'hardDelete': False, 'total': 2, 'userIds': ['id-1', 'id-2']}},
+        {'json': {'dryRun': False, 'hardDelete': False, 'total': 0, 'userIds': []}},
+    ])
+
+    result = deactivate_users(['id-1', 'id-2', 'id-1', 'missing-id'], chunk_size=2)
+    assert result == {
+        'succeeded': ['id-1', 'id-2'],
+        'failed': ['missing-id'],
+    }
+    assert [request.qs['userid'] for request in bulk_mock.request_history] == [['id-1', 'id-2'], ['missing-id']]
+
+
+@mock_tahoe_idp_api_settings
+def test_deactivate_users_without_bulk_endpoint(requests_mock):
+    """
+    Users are deactivated one by one when the bulk endpoint is unavailable.
+    """
+    bulk_mock = requests_mock.delete('https://domain/api/user/bulk', status_code=404)
+    requests_mock.delete('https://domain/api/user/id-1', text='')
+    requests_mock.delete('https://domain/api/user/id-2', status_code=500, text='error')
+    requests_mock.delete('https://domain/api/user/id-3', text='')
+
+    result = deactivate_users(['id-1', 'id-2', 'id-3'], chunk_size=2)
+    assert result == {
+        'succeeded': ['id-1', 'id-3'],
+        'failed': ['id-2'],
+    }
+    assert bulk_mock.call_count == 1, 'Should not retry the bulk endpoint after a 404'
+
+
+@mock_tahoe_idp_api_settings
+def test_deactivate_users_failed_chunk(requests_mock):
+    """
+    Users of a failed bulk chunk are retried one by one.
+    """
+    bulk_mock = requests_mock.delete('https://domain/api/user/bulk', [
+        {'status_code': 500, 'text': 'error'},
+        {'json': {'userIds': ['id-3']}},
+    ])
+    requests_mock.delete('https://domain/api/user/id-1', text='')
+    requests_mock.delete('https://domain/api/user/id-2', text='')
+
+    result = deactivate_users(['id-1', 'id-2', 'id-3'], chunk_size=2)
+    assert result == {
+        'succeeded': ['id-1', 'id-2', 'id-3'],
+        'failed': [],
+    }
+    assert bulk_mock.call_count == 2
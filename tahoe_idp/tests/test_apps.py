@@ -2,7 +2,13 @@
 Tests TahoeIdpConfig Open edX configuration.
 """
 
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+from unittest.mock import patch
+
+import tahoe_idp
 from tahoe_idp.apps import TahoeIdpConfig
+from tahoe_idp.redirect_whitelist import get_redirect_whitelist
 
 
 def test_app_config():
@@ -43,6 +49,20 @@ def test_app_config():
                         'signal_path': 'django.db.models.signals.post_save',
                         'sender_path': 'student.models.UserProfile',
                     },
+                    {
+                        'receiver_func_name': 'invalidate_magiclink_user_cache',
+                        'signal_path': 'django.db.models.signals.post_save',
+                        'sender_path': 'django.contrib.auth.models.User',
+                    },
+                    {
+                        'receiver_func_name': 'invalidate_magiclink_user_cache',
+                        'signal_path': 'django.db.models.signals.post_delete',
+                        'sender_path': 'django.contrib.auth.models.User',
+                    },
+                    {
+                        'receiver_func_name': 'invalidate_studio_session_marker',
+                        'signal_path': 'django.contrib.auth.signals.user_logged_out',
+                    },
                 ],
             },
             'cms.djangoapp': {
@@ -58,7 +78,75 @@ def test_app_config():
                         'signal_path': 'django.db.models.signals.post_save',
                         'sender_path': 'student.models.UserProfile',
                     },
+                    {
+                        'receiver_func_name': 'invalidate_magiclink_user_cache',
+                        'signal_path': 'django.db.models.signals.post_save',
+                        'sender_path': 'django.contrib.auth.models.User',
+                    },
+                    {
+                        'receiver_func_name': 'invalidate_magiclink_user_cache',
+                        'signal_path': 'django.db.models.signals.post_delete',
+                        'sender_path': 'django.contrib.auth.models.User',
+                    },
+                    {
+                        'receiver_func_name': 'invalidate_studio_session_marker',
+                        'signal_path': 'django.contrib.auth.signals.user_logged_out',
+                    },
                 ],
             },
         }
     }, 'Should initiate the app as an Open edX plugin.'
+
+
+def test_ready_resolves_studio_permission_method(settings):
+    settings.MAGICLINK_STUDIO_PERMISSION_METHOD = 'tahoe_idp.tests.magiclink_fixtures:external_method_testing'
+    TahoeIdpConfig('tahoe_idp', tahoe_idp).ready()
+
+
+def test_ready_fails_on_misconfigured_studio_permission_method(settings):
+    settings.MAGICLINK_STUDIO_PERMISSION_METHOD = 'external_module.does_not:exists'
+    with pytest.raises(ImproperlyConfigured, match='MAGICLINK_STUDIO_PERMISSION_METHOD'):
+        TahoeIdpConfig('tahoe_idp', tahoe_idp).ready()
+
+
+@pytest.fixture
+def warm_up_settings(settings):
+    settings.TAHOE_IDP_WARM_UP_ON_STARTUP = True
+    settings.TAHOE_IDP_CONFIGS = {
+        'BASE_URL': 'https://domain',
+        'API_KEY': 'dummy-key',
+    }
+    return settings
+
+
+def test_ready_warm_up(warm_up_settings):
+    with patch('tahoe_idp.redirect_whitelist.RedirectWhitelist') as mock_whitelist:
+        get_redirect_whitelist.cache_clear()
+        TahoeIdpConfig('tahoe_idp', tahoe_idp).ready()
+        get_redirect_whitelist()
+    assert mock_whitelist.call_count == 1, 'Should compile the whitelist on startup'
+    get_redirect_whitelist.cache_clear()
+
+
+@pytest.mark.parametrize('tahoe_idp_configs,error', [
+    (None, '`TAHOE_IDP_CONFIGS` settings must be defined'),
+    (['BASE_URL'], '`TAHOE_IDP_CONFIGS` must be a dict'),
+    ({'BASE_URL': 'https://domain'}, 'Tahoe IdP `API_KEY` cannot be empty'),
+    ({'BASE_URL': 'https://domain', 'API_KEY': 'key', 'JWT_OPTIONS': 'verify'}, '`JWT_OPTIONS` must be a dict'),
+])
+def test_ready_warm_up_validates_configs(warm_up_settings, tahoe_idp_configs, error):
+    warm_up_settings.TAHOE_IDP_CONFIGS = tahoe_idp_configs
+    with pytest.raises(ImproperlyConfigured, match=error):
+        TahoeIdpConfig('tahoe_idp', tahoe_idp).ready()
+
+
+def test_ready_warm_up_without_tahoe_idp(warm_up_settings):
+    warm_up_settings.FEATURES = {'ENABLE_TAHOE_IDP': False}
+    warm_up_settings.TAHOE_IDP_CONFIGS = None
+    TahoeIdpConfig('tahoe_idp', tahoe_idp).ready()
+
+
+def test_ready_warm_up_fails_on_bad_verify_url(warm_up_settings):
+    warm_up_settings.MAGICLINK_LOGIN_VERIFY_URL = 'tahoe_idp:does_not_exist'
+    with pytest.raises(ImproperlyConfigured, match='MAGICLINK_LOGIN_VERIFY_URL'):
+        TahoeIdpConfig('tahoe_idp', tahoe_idp).ready()
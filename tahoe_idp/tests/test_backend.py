@@ -4,10 +4,14 @@ https://github.com/python-social-auth/social-core/blob/master/social_core/backen
 """
 import json
 import pytest
-from unittest.mock import patch
+from unittest.mock import Mock, patch
+
+from django.test import override_settings
 
 from httpretty import HTTPretty
 
+from tahoe_idp import helpers
+
 from .oauth import OAuth2Test
 from .conftest import (
     mock_tahoe_idp_api_settings,
@@ -177,8 +181,53 @@ class TahoeIdPBackendTest(OAuth2Test):
             "tahoe_idp_is_organization_admin": False,
             "tahoe_idp_is_organization_staff": True,
             "tahoe_idp_is_course_author": False,
+            "tahoe_idp_capabilities": 2,
+            "tahoe_idp_data_version": None,
         }
 
+    @patch('tahoe_idp.helpers.fusionauth_retrieve_user')
+    def test_get_user_details_multiple_roles(self, mock_get_idp_user):
+        """
+        Ensure the flags of all the roles in `platform_role` are combined.
+        """
+        mock_get_idp_user.return_value = {
+            "email": "ahmed@appsembler.com",
+            "id": "2a106a94-c8b0-4f0b-bb69-fea0022c18d8",
+            "username": "ahmedjazzar",
+            "data": {
+                "platform_role": ["course_author", "Administrator"],
+            },
+        }
+
+        user_details = self.backend.get_user_details({
+            "userId": "2a106a94-c8b0-4f0b-bb69-fea0022c18d8",
+        })
+
+        assert user_details["tahoe_idp_is_organization_admin"]
+        assert user_details["tahoe_idp_is_organization_staff"]
+        assert user_details["tahoe_idp_is_course_author"]
+
+    @patch('tahoe_idp.helpers.fusionauth_retrieve_user')
+    def test_get_user_details_non_string_roles(self, mock_get_idp_user):
+        """
+        Ensure roles which aren't strings in the IdP data are ignored instead of failing the login.
+        """
+        mock_get_idp_user.return_value = {
+            "email": "ahmed@appsembler.com",
+            "id": "2a106a94-c8b0-4f0b-bb69-fea0022c18d8",
+            "username": "ahmedjazzar",
+            "data": {
+                "platform_role": ["staff", None, 5],
+            },
+        }
+
+        user_details = self.backend.get_user_details({
+            "userId": "2a106a94-c8b0-4f0b-bb69-fea0022c18d8",
+        })
+
+        assert not user_details["tahoe_idp_is_organization_admin"]
+        assert user_details["tahoe_idp_is_organization_staff"]
+
     @patch('tahoe_idp.helpers.fusionauth_retrieve_user')
     def test_build_user_details_with_no_role_or_app_metadata(self, mock_get_idp_user):
         """
@@ -206,4 +255,92 @@ class TahoeIdPBackendTest(OAuth2Test):
             "tahoe_idp_is_organization_admin": False,
             "tahoe_idp_is_organization_staff": False,
             "tahoe_idp_is_course_author": False,
+            "tahoe_idp_capabilities": 0,
+            "tahoe_idp_data_version": None,
+        }
+
+    @patch('tahoe_idp.helpers.fusionauth_retrieve_user')
+    def test_get_user_details_data_version(self, mock_get_idp_user):
+        """
+        Ensure the IdP `lastUpdateInstant` is used as the data version of the role flags.
+        """
+        mock_get_idp_user.return_value = {
+            "email": "ahmed@appsembler.com",
+            "id": "2a106a94-c8b0-4f0b-bb69-fea0022c18d8",
+            "username": "ahmedjazzar",
+            "lastUpdateInstant": 1634567890123,
+            "data": {
+                "platform_role": "administrator",
+            },
         }
+
+        user_details = self.backend.get_user_details({
+            "userId": "2a106a94-c8b0-4f0b-bb69-fea0022c18d8",
+        })
+
+        assert user_details["tahoe_idp_capabilities"] == 3
+        assert user_details["tahoe_idp_data_version"] == 1634567890123
+
+    def test_extra_data_stores_role_flags(self):
+        """
+        Ensure the capabilities are stored in `UserSocialAuth.extra_data` and written through to the cache.
+        """
+        user = Mock(id=99)
+        details = {
+            "tahoe_idp_capabilities": 4,
+            "tahoe_idp_data_version": 1634567890123,
+        }
+
+        with patch('tahoe_idp.helpers.cache_idp_permission_flags') as mock_cache_flags:
+            extra_data = self.backend.extra_data(user, "uid", {"access_token": "token"}, details)
+
+        assert extra_data["tahoe_idp_capabilities"] == 4
+        assert extra_data["tahoe_idp_data_version"] == 1634567890123
+        mock_cache_flags.assert_called_once_with(99, extra_data)
+
+    @override_settings(FEATURES={"ENABLE_TAHOE_IDP": True, "TAHOE_IDP_WAIT_FOR_USER_WEBHOOK": True})
+    @patch('tahoe_idp.backend.time.sleep')
+    @patch('tahoe_idp.helpers.fusionauth_retrieve_user')
+    def test_get_user_details_wait_for_webhook(self, mock_get_idp_user, mock_sleep):
+        """
+        Ensure the username from a webhook event is used instead of polling the IdP.
+        """
+        mock_get_idp_user.return_value = {
+            "email": "ahmed@appsembler.com",
+            "id": "2a106a94-c8b0-4f0b-bb69-fea0022c18d8",
+        }
+        helpers.set_idp_user_ready({
+            "email": "ahmed@appsembler.com",
+            "id": "2a106a94-c8b0-4f0b-bb69-fea0022c18d8",
+            "username": "ahmedjazzar",
+        })
+
+        user_details = self.backend.get_user_details({
+            "userId": "2a106a94-c8b0-4f0b-bb69-fea0022c18d8",
+        })
+
+        assert user_details["username"] == "ahmedjazzar"
+        assert mock_get_idp_user.call_count == 1
+        assert not mock_sleep.called
+
+    @override_settings(FEATURES={
+        "ENABLE_TAHOE_IDP": True,
+        "TAHOE_IDP_WAIT_FOR_USER_WEBHOOK": True,
+        "TAHOE_IDP_USER_WEBHOOK_TIMEOUT": 0,
+    })
+    @patch('tahoe_idp.helpers.fusionauth_retrieve_user')
+    def test_get_user_details_wait_for_webhook_deadline(self, mock_get_idp_user):
+        """
+        Ensure the IdP is called once more when no webhook event arrives before the deadline.
+        """
+        mock_get_idp_user.side_effect = [
+            {"email": "ahmed@appsembler.com", "id": "2a106a94-c8b0-4f0b-bb69-fea0022c18d8"},
+            {"email": "ahmed@appsembler.com", "id": "2a106a94-c8b0-4f0b-bb69-fea0022c18d8"},
+        ]
+
+        user_details = self.backend.get_user_details({
+            "userId": "2a106a94-c8b0-4f0b-bb69-fea0022c18d8",
+        })
+
+        assert user_details["username"] == "2a106a94-c8b0-4f0b-bb69-fea0022c18d8", "Should fall back to the id"
+        assert mock_get_idp_user.call_count == 2
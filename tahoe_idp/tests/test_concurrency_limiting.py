@@ -0,0 +1,126 @@
+"""
+Tests for the concurrency_limiting module.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import pytest
+from unittest.mock import Mock, patch
+
+from tahoe_idp.concurrency_limiting import AdaptiveConcurrencyLimiter, get_concurrency_limiter
+from tahoe_idp.helpers import get_api_client
+from tahoe_idp.rate_limiting import batch_traffic
+
+from .conftest import mock_tahoe_idp_api_settings
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_additive_increase():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=3, latency_target=1, clock=FakeClock())
+    for _i in range(2):
+        limiter.acquire()
+        limiter.release(latency=0.1)
+    assert limiter.limit == pytest.approx(2 + 1 / 2 + 1 / 2.5), 'Should grow by about one call per limit calls'
+
+    for _i in range(10):
+        limiter.acquire()
+        limiter.release(latency=0.1)
+    assert limiter.limit == 3, 'Should not exceed max_limit'
+
+
+def test_multiplicative_decrease():
+    clock = FakeClock()
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=16, latency_target=1, clock=clock)
+    limiter.acquire()
+    limiter.release(latency=2)
+    assert limiter.limit == 8, 'Should halve on slow calls'
+
+    limiter.acquire()
+    limiter.release(latency=0.1, failed=True)
+    assert limiter.limit == 8, 'Should decrease at most once per latency target'
+
+    clock.now += 1
+    for _i in range(5):
+        clock.now += 1
+        limiter.acquire()
+        limiter.release(latency=0.1, failed=True)
+    assert limiter.limit == 1, 'Should not go under min_limit'
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'initial_limit': 0, 'min_limit': 0},
+    {'initial_limit': 4, 'max_limit': 2},
+    {'latency_target': 0},
+    {'backoff_ratio': 1},
+])
+def test_limiter_validation(kwargs):
+    with pytest.raises(ValueError):
+        AdaptiveConcurrencyLimiter(**kwargs)
+
+
+def test_limiter_bounds_concurrency():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=2)
+    lock = threading.Lock()
+    concurrency = {'current': 0, 'max': 0}
+
+    def fn():
+        with lock:
+            concurrency['current'] += 1
+            concurrency['max'] = max(concurrency['max'], concurrency['current'])
+        time.sleep(0.01)
+        with lock:
+            concurrency['current'] -= 1
+        return Mock(status=200)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for future in [executor.submit(limiter.call, fn) for _i in range(16)]:
+            future.result()
+
+    assert concurrency['max'] == 2
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.parametrize('status, is_failed', [(200, False), (404, False), (429, True), (503, True)])
+def test_limiter_call_status(status, is_failed):
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4, latency_target=1)
+    with patch.object(limiter, 'release', wraps=limiter.release) as mock_release:
+        assert limiter.call(Mock(return_value=Mock(status=status))).status == status
+    assert mock_release.call_args[1] == {'failed': is_failed}
+
+
+def test_limiter_call_exception():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4, latency_target=1)
+    with pytest.raises(ConnectionError):
+        limiter.call(Mock(side_effect=ConnectionError))
+    assert limiter.limit == 2
+    assert limiter.in_flight == 0
+
+
+def test_get_concurrency_limiter(settings):
+    assert get_concurrency_limiter() is None, 'Should be disabled by default'
+    settings.TAHOE_IDP_ADAPTIVE_CONCURRENCY = {'max_limit': 16}
+    assert get_concurrency_limiter().max_limit == 16
+    assert get_concurrency_limiter() is get_concurrency_limiter(), 'Should be shared in the process'
+
+
+@pytest.mark.usefixtures('mock_tahoe_idp_settings')
+@mock_tahoe_idp_api_settings
+def test_api_client_limits_batch_calls(settings, requests_mock):
+    settings.TAHOE_IDP_ADAPTIVE_CONCURRENCY = {}
+    requests_mock.post('https://domain/api/user/forgot-password', status_code=202, text='')
+
+    with patch.object(AdaptiveConcurrencyLimiter, 'release', autospec=True) as mock_release:
+        get_api_client().forgot_password({'loginId': 'someone@example.com'})
+        assert not mock_release.called, 'Should not limit interactive calls'
+
+        with batch_traffic():
+            get_api_client().forgot_password({'loginId': 'someone@example.com'})
+        assert mock_release.call_args[1] == {'failed': False}
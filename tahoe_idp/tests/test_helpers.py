@@ -3,6 +3,7 @@ from unittest.mock import patch
 
 from ddt import data, ddt, unpack
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase, override_settings
 from django.utils.timezone import utc
@@ -10,12 +11,15 @@ from django.utils.timezone import utc
 from site_config_client.openedx.test_helpers import override_site_config
 
 from tahoe_idp.helpers import (
+    cache_idp_user,
     fail_if_tahoe_idp_not_enabled,
     fusionauth_retrieve_user,
     get_idp_base_url,
+    get_idp_user_cache_key,
     get_required_setting,
     get_tenant_id,
     import_from_path,
+    invalidate_cached_idp_user,
     is_tahoe_idp_enabled,
     is_valid_redirect_url,
 )
@@ -72,6 +76,53 @@ def test_fusionauth_retrieve_user(requests_mock):
     }
 
 
+@override_settings(TAHOE_IDP_CONFIGS={"BASE_URL": "http://fa:9100", "API_KEY": "testkey"})
+@override_site_config("admin", ENABLE_TAHOE_IDP=True, TAHOE_IDP_TENANT_ID="tenant-xyz")
+def test_fusionauth_retrieve_user_cache(requests_mock):
+    user_uuid = "855760ec-d5bc-11ec-9f0a-c3fd7676521c"
+    mock_get = requests_mock.get(
+        "/api/user/{}".format(user_uuid),
+        headers={
+            'content-type': 'application/json',
+        },
+        json={"user": {"id": user_uuid, "username": "ahmedjazzar", "lastUpdateInstant": 2}},
+    )
+    assert fusionauth_retrieve_user(user_uuid)["username"] == "ahmedjazzar"
+    assert fusionauth_retrieve_user(user_uuid)["username"] == "ahmedjazzar"
+    assert mock_get.call_count == 1, 'Should read the second time from the cache'
+
+    fusionauth_retrieve_user(user_uuid, use_cache=False)
+    assert mock_get.call_count == 2, 'Should bypass the cache'
+
+    invalidate_cached_idp_user(user_uuid)
+    fusionauth_retrieve_user(user_uuid)
+    assert mock_get.call_count == 3, 'Should call the IdP after invalidation'
+
+
+@override_settings(TAHOE_IDP_USER_CACHE_TIMEOUT=0)
+@override_settings(TAHOE_IDP_CONFIGS={"BASE_URL": "http://fa:9100", "API_KEY": "testkey"})
+@override_site_config("admin", ENABLE_TAHOE_IDP=True, TAHOE_IDP_TENANT_ID="tenant-xyz")
+def test_fusionauth_retrieve_user_cache_disabled(requests_mock):
+    user_uuid = "855760ec-d5bc-11ec-9f0a-c3fd7676521c"
+    mock_get = requests_mock.get("/api/user/{}".format(user_uuid), json={"user": {"id": user_uuid}})
+    fusionauth_retrieve_user(user_uuid)
+    fusionauth_retrieve_user(user_uuid)
+    assert mock_get.call_count == 2
+
+
+def test_cache_idp_user_keeps_newer_version():
+    """
+    An older record, e.g. from a slow read, doesn't overwrite a newer one, e.g. from a webhook event.
+    """
+    user_uuid = "855760ec-d5bc-11ec-9f0a-c3fd7676521c"
+    assert cache_idp_user({"id": user_uuid, "email": "new@example.com", "lastUpdateInstant": 2})
+    assert not cache_idp_user({"id": user_uuid, "email": "old@example.com", "lastUpdateInstant": 1})
+    assert cache.get(get_idp_user_cache_key(user_uuid))["email"] == "new@example.com"
+
+    assert cache_idp_user({"id": user_uuid, "email": "newer@example.com", "lastUpdateInstant": 3})
+    assert cache.get(get_idp_user_cache_key(user_uuid))["email"] == "newer@example.com"
+
+
 @ddt
 class TestIsTahoeIdPEnabled(TestCase):
     @unpack
@@ -136,12 +187,12 @@ class TestTahoeIdPEnabledHelper(TestCase):
         with self.assertRaises(EnvironmentError):
             fail_if_tahoe_idp_not_enabled()
 
-        mock_is_tahoe_idp_enabled.assert_called_once_with()
+        mock_is_tahoe_idp_enabled.assert_called_once_with(site_configuration=None)
 
     @patch("tahoe_idp.helpers.is_tahoe_idp_enabled", return_value=True)
     def test_enabled(self, mock_is_tahoe_idp_enabled):
         fail_if_tahoe_idp_not_enabled()
-        mock_is_tahoe_idp_enabled.assert_called_once_with()
+        mock_is_tahoe_idp_enabled.assert_called_once_with(site_configuration=None)
 
 
 @ddt
@@ -226,6 +277,22 @@ class TestIsValidRedirectURL(TestCase):
         with override_settings(LOGIN_REDIRECT_WHITELIST=['subdomain.example.com', 'otherexample.com']):
             assert is_valid_redirect_url(redirect_to, request_host, True)
 
+    @data(
+        ('https://subdomain.example.com/someurl', True),
+        ('https://deep.subdomain.example.com/someurl', True),
+        ('https://SubDomain.Example.com/someurl', True),
+        ('https://example.com/someurl', False),
+        ('https://subdomain.otherexample.com/someurl', False),
+        ('https://example.com.evil.com/someurl', False),
+    )
+    @unpack
+    def test_wildcard_whitelist(self, redirect_to, is_valid):
+        """
+        Verify that `*.example.com` in LOGIN_REDIRECT_WHITELIST matches any subdomain of example.com only
+        """
+        with override_settings(LOGIN_REDIRECT_WHITELIST=['*.example.com']):
+            assert is_valid_redirect_url(redirect_to, 'lms.local', True) == is_valid
+
 
 class TestImportFromPath(TestCase):
     """
@@ -0,0 +1,323 @@
+"""
+Tests for the IdP sync outbox.
+"""
+from datetime import datetime, timedelta
+from io import StringIO
+import json
+
+import pytest
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models.query import QuerySet
+from django.utils import timezone
+from requests import HTTPError
+from social_django.models import UserSocialAuth
+from unittest.mock import Mock, call, patch
+
+from tahoe_idp.api import update_tahoe_user_id, update_user_email
+from tahoe_idp.constants import BACKEND_NAME
+from tahoe_idp.idp_sync_outbox import drain_outbox, enqueue_user_update, get_retry_delay
+from tahoe_idp.models import IdpSyncOutboxEntry
+from tahoe_idp.receivers import user_sync_to_idp
+
+
+pytestmark = [
+    pytest.mark.django_db,
+    pytest.mark.usefixtures('site'),
+]
+
+
+class SiteConfigurationDoesNotExist(ObjectDoesNotExist, AttributeError):
+    """
+    Like the `RelatedObjectDoesNotExist` of `site.configuration` in Open edX.
+    """
+
+
+@pytest.fixture
+def site(monkeypatch):
+    """
+    The site of the current request, whose configuration is used by `drain_outbox`.
+    """
+    site = Site.objects.create(domain='tenant.example.com', name='tenant')
+    monkeypatch.setattr('tahoe_idp.helpers.get_current_site', lambda: site)
+    return site
+
+
+@pytest.fixture
+def site_configuration(monkeypatch, site):
+    site_configuration = Mock(site=site)
+    monkeypatch.setattr('tahoe_idp.helpers.get_site_configuration', Mock(return_value=site_configuration))
+    return site_configuration
+
+
+@pytest.fixture
+def outbox_settings(settings, monkeypatch):
+    settings.TAHOE_IDP_SYNC_OUTBOX_ENABLED = True
+    monkeypatch.setattr('tahoe_idp.helpers.is_tahoe_idp_enabled', lambda site_configuration=None: True)
+    return settings
+
+
+@pytest.fixture
+def users():
+    return [User.objects.create(username=username) for username in ['user_a', 'user_b']]
+
+
+def get_outbox_properties():
+    return [json.loads(entry.properties) for entry in IdpSyncOutboxEntry.objects.order_by('id')]
+
+
+@pytest.mark.usefixtures('outbox_settings')
+@patch('tahoe_idp.api.update_user')
+def test_user_sync_to_idp_enqueues(mock_update_user, users):
+    user = users[0]
+    user.first_name = 'Ahmed'
+    user_sync_to_idp(sender=User, instance=user, created=False)
+
+    assert not mock_update_user.called, 'Should not call the IdP inline'
+    assert get_outbox_properties() == [{'user': {'firstName': 'Ahmed', 'lastName': ''}}]
+
+
+@pytest.mark.usefixtures('outbox_settings')
+def test_rolled_back_changes_are_not_enqueued(users):
+    with pytest.raises(RuntimeError):
+        with transaction.atomic():
+            update_user_email(users[0], 'new@example.com')
+            raise RuntimeError('Rollback')
+
+    assert not IdpSyncOutboxEntry.objects.exists()
+
+
+@pytest.mark.usefixtures('outbox_settings')
+@patch('tahoe_idp.api.update_user')
+def test_update_user_email_enqueues(mock_update_user, users):
+    assert update_user_email(users[0], 'new@example.com', set_email_as_verified=True) is None
+    assert not mock_update_user.called
+    assert get_outbox_properties() == [{'user': {'email': 'new@example.com'}, 'skipVerification': True}]
+
+
+@patch('tahoe_idp.api.update_user')
+def test_drain_outbox(mock_update_user, users, site_configuration):
+    user_a, user_b = users
+    enqueue_user_update(user_a, {'user': {'firstName': 'A1'}})
+    enqueue_user_update(user_b, {'user': {'firstName': 'B1'}})
+    enqueue_user_update(user_a, {'user': {'firstName': 'A2'}})
+
+    assert drain_outbox() == {'sent': 3, 'retried': 0, 'failed': 0}
+    assert mock_update_user.call_args_list == [
+        call(user_a, {'user': {'firstName': 'A1'}}, site_configuration=site_configuration),
+        call(user_b, {'user': {'firstName': 'B1'}}, site_configuration=site_configuration),
+        call(user_a, {'user': {'firstName': 'A2'}}, site_configuration=site_configuration),
+    ]
+    assert not IdpSyncOutboxEntry.objects.exists()
+
+
+@patch('tahoe_idp.api.update_user')
+def test_drain_outbox_keeps_user_order_on_failure(mock_update_user, users, site_configuration):
+    """
+    A failed entry is retried later and blocks the later entries of the same user only.
+    """
+    user_a, user_b = users
+    failed_entry = enqueue_user_update(user_a, {'user': {'firstName': 'A1'}})
+    enqueue_user_update(user_b, {'user': {'firstName': 'B1'}})
+    enqueue_user_update(user_a, {'user': {'firstName': 'A2'}})
+    mock_update_user.side_effect = [HTTPError('503 Server Error'), None]
+
+    assert drain_outbox() == {'sent': 1, 'retried': 1, 'failed': 0}
+    assert mock_update_user.call_count == 2
+
+    failed_entry.refresh_from_db()
+    assert failed_entry.attempts == 1
+    assert failed_entry.last_error == '503 Server Error'
+    assert failed_entry.next_attempt_on > timezone.now()
+
+    mock_update_user.reset_mock(side_effect=True)
+    assert drain_outbox() == {'sent': 0, 'retried': 0, 'failed': 0}, 'Should wait for the retry delay'
+
+    IdpSyncOutboxEntry.objects.update(next_attempt_on=timezone.now())
+    assert drain_outbox() == {'sent': 2, 'retried': 0, 'failed': 0}
+    assert mock_update_user.call_args_list == [
+        call(user_a, {'user': {'firstName': 'A1'}}, site_configuration=site_configuration),
+        call(user_a, {'user': {'firstName': 'A2'}}, site_configuration=site_configuration),
+    ]
+
+
+@patch('tahoe_idp.api.update_user')
+def test_drain_outbox_skips_entries_in_backoff(mock_update_user, site_configuration):
+    """
+    Entries waiting for a retry don't take the batch from the ready entries, nor let their user's later entries go.
+    """
+    users = [User.objects.create(username='user_{}'.format(index)) for index in range(4)]
+    for user in users:
+        enqueue_user_update(user, {'user': {'firstName': user.username}})
+    blocked_user_entry = enqueue_user_update(users[0], {'user': {'firstName': 'later'}})
+    IdpSyncOutboxEntry.objects.filter(user__in=users[:3]).exclude(pk=blocked_user_entry.pk).update(
+        attempts=1, next_attempt_on=timezone.now() + timedelta(minutes=1),
+    )
+
+    assert drain_outbox(batch_size=3) == {'sent': 1, 'retried': 0, 'failed': 0}
+    mock_update_user.assert_called_once_with(
+        users[3], {'user': {'firstName': 'user_3'}}, site_configuration=site_configuration,
+    )
+    assert IdpSyncOutboxEntry.objects.filter(pk=blocked_user_entry.pk).exists(), 'Should keep the user order'
+
+
+@patch('tahoe_idp.api.update_user', side_effect=HTTPError('404 Client Error'))
+@pytest.mark.usefixtures('site_configuration')
+def test_drain_outbox_gives_up(_mock_update_user, users):
+    entry = enqueue_user_update(users[0], {'user': {'firstName': 'A1'}})
+
+    assert drain_outbox(max_attempts=1) == {'sent': 0, 'retried': 0, 'failed': 1}
+    entry.refresh_from_db()
+    assert entry.failed_on
+    assert drain_outbox(max_attempts=1) == {'sent': 0, 'retried': 0, 'failed': 0}, 'Should not retry failed entries'
+
+
+@patch('tahoe_idp.api.update_user')
+def test_drain_outbox_retries_other_errors(mock_update_user, users, site_configuration):
+    """
+    Errors other than the IdP responses e.g. a misconfigured site are retried later without stopping the drain.
+    """
+    user_a, user_b = users
+    failed_entry = enqueue_user_update(user_a, {'user': {'firstName': 'A1'}})
+    enqueue_user_update(user_b, {'user': {'firstName': 'B1'}})
+    mock_update_user.side_effect = [EnvironmentError('Tahoe IdP is not enabled'), None]
+
+    assert drain_outbox() == {'sent': 1, 'retried': 1, 'failed': 0}
+    assert mock_update_user.call_args_list[1] == call(
+        user_b, {'user': {'firstName': 'B1'}}, site_configuration=site_configuration,
+    )
+    failed_entry.refresh_from_db()
+    assert failed_entry.attempts == 1
+    assert failed_entry.last_error == 'Tahoe IdP is not enabled'
+    assert failed_entry.next_attempt_on > timezone.now()
+
+
+@patch('tahoe_idp.api.update_user')
+def test_drain_outbox_gives_up_without_site_configuration(mock_update_user, users, site):
+    """
+    Entries of users saved outside of a request, or of sites without configuration, can't be sent.
+    """
+    user_a, user_b = users
+    without_site_entry = enqueue_user_update(user_a, {'user': {'firstName': 'A1'}})
+    IdpSyncOutboxEntry.objects.filter(pk=without_site_entry.pk).update(site=None)
+    without_configuration_entry = enqueue_user_update(user_b, {'user': {'firstName': 'B1'}})
+
+    with patch('tahoe_idp.helpers.get_site_configuration', side_effect=SiteConfigurationDoesNotExist):
+        assert drain_outbox() == {'sent': 0, 'retried': 0, 'failed': 2}
+
+    assert not mock_update_user.called
+    for entry in [without_site_entry, without_configuration_entry]:
+        entry.refresh_from_db()
+        assert entry.failed_on
+        assert entry.last_error == 'No site configuration'
+    assert drain_outbox() == {'sent': 0, 'retried': 0, 'failed': 0}, 'Should not retry failed entries'
+
+
+@patch('tahoe_idp.api.update_user')
+def test_buffered_last_login(mock_update_user, users, settings, site_configuration):
+    """
+    Only the newest last login of each user is kept and sent.
+    """
+    settings.TAHOE_IDP_BUFFER_LAST_LOGIN = True
+    user_a, user_b = users
+    update_tahoe_user_id(user_a, now=datetime(2022, 1, 1, 8))
+    update_tahoe_user_id(user_b, now=datetime(2022, 1, 1, 9))
+    update_tahoe_user_id(user_a, now=datetime(2022, 1, 1, 10))
+    assert not mock_update_user.called, 'Should not call the IdP on login'
+    assert IdpSyncOutboxEntry.objects.filter(kind=IdpSyncOutboxEntry.KIND_LAST_LOGIN).count() == 2
+
+    assert drain_outbox() == {'sent': 2, 'retried': 0, 'failed': 0}
+    assert mock_update_user.call_args_list == [
+        call(
+            user_a,
+            {'user': {'data': {'tahoe_user_id': user_a.id, 'tahoe_user_last_login': '2022-01-01T10:00:00'}}},
+            site_configuration=site_configuration,
+        ),
+        call(
+            user_b,
+            {'user': {'data': {'tahoe_user_id': user_b.id, 'tahoe_user_last_login': '2022-01-01T09:00:00'}}},
+            site_configuration=site_configuration,
+        ),
+    ]
+
+
+def test_drain_outbox_uses_entry_site(settings, site, requests_mock):
+    """
+    The IdP client is configured from the site of the entry, there's no current site when draining.
+    """
+    settings.TAHOE_IDP_CONFIGS = {'BASE_URL': 'https://domain', 'API_KEY': 'dummy-api-key'}
+    site_configuration = Mock(site=site, admin_values={'ENABLE_TAHOE_IDP': True, 'TAHOE_IDP_TENANT_ID': 'tenant-xyz'})
+
+    def get_admin_value(name, default=None, site_configuration=None):
+        assert site_configuration is not None, 'Should not read the configuration of the current site'
+        return site_configuration.admin_values.get(name, default)
+    user = User.objects.create(username='user_a')
+    UserSocialAuth.objects.create(user=user, uid='c80f5080-d50c-11ec-b5e5-5b30b2c6a1d9', provider=BACKEND_NAME)
+    enqueue_user_update(user, {'user': {'firstName': 'A1'}})
+    mock_patch = requests_mock.patch('https://domain/api/user/c80f5080-d50c-11ec-b5e5-5b30b2c6a1d9', text='{}')
+
+    with patch('tahoe_idp.helpers.get_site_configuration', return_value=site_configuration) as mock_get_config:
+        with patch('site_config_client.openedx.api.get_admin_value', side_effect=get_admin_value):
+            assert drain_outbox() == {'sent': 1, 'retried': 0, 'failed': 0}
+
+    mock_get_config.assert_called_once_with(site)
+    assert mock_patch.last_request.headers['X-FusionAuth-TenantId'] == 'tenant-xyz'
+    assert mock_patch.last_request.json() == {'user': {'firstName': 'A1'}}
+
+
+def test_get_retry_delay():
+    assert get_retry_delay(1) == timedelta(minutes=1)
+    assert get_retry_delay(3) == timedelta(minutes=4)
+    assert get_retry_delay(20) == timedelta(hours=1)
+
+
+@patch('tahoe_idp.api.update_user')
+@pytest.mark.usefixtures('site_configuration')
+def test_drain_idp_sync_outbox_command(mock_update_user, users):
+    for user in users:
+        enqueue_user_update(user, {'user': {'firstName': user.username}})
+
+    out = StringIO()
+    call_command('drain_idp_sync_outbox', '--batch-size', '1', stdout=out)
+    assert mock_update_user.call_count == 2
+    assert out.getvalue().splitlines() == ['Sent 1, retrying 0, failed 0 IdP sync entries'] * 2
+
+
+@pytest.mark.usefixtures('site_configuration')
+def test_buffered_last_login_locks_user(users, settings):
+    """
+    Concurrent logins of a user are serialized by locking the user row while coalescing.
+    """
+    settings.TAHOE_IDP_BUFFER_LAST_LOGIN = True
+    locked_models = []
+
+    def select_for_update(queryset, *args, **kwargs):
+        assert transaction.get_connection().in_atomic_block, 'Should lock within a transaction'
+        locked_models.append(queryset.model)
+        return original_select_for_update(queryset, *args, **kwargs)
+
+    original_select_for_update = QuerySet.select_for_update
+    with patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=select_for_update):
+        update_tahoe_user_id(users[0], now=datetime(2022, 1, 1, 8))
+
+    assert locked_models == [User]
+
+
+@patch('tahoe_idp.api.update_user')
+@pytest.mark.usefixtures('site_configuration')
+def test_buffered_last_login_coalesced_while_sending(mock_update_user, users, settings):
+    """
+    A last login coalesced into an entry while it's sent stays pending.
+    """
+    settings.TAHOE_IDP_BUFFER_LAST_LOGIN = True
+    user = users[0]
+    update_tahoe_user_id(user, now=datetime(2022, 1, 1, 8))
+    mock_update_user.side_effect = lambda *args, **kwargs: update_tahoe_user_id(user, now=datetime(2022, 1, 1, 9))
+
+    assert drain_outbox() == {'sent': 1, 'retried': 0, 'failed': 0}
+    assert get_outbox_properties() == [
+        {'user': {'data': {'tahoe_user_id': user.id, 'tahoe_user_last_login': '2022-01-01T09:00:00'}}},
+    ]
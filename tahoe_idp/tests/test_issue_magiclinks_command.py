@@ -0,0 +1,79 @@
+"""
+Tests for the `issue_magiclinks` management command.
+"""
+from io import StringIO
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tahoe_idp.magiclink_storage import DatabaseMagicLinkStorage
+from tahoe_idp.models import MagicLink
+
+
+User = get_user_model()
+
+
+@pytest.fixture
+def course_authors():
+    return [User.objects.create(username=username) for username in ['author_a', 'author_b']]
+
+
+def issue_magiclinks(*args, **kwargs):
+    out = StringIO()
+    err = StringIO()
+    call_command('issue_magiclinks', *args, stdout=out, stderr=err, **kwargs)
+    return out.getvalue().splitlines(), err.getvalue()
+
+
+@pytest.mark.django_db
+def test_issue_magiclinks(settings, course_authors):
+    lines, _err = issue_magiclinks('author_a', 'author_b', '--secure', '--redirect-url', '/home/')
+
+    assert len(lines) == 2
+    for line, user in zip(lines, course_authors):
+        username, url = line.split(',', 1)
+        assert username == user.username
+        assert url.startswith('https://{}/'.format(settings.MAGICLINK_STUDIO_DOMAIN))
+        assert MagicLink.objects.get(username=username, redirect_url='/home/').token in url
+
+
+@pytest.mark.django_db
+def test_issue_magiclinks_from_file(tmp_path, course_authors):
+    usernames_file = tmp_path / 'usernames.txt'
+    usernames_file.write_text('author_a\n\nauthor_b\n')
+
+    lines, _err = issue_magiclinks('--file', str(usernames_file))
+    assert [line.split(',')[0] for line in lines] == ['author_a', 'author_b']
+    assert all(line.split(',')[1].startswith('http://') for line in lines)
+
+
+@pytest.mark.django_db
+def test_issue_magiclinks_skipped_users(course_authors):
+    issue_magiclinks('author_a')
+
+    lines, err = issue_magiclinks('author_a', 'author_b', 'ghost')
+    assert [line.split(',')[0] for line in lines] == ['author_b']
+    assert 'Skipped ghost: user does not exist' in err
+    assert 'Skipped author_a: too many magic login requests' in err
+
+
+def test_issue_magiclinks_no_usernames():
+    with pytest.raises(CommandError, match='Provide usernames'):
+        issue_magiclinks()
+
+
+@pytest.mark.django_db
+def test_issue_magiclinks_batches_user_lookups(monkeypatch, course_authors):
+    monkeypatch.setattr(DatabaseMagicLinkStorage, 'BATCH_SIZE', 2)
+    User.objects.create(username='author_c')
+
+    with CaptureQueriesContext(connection) as queries:
+        lines, _err = issue_magiclinks('author_a', 'author_b', 'author_c')
+
+    assert [line.split(',')[0] for line in lines] == ['author_a', 'author_b', 'author_c']
+    user_lookups = [query['sql'] for query in queries if 'FROM "{}"'.format(User._meta.db_table) in query['sql']]
+    assert len(user_lookups) == 2, 'Should look the users up in batches'
@@ -0,0 +1,51 @@
+"""
+Ensure the heavy dependencies are imported on first use, not when importing the package.
+"""
+import os
+import subprocess
+import sys
+
+
+IMPORT_SCRIPT = """
+import sys
+
+import django
+from django.conf import settings
+
+settings.configure(
+    INSTALLED_APPS=['django.contrib.auth', 'django.contrib.contenttypes', 'tahoe_idp'],
+    DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+)
+django.setup()
+
+import tahoe_idp.api
+import tahoe_idp.helpers
+import tahoe_idp.magiclink_backends
+import tahoe_idp.magiclink_views
+
+print(','.join(sorted(sys.modules)))
+"""
+
+HEAVY_MODULES = [
+    'fusionauth.fusionauth_client',
+    'requests',
+    'site_config_client.openedx.api',
+    'social_django.models',
+]
+
+
+def test_heavy_modules_are_not_imported():
+    """
+    Simulate a Studio worker that only uses magic links in a fresh interpreter.
+    """
+    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    output = subprocess.check_output(
+        [sys.executable, '-c', IMPORT_SCRIPT],
+        cwd=project_root,
+        env=dict(os.environ, PYTHONPATH=project_root),
+        universal_newlines=True,
+    )
+
+    imported_modules = set(output.strip().split(','))
+    assert 'tahoe_idp.magiclink_views' in imported_modules
+    assert imported_modules.isdisjoint(HEAVY_MODULES)
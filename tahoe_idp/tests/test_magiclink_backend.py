@@ -1,11 +1,18 @@
+from datetime import timedelta
+
 import pytest
+from django.contrib.auth import get_user_model
 from django.http import HttpRequest
+from django.utils import timezone
 
 from tahoe_idp.magiclink_backends import MagicLinkBackend
 from tahoe_idp.models import MagicLink
+from tahoe_idp.receivers import invalidate_magiclink_user_cache
 
 from tahoe_idp.tests.magiclink_fixtures import magic_link, user  # NOQA: F401
 
+User = get_user_model()
+
 
 @pytest.mark.django_db
 def test_auth_backend_get_user(user):  # NOQA: F811
@@ -67,3 +74,78 @@ def test_auth_backend_invalid(user, magic_link):  # NOQA: F811
         request=request, token=ml.token, username='fake_user'
     )
     assert user is None
+
+
+@pytest.mark.django_db
+def test_auth_backend_get_user_loads_auth_fields_only(user):  # NOQA: F811
+    loaded_user = MagicLinkBackend().get_user(user.id)
+    assert loaded_user.get_deferred_fields() == {'first_name', 'last_name', 'date_joined'}
+
+
+@pytest.mark.django_db
+def test_auth_backend_get_user_not_cached_by_default(user, django_assert_num_queries):  # NOQA: F811
+    MagicLinkBackend().get_user(user.id)
+    with django_assert_num_queries(1):
+        MagicLinkBackend().get_user(user.id)
+
+
+@pytest.mark.django_db
+def test_auth_backend_get_user_cache(settings, user, django_assert_num_queries):  # NOQA: F811
+    settings.MAGICLINK_GET_USER_CACHE_TIMEOUT = 30
+    MagicLinkBackend().get_user(user.id)
+    with django_assert_num_queries(0):
+        cached_user = MagicLinkBackend().get_user(user.id)
+    assert cached_user == user
+
+    invalidate_magiclink_user_cache(sender=User, instance=user)
+    with django_assert_num_queries(1):
+        MagicLinkBackend().get_user(user.id)
+
+
+@pytest.mark.django_db
+def test_auth_backend_get_user_cache_lms_invalidation(monkeypatch, settings, user, lms_signal_receivers):  # NOQA: F811
+    """
+    Password changes and deactivations saved in LMS evict the user cached for Studio sessions.
+    """
+    monkeypatch.setattr('tahoe_idp.helpers.is_tahoe_idp_enabled', lambda site_configuration=None: False)
+    settings.MAGICLINK_GET_USER_CACHE_TIMEOUT = 30
+    MagicLinkBackend().get_user(user.id)
+
+    user.set_password('new-password')
+    user.save()
+    assert MagicLinkBackend().get_user(user.id).password == user.password
+
+    user.delete()
+    assert MagicLinkBackend().get_user(user.id) is None
+
+
+@pytest.mark.django_db
+def test_auth_backend_validate_loads_auth_fields_only(user, magic_link):  # NOQA: F811
+    request = HttpRequest()
+    ml = magic_link(request)
+    validated_user = ml.get_user_with_validate(request=request, username=user.username)
+    assert validated_user == user
+    assert 'password' not in validated_user.get_deferred_fields(), 'Password is needed for the session hash'
+    assert 'date_joined' in validated_user.get_deferred_fields()
+
+
+@pytest.mark.django_db
+def test_auth_backend_expired_token(user, magic_link, django_assert_num_queries):  # NOQA: F811
+    request = HttpRequest()
+    ml = magic_link(request)
+    MagicLink.objects.filter(pk=ml.pk).update(expiry=timezone.now() - timedelta(seconds=1))
+
+    with django_assert_num_queries(1):  # A single SELECT and no write
+        authenticated_user = MagicLinkBackend().authenticate(request=request, token=ml.token, username=user.username)
+
+    assert authenticated_user is None
+    assert MagicLink.objects.get(pk=ml.pk).used is False
+
+
+@pytest.mark.django_db
+def test_auth_backend_unknown_token_single_query(user, django_assert_num_queries):  # NOQA: F811
+    with django_assert_num_queries(1):
+        authenticated_user = MagicLinkBackend().authenticate(
+            request=HttpRequest(), token='unknown', username=user.username,
+        )
+    assert authenticated_user is None
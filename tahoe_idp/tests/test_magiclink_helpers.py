@@ -5,13 +5,22 @@ from unittest.mock import patch
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ImproperlyConfigured
 from django.db import models
 from django.http import HttpRequest
 from django.utils import timezone
 
-from tahoe_idp.magiclink_helpers import create_magiclink, is_studio_allowed_for_user
+from tahoe_idp.helpers import cache_idp_permission_flags
+from tahoe_idp.magiclink_helpers import (
+    create_magiclink,
+    create_magiclinks,
+    get_studio_permission_method,
+    invalidate_studio_permission_cache,
+    is_studio_allowed_for_user,
+)
 from tahoe_idp.models import MagicLink, MagicLinkError
-from tahoe_idp.tests.magiclink_fixtures import user  # NOQA: F401
+from tahoe_idp.receivers import invalidate_magiclink_user_cache
+from tahoe_idp.tests.magiclink_fixtures import external_method_testing, user  # NOQA: F401
 
 
 User = get_user_model()
@@ -118,15 +127,107 @@ def test_is_studio_allowed_for_user_with_external(settings, user):  # NOQA: F811
     assert is_studio_allowed_for_user(user)
 
 
+@pytest.mark.django_db
+@pytest.mark.parametrize('method_path', [
+    'external_module.does_not:exists',
+    'tahoe_idp.tests.magiclink_fixtures:does_not_exist',
+    'not a path',
+    'tahoe_idp.permissions:IDP_ORG_ADMIN_ROLE',  # Not callable
+])
+def test_is_studio_allowed_for_user_with_misconfigured_external(settings, user, method_path):  # NOQA: F811
+    """
+    Verify that is_studio_allowed_for_user fails loudly if the external method can't be loaded
+    """
+    settings.MAGICLINK_STUDIO_PERMISSION_METHOD = method_path
+
+    with pytest.raises(ImproperlyConfigured, match='MAGICLINK_STUDIO_PERMISSION_METHOD'):
+        is_studio_allowed_for_user(user)
+
+
 @pytest.mark.django_db
 def test_is_studio_allowed_for_user_with_failing_external(settings, user):  # NOQA: F811
     """
-    Verify that is_studio_allowed_for_user will check using the given external method
+    Verify that is_studio_allowed_for_user returns False if the external method fails
     """
-    settings.MAGICLINK_STUDIO_PERMISSION_METHOD = 'external_module.does_not:exists'
+    settings.MAGICLINK_STUDIO_PERMISSION_METHOD = 'tahoe_idp.tests.magiclink_fixtures:external_method_testing'
 
-    with patch('tahoe_idp.magiclink_helpers.log.warning') as mock_log:
-        assert not is_studio_allowed_for_user(user)
+    with patch('tahoe_idp.tests.magiclink_fixtures.external_method_testing', side_effect=ValueError('boom')):
+        get_studio_permission_method.cache_clear()
+        with patch('tahoe_idp.magiclink_helpers.log.warning') as mock_log:
+            assert not is_studio_allowed_for_user(user)
     mock_log.assert_called_once_with(
-        "tahoue_idp.is_studio_allowed_for_user failed for user test_user: No module named 'external_module'"
+        "tahoue_idp.is_studio_allowed_for_user failed for user test_user: boom"
     )
+
+
+def test_get_studio_permission_method_resolved_once(settings):
+    settings.MAGICLINK_STUDIO_PERMISSION_METHOD = 'tahoe_idp.tests.magiclink_fixtures:external_method_testing'
+    with patch('tahoe_idp.magiclink_helpers.import_from_path', return_value=external_method_testing) as mock_import:
+        get_studio_permission_method.cache_clear()
+        assert get_studio_permission_method() is external_method_testing
+        assert get_studio_permission_method() is external_method_testing
+    assert mock_import.call_count == 1
+
+
+@pytest.mark.django_db
+def test_is_studio_allowed_for_user_cache(settings, user):  # NOQA: F811
+    settings.MAGICLINK_STUDIO_PERMISSION_METHOD = 'tahoe_idp.tests.magiclink_fixtures:external_method_testing'
+    settings.MAGICLINK_STUDIO_PERMISSION_CACHE_TIMEOUT = 30
+
+    assert not is_studio_allowed_for_user(user)
+    user.email = 'permitted@example.com'
+    assert not is_studio_allowed_for_user(user), 'Should use the cached verdict'
+
+    invalidate_studio_permission_cache(user.id)
+    assert is_studio_allowed_for_user(user), 'Should use the external method after invalidation'
+
+
+@pytest.mark.django_db
+def test_is_studio_allowed_for_user_cache_invalidated_on_save(settings, user):  # NOQA: F811
+    settings.MAGICLINK_STUDIO_PERMISSION_METHOD = 'tahoe_idp.tests.magiclink_fixtures:external_method_testing'
+    settings.MAGICLINK_STUDIO_PERMISSION_CACHE_TIMEOUT = 30
+
+    assert not is_studio_allowed_for_user(user)
+    user.email = 'permitted@example.com'
+    user.save()
+    invalidate_magiclink_user_cache(sender=User, instance=user)
+    assert is_studio_allowed_for_user(user)
+
+
+@pytest.mark.django_db
+def test_is_studio_allowed_cache_lms_invalidation(monkeypatch, settings, user, lms_signal_receivers):  # NOQA: F811
+    """
+    The verdict is cached in LMS, so `is_staff` changes saved there are reflected right away.
+    """
+    monkeypatch.setattr('tahoe_idp.helpers.is_tahoe_idp_enabled', lambda site_configuration=None: False)
+    settings.MAGICLINK_STUDIO_PERMISSION_CACHE_TIMEOUT = 30
+
+    assert not is_studio_allowed_for_user(user)
+    user.is_staff = True
+    user.save()
+    assert is_studio_allowed_for_user(user)
+
+    user.is_staff = False
+    user.save()
+    assert not is_studio_allowed_for_user(user)
+
+
+@pytest.mark.django_db
+def test_is_studio_allowed_for_user_cache_invalidated_on_idp_role_change(settings, user):  # NOQA: F811
+    settings.MAGICLINK_STUDIO_PERMISSION_METHOD = 'tahoe_idp.tests.magiclink_fixtures:external_method_testing'
+    settings.MAGICLINK_STUDIO_PERMISSION_CACHE_TIMEOUT = 30
+
+    cache_idp_permission_flags(user.id, {'tahoe_idp_capabilities': 0, 'tahoe_idp_data_version': 1000})
+    assert not is_studio_allowed_for_user(user)
+    user.email = 'permitted@example.com'
+    assert not is_studio_allowed_for_user(user), 'Should use the cached verdict'
+
+    cache_idp_permission_flags(user.id, {'tahoe_idp_capabilities': 2, 'tahoe_idp_data_version': 2000})
+    assert is_studio_allowed_for_user(user), 'Should use the external method after the IdP data changes'
+
+
+@pytest.mark.django_db
+def test_create_magiclinks():
+    magic_links = create_magiclinks(['user_a', 'user_b'], redirect_url='/test/')
+    assert list(magic_links) == ['user_a', 'user_b']
+    assert MagicLink.objects.filter(redirect_url='/test/', used=False).count() == 2
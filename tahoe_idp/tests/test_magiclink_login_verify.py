@@ -94,3 +94,36 @@ def test_login_verify_custom_verify(client, settings, magic_link):  # NOQA: F811
     response = client.get(url)
     assert response.status_code == 302
     assert response.url == reverse('no_login')
+
+
+@pytest.mark.django_db
+def test_login_verify_sets_studio_session_marker(client, settings, magic_link):  # NOQA: F811
+    settings.MAGICLINK_STUDIO_SESSION_COOKIE_DOMAIN = '.example.com'
+    request = HttpRequest()
+    ml = magic_link(request)
+
+    response = client.get(ml.generate_url(request))
+    cookie = response.cookies[settings.MAGICLINK_STUDIO_SESSION_COOKIE_NAME]
+    assert cookie['domain'] == '.example.com'
+    assert cookie['httponly']
+    assert cookie['max-age'] == settings.MAGICLINK_STUDIO_SESSION_COOKIE_AGE
+
+
+@pytest.mark.django_db
+def test_studio_session_marker_capped_at_session_age(client, settings, magic_link):  # NOQA: F811
+    settings.MAGICLINK_STUDIO_SESSION_COOKIE_DOMAIN = '.example.com'
+    settings.SESSION_COOKIE_AGE = 600
+    request = HttpRequest()
+    ml = magic_link(request)
+
+    response = client.get(ml.generate_url(request))
+    assert response.cookies[settings.MAGICLINK_STUDIO_SESSION_COOKIE_NAME]['max-age'] == 600
+
+
+@pytest.mark.django_db
+def test_login_verify_no_studio_session_marker_by_default(client, settings, magic_link):  # NOQA: F811
+    request = HttpRequest()
+    ml = magic_link(request)
+
+    response = client.get(ml.generate_url(request))
+    assert settings.MAGICLINK_STUDIO_SESSION_COOKIE_NAME not in response.cookies
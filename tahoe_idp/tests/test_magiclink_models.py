@@ -95,7 +95,7 @@ def test_validate_expired(user, magic_link):  # NOQA: F811
     error.match('Magic link has expired')
 
     ml = MagicLink.objects.get(token=ml.token)
-    assert ml.used is True
+    assert ml.used is False, 'Expired links should not be written to'
 
 
 @pytest.mark.django_db
@@ -0,0 +1,193 @@
+"""
+Tests for the magic link storage backends.
+"""
+from datetime import timedelta
+
+import pytest
+from django.http import HttpRequest
+from django.utils import timezone
+
+from tahoe_idp.magiclink_storage import (
+    CacheMagicLinkStorage,
+    DatabaseMagicLinkStorage,
+    get_magiclink_storage,
+)
+from tahoe_idp.models import MagicLink, MagicLinkError
+
+from tahoe_idp.tests.magiclink_fixtures import user  # NOQA: F401
+
+
+CACHE_STORAGE_PATH = 'tahoe_idp.magiclink_storage:CacheMagicLinkStorage'
+
+STORAGE_CLASSES = [DatabaseMagicLinkStorage, CacheMagicLinkStorage]
+
+
+def test_get_magiclink_storage_default():
+    assert isinstance(get_magiclink_storage(), DatabaseMagicLinkStorage), 'Database storage by default'
+
+
+def test_get_magiclink_storage_cache(settings):
+    settings.MAGICLINK_STORAGE_BACKEND = CACHE_STORAGE_PATH
+    assert isinstance(get_magiclink_storage(), CacheMagicLinkStorage)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('storage_class', STORAGE_CLASSES)
+def test_create_and_get(settings, storage_class):
+    storage = storage_class()
+    magic_link = storage.create('test_user', redirect_url='/test/')
+
+    stored_link = storage.get(magic_link.token)
+    assert stored_link.username == 'test_user'
+    assert stored_link.token == magic_link.token
+    assert stored_link.redirect_url == '/test/'
+    assert stored_link.expiry == magic_link.expiry
+    assert stored_link.used is False
+    assert len(stored_link.token) == settings.MAGICLINK_TOKEN_LENGTH
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('storage_class', STORAGE_CLASSES)
+def test_get_missing_token(storage_class):
+    assert storage_class().get('does-not-exist') is None
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('storage_class', STORAGE_CLASSES)
+def test_request_time_limit(storage_class):
+    storage = storage_class()
+    storage.create('test_user')
+    with pytest.raises(MagicLinkError, match='Too many magic login requests'):
+        storage.create('test_user')
+
+    assert storage.create('other_user'), 'The limit is per user'
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('storage_class', STORAGE_CLASSES)
+def test_only_last_link_is_usable(settings, storage_class):
+    settings.MAGICLINK_LOGIN_REQUEST_TIME_LIMIT = 0
+    storage = storage_class()
+    first_link = storage.create('test_user')
+    second_link = storage.create('test_user')
+
+    first_stored_link = storage.get(first_link.token)
+    assert not first_stored_link or first_stored_link.used, 'Previous link should not be usable'
+    assert storage.get(second_link.token).used is False
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('storage_class', STORAGE_CLASSES)
+def test_mark_used(storage_class):
+    storage = storage_class()
+    magic_link = storage.create('test_user', redirect_url='/test/')
+    storage.mark_used(magic_link)
+
+    stored_link = storage.get(magic_link.token)
+    assert stored_link.used is True
+    assert stored_link.redirect_url == '/test/', 'Used links are kept until they expire'
+
+
+def test_cache_storage_does_not_touch_the_database():
+    """
+    No `django_db` mark: any database query would fail this test.
+    """
+    storage = CacheMagicLinkStorage()
+    magic_link = storage.create('test_user')
+    storage.get(magic_link.token)
+    storage.mark_used(magic_link)
+
+
+def test_cache_storage_mark_used_expired_link():
+    storage = CacheMagicLinkStorage()
+    magic_link = storage.create('test_user')
+    magic_link.expiry = timezone.now() - timedelta(seconds=1)
+    storage.mark_used(magic_link)
+    assert storage.get(magic_link.token) is None, 'Expired links are removed'
+
+
+@pytest.mark.django_db
+def test_cache_storage_authenticate(settings, client, user):  # NOQA: F811
+    """
+    End-to-end magic link login through the cache storage.
+    """
+    settings.MAGICLINK_STORAGE_BACKEND = CACHE_STORAGE_PATH
+    storage = get_magiclink_storage()
+    magic_link = storage.create(user.username, redirect_url='/test/')
+
+    response = client.get(magic_link.generate_url(HttpRequest()))
+    assert response.status_code == 302
+    assert response.url == '/test/'
+    assert storage.get(magic_link.token).used is True
+    assert not MagicLink.objects.exists(), 'Should not store links in the database'
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('storage_class', STORAGE_CLASSES)
+def test_bulk_create(storage_class):
+    storage = storage_class()
+    magic_links = storage.bulk_create(['user_a', 'user_b', 'user_a'], redirect_url='/test/')
+
+    assert list(magic_links) == ['user_a', 'user_b'], 'Should keep the order and ignore duplicates'
+    for username, magic_link in magic_links.items():
+        stored_link = storage.get(magic_link.token)
+        assert stored_link.username == username
+        assert stored_link.redirect_url == '/test/'
+        assert stored_link.used is False
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('storage_class', STORAGE_CLASSES)
+def test_bulk_create_skips_rate_limited_users(settings, storage_class):
+    storage = storage_class()
+    previous_link = storage.create('user_a')
+
+    magic_links = storage.bulk_create(['user_a', 'user_b'])
+    assert list(magic_links) == ['user_b'], 'Users over the request time limit are skipped'
+    assert storage.get(previous_link.token).used is False, 'Links of skipped users are kept'
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('storage_class', STORAGE_CLASSES)
+def test_bulk_create_invalidates_previous_links(settings, storage_class):
+    settings.MAGICLINK_LOGIN_REQUEST_TIME_LIMIT = 0
+    storage = storage_class()
+    previous_link = storage.create('user_a')
+
+    magic_links = storage.bulk_create(['user_a'])
+    previous_stored_link = storage.get(previous_link.token)
+    assert not previous_stored_link or previous_stored_link.used, 'Only the last link is usable'
+    assert storage.get(magic_links['user_a'].token).used is False
+
+
+@pytest.mark.django_db
+def test_database_bulk_create_queries(django_assert_num_queries):
+    """
+    The number of queries should not grow with the number of users.
+    """
+    usernames = ['user_{}'.format(i) for i in range(50)]
+    # SAVEPOINT, rate-limit SELECT, invalidation UPDATE, bulk INSERT, RELEASE SAVEPOINT
+    with django_assert_num_queries(5):
+        DatabaseMagicLinkStorage().bulk_create(usernames)
+
+    assert MagicLink.objects.count() == 50
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('storage_class', STORAGE_CLASSES)
+def test_get_usable(storage_class):
+    storage = storage_class()
+    magic_link = storage.create('test_user')
+    assert storage.get_usable(magic_link.token).token == magic_link.token
+
+    storage.mark_used(magic_link)
+    assert storage.get_usable(magic_link.token) is None, 'Used links are not usable'
+    assert storage.get_usable('does-not-exist') is None
+
+
+@pytest.mark.django_db
+def test_database_get_usable_expired():
+    storage = DatabaseMagicLinkStorage()
+    magic_link = storage.create('test_user')
+    MagicLink.objects.filter(pk=magic_link.pk).update(expiry=timezone.now() - timedelta(seconds=1))
+    assert storage.get_usable(magic_link.token) is None, 'Expired links are not usable'
@@ -2,8 +2,14 @@ import pytest
 from unittest.mock import Mock, patch
 
 from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from django.test import RequestFactory
 from django.urls import reverse, reverse_lazy
 
+from tahoe_idp.magiclink_helpers import STUDIO_SESSION_MARKER_SALT, _studio_session_marker_cache_key
+from tahoe_idp.models import MagicLink
+from tahoe_idp.receivers import invalidate_studio_session_marker
 from tahoe_idp.tests.magiclink_fixtures import user  # NOQA: F401
 
 User = get_user_model()
@@ -40,3 +46,66 @@ def test_studio_login(settings, client, user, studio_login_url):  # NOQA: F811
 
     assert response.status_code == 302
     assert response.url.startswith('http://{studio_domain}'.format(studio_domain=settings.MAGICLINK_STUDIO_DOMAIN))
+
+
+def set_studio_session_marker_cookie(settings, client, session_user, username=None, salt=STUDIO_SESSION_MARKER_SALT):
+    """
+    Set the marker cookie of a Studio session of `session_user`, with the `username` of the cookie overridden.
+    """
+    cookie_name = settings.MAGICLINK_STUDIO_SESSION_COOKIE_NAME
+    cache.set(_studio_session_marker_cache_key('marker-id'), session_user.pk)
+    marker = '{username}:marker-id'.format(username=username or session_user.username)
+    client.cookies[cookie_name] = signing.get_cookie_signer(salt=cookie_name + salt).sign(marker)
+
+
+@pytest.mark.django_db
+@patch('tahoe_idp.magiclink_views.is_studio_allowed_for_user', Mock(return_value=True))
+@patch('tahoe_idp.magiclink_views.is_valid_redirect_url', Mock(return_value=True))
+def test_studio_login_skips_magic_link_with_session_marker(settings, client, user):  # NOQA: F811
+    settings.MAGICLINK_STUDIO_SESSION_COOKIE_DOMAIN = '.example.com'
+    client.login(username=user.username, password='password')
+    set_studio_session_marker_cookie(settings, client, user)
+
+    response = client.get(reverse('studio_login'), {'next': '/course/'})
+
+    assert response.status_code == 302
+    assert response.url == 'http://{studio_domain}/course/'.format(studio_domain=settings.MAGICLINK_STUDIO_DOMAIN)
+    assert not MagicLink.objects.exists(), 'Should not create a magic link for an existing Studio session'
+
+
+@pytest.mark.django_db
+@patch('tahoe_idp.magiclink_views.is_studio_allowed_for_user', Mock(return_value=True))
+@pytest.mark.parametrize('cookie_domain,marker_username,marker_salt', [
+    (None, 'test_user', STUDIO_SESSION_MARKER_SALT),  # Feature is disabled
+    ('.example.com', 'other_user', STUDIO_SESSION_MARKER_SALT),  # Marker of another user
+    ('.example.com', 'test_user', 'tampered'),  # Bad signature
+])
+def test_studio_login_invalid_session_marker(settings, client, user, cookie_domain, marker_username,  # NOQA: F811
+                                             marker_salt):
+    settings.MAGICLINK_STUDIO_SESSION_COOKIE_DOMAIN = cookie_domain
+    client.login(username=user.username, password='password')
+    set_studio_session_marker_cookie(settings, client, user, username=marker_username, salt=marker_salt)
+
+    response = client.get(reverse('studio_login'))
+
+    assert response.status_code == 302
+    assert reverse('tahoe_idp:verify_login') in response.url, 'Should go through the magic link'
+    assert MagicLink.objects.filter(username=user.username).exists()
+
+
+@pytest.mark.django_db
+@patch('tahoe_idp.magiclink_views.is_studio_allowed_for_user', Mock(return_value=True))
+def test_studio_login_after_logout(settings, client, user):  # NOQA: F811
+    """
+    The marker is revoked on logout, so a dead Studio session doesn't send the user to Studio in a loop.
+    """
+    settings.MAGICLINK_STUDIO_SESSION_COOKIE_DOMAIN = '.example.com'
+    client.login(username=user.username, password='password')
+    set_studio_session_marker_cookie(settings, client, user)
+
+    logout_request = RequestFactory().get('/logout')
+    logout_request.COOKIES = {key: morsel.value for key, morsel in client.cookies.items()}
+    invalidate_studio_session_marker(sender=User, request=logout_request, user=user)
+
+    response = client.get(reverse('studio_login'))
+    assert reverse('tahoe_idp:verify_login') in response.url, 'Should go through the magic link'
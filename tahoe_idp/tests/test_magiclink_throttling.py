@@ -0,0 +1,102 @@
+"""
+Tests for the magic link verification throttling.
+"""
+import pytest
+from django.http import HttpRequest
+
+from tahoe_idp.magiclink_backends import MagicLinkBackend
+from tahoe_idp.magiclink_throttling import (
+    get_client_ip,
+    is_verification_blocked,
+    record_verification_failure,
+)
+
+from tahoe_idp.tests.magiclink_fixtures import magic_link, user  # NOQA: F401
+
+
+def request_from(ip_address, **meta):
+    request = HttpRequest()
+    request.META['REMOTE_ADDR'] = ip_address
+    request.META.update(meta)
+    return request
+
+
+def test_rejected_token_is_blocked():
+    request = request_from('10.0.0.1')
+    assert not is_verification_blocked(request, 'bad-token')
+
+    record_verification_failure(request, 'bad-token')
+    assert is_verification_blocked(request_from('10.0.0.2'), 'bad-token'), 'Block the token for everyone'
+    assert not is_verification_blocked(request_from('10.0.0.2'), 'other-token')
+
+
+def test_failure_limit_per_ip(settings):
+    settings.MAGICLINK_VERIFY_FAILURE_LIMIT = 3
+    request = request_from('10.0.0.1')
+    for i in range(3):
+        record_verification_failure(request, 'bad-token-{}'.format(i))
+
+    assert is_verification_blocked(request, 'new-token')
+    assert not is_verification_blocked(request_from('10.0.0.2'), 'new-token'), 'Other IPs are allowed'
+
+
+def test_failure_limit_disabled_by_default():
+    request = request_from('10.0.0.1')
+    for i in range(50):
+        record_verification_failure(request, 'bad-token-{}'.format(i))
+
+    assert not is_verification_blocked(request, 'new-token')
+
+
+@pytest.mark.parametrize('header_value, trusted_proxy_count, client_ip', [
+    ('203.0.113.7', 0, '203.0.113.7'),
+    ('198.51.100.1, 203.0.113.7', 0, '203.0.113.7'),
+    ('198.51.100.1, 203.0.113.7, 10.0.0.5', 1, '203.0.113.7'),
+    ('203.0.113.7', 3, '203.0.113.7'),
+    ('', 0, None),
+])
+def test_get_client_ip(settings, header_value, trusted_proxy_count, client_ip):
+    """
+    The client IP is read from the right of the header, entries added by the client are ignored.
+    """
+    settings.MAGICLINK_VERIFY_CLIENT_IP_HEADER = 'HTTP_X_FORWARDED_FOR'
+    settings.MAGICLINK_VERIFY_TRUSTED_PROXY_COUNT = trusted_proxy_count
+    assert get_client_ip(request_from('10.0.0.1', HTTP_X_FORWARDED_FOR=header_value)) == client_ip
+
+
+@pytest.mark.django_db
+def test_backend_rejects_repeated_bad_token_without_database(user, django_assert_num_queries):  # NOQA: F811
+    request = request_from('10.0.0.1')
+    backend = MagicLinkBackend()
+    assert backend.authenticate(request=request, token='bad-token', username=user.username) is None
+
+    with django_assert_num_queries(0):
+        assert backend.authenticate(request=request, token='bad-token', username=user.username) is None
+
+
+@pytest.mark.django_db
+def test_backend_bogus_tokens_dont_lock_out_username(settings, user, magic_link):  # NOQA: F811
+    """
+    Bogus tokens sent for a username from other IPs don't block the valid token of the user.
+    """
+    settings.MAGICLINK_VERIFY_FAILURE_LIMIT = 2
+    request = request_from('10.0.0.1')
+    ml = magic_link(request)
+    backend = MagicLinkBackend()
+    for i in range(5):
+        backend.authenticate(request=request_from('10.0.1.{}'.format(i)), token='x{}'.format(i), username=user.username)
+
+    assert backend.authenticate(request=request, token=ml.token, username=user.username)
+
+
+@pytest.mark.django_db
+def test_backend_throttles_ip(settings, user, magic_link):  # NOQA: F811
+    settings.MAGICLINK_VERIFY_FAILURE_LIMIT = 2
+    request = request_from('10.0.0.1')
+    ml = magic_link(request)
+    backend = MagicLinkBackend()
+    for i in range(2):
+        backend.authenticate(request=request, token='bad-token-{}'.format(i), username='someone_else')
+
+    assert backend.authenticate(request=request, token=ml.token, username=user.username) is None, 'IP is throttled'
+    assert backend.authenticate(request=request_from('10.0.0.2'), token=ml.token, username=user.username)
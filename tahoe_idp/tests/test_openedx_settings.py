@@ -55,6 +55,16 @@ def test_cms_authentication_backend_settings(settings):
         'value': 'not integer',
         'message': '"MAGICLINK_LOGIN_REQUEST_TIME_LIMIT" must be an integer',
     },
+    {
+        'name': 'MAGICLINK_STUDIO_SESSION_COOKIE_AGE',
+        'value': 'not integer',
+        'message': '"MAGICLINK_STUDIO_SESSION_COOKIE_AGE" must be an integer',
+    },
+    {
+        'name': 'MAGICLINK_VERIFY_FAILURE_LIMIT',
+        'value': 'not integer',
+        'message': '"MAGICLINK_VERIFY_FAILURE_LIMIT" must be an integer',
+    },
 ])
 def test_wrong_magiclink_settings(settings, invalid_test_case):
     """
@@ -79,4 +89,8 @@ def test_token_length_configs(settings):
 
     settings.MAGICLINK_TOKEN_LENGTH = 60
     common_production.magiclink_settings(settings)
-    assert settings.MAGICLINK_TOKEN_LENGTH == 60, 'allow setting any large value'
+    assert settings.MAGICLINK_TOKEN_LENGTH == 60, 'allow setting large values'
+
+    settings.MAGICLINK_TOKEN_LENGTH = 300
+    common_production.magiclink_settings(settings)
+    assert settings.MAGICLINK_TOKEN_LENGTH == 255, 'do not allow more than the database column length'
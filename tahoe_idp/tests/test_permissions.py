@@ -2,7 +2,15 @@
 Tests for the permission module.
 """
 
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+
 from tahoe_idp.permissions import (
+    CAPABILITY_COURSE_AUTHOR,
+    CAPABILITY_ORGANIZATION_ADMIN,
+    CAPABILITY_ORGANIZATION_STAFF,
+    get_capabilities,
+    get_role_registry,
     get_role_with_default,
     is_course_author,
     is_organization_admin,
@@ -54,3 +62,60 @@ def test_get_role_with_default():
     assert get_role_with_default(user_data={
         'platform_role': 'Learner',
     }) == 'Learner', 'Should read the provided `Learner` role correctly'
+
+
+def test_get_role_with_default_multiple_roles():
+    """
+    Tests for the `get_role_with_default` helper with a list of roles.
+    """
+    assert get_role_with_default(user_data={
+        'platform_role': ['Staff', 'course_author'],
+    }) == ['Staff', 'course_author'], 'Should read the list of roles as-is'
+
+    assert get_role_with_default(user_data={'platform_role': []}) == 'learner', 'Default to learner for no roles'
+
+
+def test_get_capabilities():
+    """
+    Tests for the `get_capabilities` helper.
+    """
+    assert get_capabilities('Learner') == 0
+    assert get_capabilities('SomethingElse') == 0, 'Unknown roles have no capabilities'
+    assert get_capabilities('Administrator') == CAPABILITY_ORGANIZATION_ADMIN | CAPABILITY_ORGANIZATION_STAFF
+    assert get_capabilities(['staff', 'Course_Author']) == CAPABILITY_ORGANIZATION_STAFF | CAPABILITY_COURSE_AUTHOR
+    assert get_capabilities(['staff', None, 5]) == CAPABILITY_ORGANIZATION_STAFF, 'Should ignore non-string roles'
+    assert get_capabilities(None) == 0
+
+
+def test_multiple_roles():
+    """
+    The permission helpers accept a list of roles.
+    """
+    roles = ['learner', 'course_author']
+    assert is_course_author(roles)
+    assert not is_organization_staff(roles)
+    assert not is_organization_admin(roles)
+
+    assert is_organization_staff(['course_author', 'staff'])
+
+
+def test_extra_roles(settings):
+    """
+    Roles can be added via `TAHOE_IDP_EXTRA_ROLES`.
+    """
+    assert not is_course_author('Observer')
+
+    settings.TAHOE_IDP_EXTRA_ROLES = {'Observer': ['course_author']}
+    assert is_course_author('observer')
+    assert get_capabilities('Observer') == CAPABILITY_COURSE_AUTHOR
+
+
+def test_extra_roles_unknown_capability(settings):
+    settings.TAHOE_IDP_EXTRA_ROLES = {'observer': ['superpowers']}
+    with pytest.raises(ImproperlyConfigured, match='Unknown capability "superpowers"'):
+        get_role_registry()
+
+
+def test_role_registry_is_frozen():
+    with pytest.raises(TypeError):
+        get_role_registry()['learner'] = CAPABILITY_ORGANIZATION_ADMIN
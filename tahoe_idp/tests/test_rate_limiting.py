@@ -0,0 +1,168 @@
+"""
+Tests for the rate_limiting module.
+"""
+import pytest
+from unittest.mock import patch
+
+from tahoe_idp.helpers import get_api_client
+from tahoe_idp.rate_limiting import (
+    INTERACTIVE_MAX_WAIT_SECONDS,
+    TRAFFIC_BATCH,
+    TRAFFIC_INTERACTIVE,
+    ClusterRateLimiter,
+    TokenBucket,
+    batch_traffic,
+    get_api_rate_limiter,
+    get_traffic,
+)
+
+from .conftest import mock_tahoe_idp_api_settings
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_burst():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=3, clock=clock, sleep=clock.sleep)
+    assert [bucket.try_acquire() for _i in range(4)] == [True, True, True, False]
+
+    clock.now += 0.5
+    assert bucket.try_acquire(), 'Should refill one token in 1/rate seconds'
+    assert not bucket.try_acquire()
+
+
+def test_token_bucket_acquire_waits():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=4, clock=clock, sleep=clock.sleep)
+    for _i in range(5):
+        bucket.acquire()
+
+    assert clock.sleeps == [0.25] * 4
+    assert clock.now == 1.0
+
+
+def test_token_bucket_capacity_limit():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, capacity=2, clock=clock, sleep=clock.sleep)
+    clock.now += 60
+    assert [bucket.try_acquire() for _i in range(3)] == [True, True, False], 'Idle time should not exceed capacity'
+
+
+@pytest.mark.parametrize('kwargs', [{'rate': 0}, {'rate': -1}, {'rate': 1, 'capacity': 0}])
+def test_token_bucket_validation(kwargs):
+    with pytest.raises(ValueError):
+        TokenBucket(**kwargs)
+
+
+def test_cluster_rate_limiter_shared_budget():
+    """
+    Limiters with the same name share the budget, like in different workers.
+    """
+    clock = FakeClock()
+    clock.now = 1000.0
+    worker_limiters = [ClusterRateLimiter('test', limit=3, clock=clock, sleep=clock.sleep) for _i in range(2)]
+    assert [limiter.try_acquire() for limiter in worker_limiters * 2] == [True, True, True, False]
+
+    clock.now += 1
+    assert worker_limiters[1].try_acquire(), 'Should allow calls in the next window'
+
+
+def test_cluster_rate_limiter_acquire_waits():
+    clock = FakeClock()
+    clock.now = 1000.25
+    limiter = ClusterRateLimiter('test', limit=2, clock=clock, sleep=clock.sleep)
+    for _i in range(3):
+        limiter.acquire()
+
+    assert clock.sleeps == [0.75], 'Should wait for the next window'
+
+
+def test_cluster_rate_limiter_max_wait():
+    """
+    A call stops waiting after `max_wait` even if the other workers keep using up the budget.
+    """
+    clock = FakeClock()
+    clock.now = 1000.5
+    limiter = ClusterRateLimiter('test', limit=1, max_wait=1.2, clock=clock, sleep=clock.sleep)
+    assert limiter.acquire()
+
+    with patch.object(limiter, 'try_acquire', return_value=False):
+        assert not limiter.acquire()
+    assert clock.sleeps == pytest.approx([0.5, 0.7]), 'Should wait for the next window, then until the max wait'
+
+
+@pytest.mark.parametrize('kwargs', [{'limit': 0}, {'limit': 1, 'window': 0}, {'limit': 1, 'max_wait': -1}])
+def test_cluster_rate_limiter_validation(kwargs):
+    with pytest.raises(ValueError):
+        ClusterRateLimiter('test', **kwargs)
+
+
+def test_batch_traffic():
+    assert get_traffic() == TRAFFIC_INTERACTIVE
+    with batch_traffic():
+        assert get_traffic() == TRAFFIC_BATCH
+        with batch_traffic():
+            assert get_traffic() == TRAFFIC_BATCH
+        assert get_traffic() == TRAFFIC_BATCH
+    assert get_traffic() == TRAFFIC_INTERACTIVE
+
+
+def test_api_rate_limiters(settings):
+    assert get_api_rate_limiter(TRAFFIC_INTERACTIVE) is None, 'Should not limit by default'
+
+    settings.TAHOE_IDP_API_RATE_LIMITS = {TRAFFIC_BATCH: 1}
+    assert get_api_rate_limiter(TRAFFIC_INTERACTIVE) is None
+    batch_limiter = get_api_rate_limiter(TRAFFIC_BATCH)
+    assert batch_limiter.limit == 1
+    assert batch_limiter.max_wait is None, 'Batch calls should wait for the budget'
+
+    settings.TAHOE_IDP_API_RATE_LIMITS = {TRAFFIC_INTERACTIVE: 2, TRAFFIC_BATCH: 1}
+    with patch('tahoe_idp.rate_limiting.time.time', return_value=1000.0):
+        assert get_api_rate_limiter(TRAFFIC_BATCH).try_acquire()
+        assert not get_api_rate_limiter(TRAFFIC_BATCH).try_acquire()
+        assert get_api_rate_limiter(TRAFFIC_INTERACTIVE).try_acquire(), 'Should have separate budgets'
+    assert get_api_rate_limiter(TRAFFIC_INTERACTIVE).max_wait == INTERACTIVE_MAX_WAIT_SECONDS
+
+
+@pytest.mark.usefixtures('mock_tahoe_idp_settings')
+@mock_tahoe_idp_api_settings
+def test_api_client_rate_limit(settings, requests_mock):
+    settings.TAHOE_IDP_API_RATE_LIMITS = {TRAFFIC_INTERACTIVE: 10, TRAFFIC_BATCH: 5}
+    requests_mock.post('https://domain/api/user/forgot-password', status_code=202, text='')
+
+    with patch.object(ClusterRateLimiter, 'acquire', autospec=True, return_value=True) as mock_acquire:
+        get_api_client().forgot_password({'loginId': 'someone@example.com'})
+        with batch_traffic():
+            batch_api_client = get_api_client()
+        batch_api_client.forgot_password({'loginId': 'someone@example.com'})
+
+    assert [call[0][0].name for call in mock_acquire.call_args_list] == ['api.interactive', 'api.batch']
+
+
+@pytest.mark.usefixtures('mock_tahoe_idp_settings')
+@mock_tahoe_idp_api_settings
+def test_api_client_over_interactive_rate_limit(settings, requests_mock, caplog):
+    """
+    Interactive calls go ahead once the max wait is over instead of holding the request.
+    """
+    settings.TAHOE_IDP_API_RATE_LIMITS = {TRAFFIC_INTERACTIVE: 1}
+    forgot_password_mock = requests_mock.post('https://domain/api/user/forgot-password', status_code=202, text='')
+
+    with patch.object(ClusterRateLimiter, 'try_acquire', return_value=False):
+        with patch('tahoe_idp.rate_limiting.time.sleep') as mock_sleep:
+            get_api_client().forgot_password({'loginId': 'someone@example.com'})
+
+    assert sum(call[0][0] for call in mock_sleep.call_args_list) <= INTERACTIVE_MAX_WAIT_SECONDS
+    assert forgot_password_mock.called
+    assert 'Calling FusionAuth forgot_password over the interactive rate limit' in caplog.text
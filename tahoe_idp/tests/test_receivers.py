@@ -0,0 +1,157 @@
+"""
+Tests for the signal receivers.
+"""
+import json
+
+import pytest
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.db import transaction
+from requests import HTTPError
+from unittest.mock import Mock, patch
+
+from tahoe_idp.models import IdpSyncOutboxEntry
+from tahoe_idp.receivers import PendingUserSync, _get_pending_user_syncs, user_sync_to_idp
+
+
+pytestmark = [
+    pytest.mark.django_db(transaction=True),
+    pytest.mark.usefixtures('idp_enabled'),
+]
+
+
+@pytest.fixture
+def idp_enabled(monkeypatch):
+    monkeypatch.setattr('tahoe_idp.helpers.is_tahoe_idp_enabled', lambda site_configuration=None: True)
+
+
+@pytest.fixture
+def user():
+    return User.objects.create(username='someone', first_name='Some', last_name='One')
+
+
+def save_user(user, **fields):
+    """
+    Save the user and call the receiver, which is connected by the Open edX plugin signals config.
+    """
+    for name, value in fields.items():
+        setattr(user, name, value)
+    user.save()
+    user_sync_to_idp(sender=User, instance=user, created=False)
+
+
+@patch('tahoe_idp.api.update_user')
+def test_user_sync_to_idp_on_commit(mock_update_user, user):
+    """
+    Several saves in a transaction are sent once with the final state after the commit.
+    """
+    with transaction.atomic():
+        save_user(user, first_name='First')
+        save_user(user, last_name='Last')
+        assert not mock_update_user.called, 'Should wait for the commit'
+
+    mock_update_user.assert_called_once_with(user, {'user': {'firstName': 'First', 'lastName': 'Last'}})
+
+
+@patch('tahoe_idp.api.update_user')
+def test_user_sync_to_idp_without_transaction(mock_update_user, user):
+    save_user(user, first_name='First')
+    save_user(user, first_name='Second')
+    assert mock_update_user.call_count == 2, 'Should be sent immediately in autocommit mode'
+
+
+@patch('tahoe_idp.api.update_user')
+def test_user_sync_to_idp_rollback(mock_update_user, user):
+    """
+    Rolled back changes are not sent, even partially in the next transaction.
+    """
+    with pytest.raises(RuntimeError):
+        with transaction.atomic():
+            save_user(user, first_name='Rolled back')
+            raise RuntimeError('Rollback')
+    assert not mock_update_user.called
+
+    user.refresh_from_db()
+    with transaction.atomic():
+        save_user(user, last_name='Last')
+    mock_update_user.assert_called_once_with(user, {'user': {'firstName': 'Some', 'lastName': 'Last'}})
+
+
+@patch('tahoe_idp.api.update_user')
+def test_user_sync_to_idp_outbox(mock_update_user, user, settings, monkeypatch):
+    """
+    A single outbox entry with the final state is written per user per transaction.
+    """
+    settings.TAHOE_IDP_SYNC_OUTBOX_ENABLED = True
+    site = Site.objects.create(domain='tenant.example.com', name='tenant')
+    monkeypatch.setattr('tahoe_idp.helpers.get_current_site', lambda: site)
+    with transaction.atomic():
+        save_user(user, first_name='First')
+        save_user(user, last_name='Last')
+
+    assert not mock_update_user.called
+    entry = IdpSyncOutboxEntry.objects.get()
+    assert entry.site == site
+    assert json.loads(entry.properties) == {'user': {'firstName': 'First', 'lastName': 'Last'}}
+
+
+@patch('tahoe_idp.api.update_user', side_effect=HTTPError('503 Server Error'))
+def test_user_sync_to_idp_failure_runs_other_callbacks(_mock_update_user, user, caplog):
+    """
+    An IdP failure after the commit is logged, and the `on_commit` callbacks of other apps still run.
+    """
+    other_callback = Mock()
+    with transaction.atomic():
+        save_user(user, first_name='First')
+        transaction.on_commit(other_callback)
+
+    other_callback.assert_called_once_with()
+    assert 'Could not sync the changes of user {}'.format(user.pk) in caplog.text
+
+
+@patch('tahoe_idp.api.update_user')
+def test_user_sync_to_idp_forgets_rolled_back_syncs(_mock_update_user, user):
+    other_user = User.objects.create(username='other')
+    with pytest.raises(RuntimeError):
+        with transaction.atomic():
+            save_user(user, first_name='Rolled back')
+            raise RuntimeError('Rollback')
+    assert list(_get_pending_user_syncs()) == [user.pk]
+
+    with transaction.atomic():
+        save_user(other_user, first_name='Other')
+        assert list(_get_pending_user_syncs()) == [other_user.pk], 'Should drop the rolled back syncs'
+    assert not _get_pending_user_syncs()
+
+
+@patch('tahoe_idp.api.update_user')
+def test_user_sync_to_idp_savepoint_rollback(mock_update_user, user):
+    """
+    A sync dropped by the rollback of a savepoint is registered again on the next save.
+    """
+    with transaction.atomic():
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                save_user(user, first_name='Rolled back')
+                raise RuntimeError('Rollback')
+        user.refresh_from_db()
+        save_user(user, last_name='Last')
+
+    mock_update_user.assert_called_once_with(user, {'user': {'firstName': 'Some', 'lastName': 'Last'}})
+
+
+@patch('tahoe_idp.api.update_user')
+def test_user_sync_to_idp_many_users(mock_update_user):
+    """
+    Saving many users in a transaction doesn't look up the pending syncs of the other users.
+    """
+    User.objects.bulk_create([User(username='user_{}'.format(i)) for i in range(2000)])
+    users = list(User.objects.all())
+    with patch.object(PendingUserSync, 'is_registered', autospec=True, return_value=True) as mock_is_registered:
+        with transaction.atomic():
+            for user in users:
+                save_user(user, first_name='First')
+                save_user(user, last_name='Last')
+
+    assert mock_is_registered.call_count == len(users), 'Should only check the sync of the saved user'
+    assert mock_update_user.call_count == len(users)
@@ -0,0 +1,41 @@
+"""
+Tests for the precompiled redirect whitelist.
+"""
+from django.test import override_settings
+
+from tahoe_idp.redirect_whitelist import RedirectWhitelist, get_redirect_whitelist
+
+
+def test_exact_hosts():
+    whitelist = RedirectWhitelist(['example.com', 'Other.example.com'])
+    assert 'example.com' in whitelist
+    assert 'other.example.com' in whitelist, 'Hosts are case insensitive'
+    assert 'sub.example.com' not in whitelist
+    assert 'example.org' not in whitelist
+
+
+def test_wildcard_hosts():
+    whitelist = RedirectWhitelist(['*.example.com', '*.customers.example.org'])
+    assert 'a.example.com' in whitelist
+    assert 'a.b.example.com' in whitelist
+    assert 'example.com' not in whitelist, 'Wildcards match subdomains only'
+    assert 'a.customers.example.org' in whitelist
+    assert 'a.example.org' not in whitelist
+    assert 'customers.example.org' not in whitelist
+    assert 'notexample.com' not in whitelist
+
+
+def test_allowed_hosts_includes_request_host():
+    allowed_hosts = RedirectWhitelist(['*.example.com']).allowed_hosts('lms.local')
+    assert 'lms.local' in allowed_hosts
+    assert 'a.example.com' in allowed_hosts
+    assert 'other.local' not in allowed_hosts
+
+
+def test_get_redirect_whitelist_is_compiled_once():
+    assert get_redirect_whitelist() is get_redirect_whitelist()
+
+    with override_settings(LOGIN_REDIRECT_WHITELIST=['*.example.com']):
+        assert 'a.example.com' in get_redirect_whitelist(), 'Should recompile when the setting changes'
+
+    assert 'a.example.com' not in get_redirect_whitelist()
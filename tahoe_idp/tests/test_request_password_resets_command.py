@@ -0,0 +1,111 @@
+"""
+Tests for the `request_password_resets` management command.
+"""
+from io import StringIO
+
+import pytest
+from django.contrib.sites.models import Site
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from requests import HTTPError
+from unittest.mock import Mock, call, patch
+
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def site_configuration(monkeypatch):
+    site = Site.objects.create(domain='tenant.example.com', name='tenant')
+    site_configuration = Mock(site=site)
+    monkeypatch.setattr('tahoe_idp.helpers.get_site_configuration', Mock(return_value=site_configuration))
+    return site_configuration
+
+
+def request_password_resets(*args, **kwargs):
+    out = StringIO()
+    err = StringIO()
+    call_command('request_password_resets', *args, stdout=out, stderr=err, **kwargs)
+    return out.getvalue(), err.getvalue()
+
+
+@patch('tahoe_idp.api.request_password_reset')
+def test_request_password_resets(mock_reset, tmp_path, site_configuration):
+    emails_file = tmp_path / 'emails.txt'
+    emails_file.write_text('a@example.com\nB@example.com\n\nb@example.com\n')
+
+    out, err = request_password_resets(
+        'c@example.com', '--file', str(emails_file), '--rate', '1000', '--site', 'tenant.example.com',
+    )
+
+    assert mock_reset.call_args_list == [
+        call(email, site_configuration=site_configuration)
+        for email in ['c@example.com', 'a@example.com', 'B@example.com']
+    ]
+    assert 'Sent 3 password resets, 0 failed' in out
+    assert not err
+
+
+@patch('tahoe_idp.api.request_password_reset')
+@pytest.mark.usefixtures('site_configuration')
+def test_request_password_resets_checkpoint(mock_reset, tmp_path):
+    """
+    Sent emails are checkpointed and skipped when resuming, failed ones are retried.
+    """
+    checkpoint_file = tmp_path / 'checkpoint.txt'
+    mock_reset.side_effect = [None, HTTPError('503 Server Error')]
+
+    out, err = request_password_resets(
+        'a@example.com', 'b@example.com', '--rate', '1000', '--checkpoint', str(checkpoint_file),
+        '--site', 'tenant.example.com',
+    )
+    assert 'Sent 1 password resets, 1 failed' in out
+    assert 'Failed b@example.com' in err
+    assert checkpoint_file.read_text() == 'a@example.com\n'
+
+    mock_reset.reset_mock(side_effect=True)
+    out, _err = request_password_resets(
+        'A@example.com', 'b@example.com', '--rate', '1000', '--checkpoint', str(checkpoint_file),
+        '--site', 'tenant.example.com',
+    )
+    assert [reset_call[0][0] for reset_call in mock_reset.call_args_list] == ['b@example.com']
+    assert 'Skipping 1 emails already in the checkpoint' in out
+    assert checkpoint_file.read_text() == 'a@example.com\nb@example.com\n'
+
+
+@pytest.mark.usefixtures('site_configuration')
+def test_request_password_resets_validation():
+    with pytest.raises(CommandError, match='Provide emails'):
+        request_password_resets('--site', 'tenant.example.com')
+
+    with pytest.raises(CommandError, match='--rate must be a positive number'):
+        request_password_resets('a@example.com', '--rate', '0', '--site', 'tenant.example.com')
+
+    with pytest.raises(CommandError, match='Site "unknown.example.com" does not exist'):
+        request_password_resets('a@example.com', '--site', 'unknown.example.com')
+
+    with pytest.raises(CommandError, match='the following arguments are required: --site'):
+        request_password_resets('a@example.com')
+
+
+def test_request_password_resets_uses_site_tenant(settings, requests_mock):
+    """
+    The IdP client is configured from the `--site` configuration, there's no current site in commands.
+    """
+    settings.TAHOE_IDP_CONFIGS = {'BASE_URL': 'https://domain', 'API_KEY': 'dummy-api-key'}
+    site = Site.objects.create(domain='tenant.example.com', name='tenant')
+    site_configuration = Mock(site=site, admin_values={'ENABLE_TAHOE_IDP': True, 'TAHOE_IDP_TENANT_ID': 'tenant-xyz'})
+
+    def get_admin_value(name, default=None, site_configuration=None):
+        assert site_configuration is not None, 'Should not read the configuration of the current site'
+        return site_configuration.admin_values.get(name, default)
+    forgot_password_mock = requests_mock.post('https://domain/api/user/forgot-password', status_code=202, text='')
+
+    with patch('tahoe_idp.helpers.get_site_configuration', return_value=site_configuration) as mock_get_config:
+        with patch('site_config_client.openedx.api.get_admin_value', side_effect=get_admin_value):
+            out, _err = request_password_resets('a@example.com', '--site', 'tenant.example.com', '--rate', '1000')
+
+    mock_get_config.assert_called_once_with(site)
+    assert 'Sent 1 password resets, 0 failed' in out
+    assert forgot_password_mock.last_request.headers['X-FusionAuth-TenantId'] == 'tenant-xyz'
+    assert forgot_password_mock.last_request.json() == {'loginId': 'a@example.com'}
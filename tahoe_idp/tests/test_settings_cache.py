@@ -0,0 +1,22 @@
+"""
+Tests for the settings_cache module.
+"""
+from django.conf import settings as django_settings
+
+from tahoe_idp.settings_cache import cached_until_setting_changed
+
+
+@cached_until_setting_changed('TAHOE_IDP_TEST_SETTING')
+def get_test_setting():
+    return [getattr(django_settings, 'TAHOE_IDP_TEST_SETTING', None)]
+
+
+def test_cached_until_setting_changed(settings):
+    assert get_test_setting() is get_test_setting(), 'Should be cached for the process'
+
+    settings.TAHOE_IDP_TEST_SETTING = 'changed'
+    assert get_test_setting() == ['changed']
+
+    cached_value = get_test_setting()
+    settings.TAHOE_IDP_OTHER_SETTING = 'changed'
+    assert get_test_setting() is cached_value, 'Should ignore the other settings'
@@ -0,0 +1,82 @@
+"""
+Tests for the singleflight module.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import pytest
+from unittest.mock import patch
+
+from tahoe_idp import helpers
+from tahoe_idp.singleflight import Group
+
+
+def call_concurrently(group, fn, callers=5):
+    """
+    Call `group.do` from several threads while `fn` is blocked until all of them are waiting.
+    """
+    release = threading.Event()
+
+    def blocked_fn():
+        release.wait(timeout=5)
+        return fn()
+
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        futures = [executor.submit(group.do, 'key', blocked_fn) for _i in range(callers)]
+        deadline = time.monotonic() + 5
+        while group._calls.get('key') is None or group._calls['key'].waiters < callers - 1:
+            assert time.monotonic() < deadline, 'All callers should join the in-flight call'
+            time.sleep(0.01)
+        release.set()
+        return futures
+
+
+def test_group_shares_in_flight_call():
+    calls = []
+    futures = call_concurrently(Group(), lambda: calls.append(1) or 'result')
+    assert [future.result() for future in futures] == [('result', True)] * 5
+    assert len(calls) == 1
+
+
+def test_group_shares_exceptions():
+    futures = call_concurrently(Group(), lambda: 1 / 0)
+    for future in futures:
+        with pytest.raises(ZeroDivisionError):
+            future.result()
+
+
+def test_group_sequential_calls():
+    group = Group()
+    assert group.do('key', lambda: 1) == (1, False)
+    assert group.do('key', lambda: 2) == (2, False), 'Should not reuse a finished call'
+    assert not group._calls
+
+
+def test_fusionauth_retrieve_user_singleflight(settings):
+    """
+    Concurrent reads of the same user make one IdP request and get their own copies of the record.
+    """
+    settings.TAHOE_IDP_USER_CACHE_TIMEOUT = 0
+    release = threading.Event()
+    fetches = []
+
+    def fetch_idp_user(user_uuid):
+        fetches.append(user_uuid)
+        release.wait(timeout=5)
+        return {'id': user_uuid, 'data': {}}
+
+    with patch('tahoe_idp.helpers._fetch_idp_user', side_effect=fetch_idp_user):
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [executor.submit(helpers.fusionauth_retrieve_user, 'uuid') for _i in range(3)]
+            deadline = time.monotonic() + 5
+            while helpers._idp_user_reads._calls.get('uuid') is None or \
+                    helpers._idp_user_reads._calls['uuid'].waiters < 2:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            release.set()
+            idp_users = [future.result() for future in futures]
+
+    assert fetches == ['uuid']
+    assert all(idp_user == {'id': 'uuid', 'data': {}} for idp_user in idp_users)
+    assert len({id(idp_user) for idp_user in idp_users}) == 3
@@ -0,0 +1,97 @@
+"""
+Tests for the tracing hooks.
+"""
+import contextlib
+
+import pytest
+from unittest.mock import patch
+
+from tahoe_idp import tracing
+from tahoe_idp.backend import TahoeIdpOAuth2
+from tahoe_idp.helpers import get_api_client
+
+from .conftest import MOCK_TENANT_ID, mock_tahoe_idp_api_settings
+
+
+class RecordingSpan:
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = dict(attributes or {})
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_exception(self, exception):
+        pass
+
+
+class RecordingTracer:
+    """
+    Test tracer factory that keeps the started spans.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.spans = []
+
+    @contextlib.contextmanager
+    def start_as_current_span(self, name, attributes=None):
+        span = RecordingSpan(name, attributes)
+        self.spans.append(span)
+        yield span
+
+
+@pytest.fixture
+def tracer(settings):
+    settings.TAHOE_IDP_TRACER_FACTORY = 'tahoe_idp.tests.test_tracing:RecordingTracer'
+    return tracing.get_tracer()
+
+
+def test_no_op_tracer_by_default():
+    assert isinstance(tracing.get_tracer(), tracing.NoOpTracer)
+    with tracing.start_span('test', {'key': 'value'}) as span:
+        span.set_attribute('other_key', 'value')
+
+
+def test_start_span_drops_none_attributes(tracer):
+    with tracing.start_span('test', {'key': 'value', 'empty': None}):
+        pass
+    assert tracer.name == 'tahoe_idp'
+    assert tracer.spans[0].name == 'test'
+    assert tracer.spans[0].attributes == {'key': 'value'}
+
+
+@pytest.mark.usefixtures('mock_tahoe_idp_settings')
+@mock_tahoe_idp_api_settings
+def test_api_client_call_span(tracer, requests_mock):
+    requests_mock.post('https://domain/api/user/forgot-password', status_code=202, text='')
+    get_api_client().forgot_password({'loginId': 'someone@example.com'})
+
+    [span] = tracer.spans
+    assert span.name == 'tahoe_idp.fusionauth.forgot_password'
+    assert span.attributes == {
+        'tahoe_idp.tenant_id': MOCK_TENANT_ID,
+        'tahoe_idp.traffic': 'interactive',
+        'http.status_code': 202,
+    }
+
+
+@patch('tahoe_idp.backend.time.sleep')
+@patch('tahoe_idp.helpers.fusionauth_retrieve_user')
+def test_get_user_details_span(mock_get_idp_user, _mock_sleep, tracer):
+    """
+    The span of `get_user_details` is tagged with the tenant and the number of retries.
+    """
+    mock_get_idp_user.side_effect = [
+        {'id': 'idp-user-id', 'email': 'someone@example.com', 'tenantId': MOCK_TENANT_ID},
+        {'id': 'idp-user-id', 'email': 'someone@example.com', 'tenantId': MOCK_TENANT_ID, 'username': 'someone'},
+    ]
+
+    TahoeIdpOAuth2().get_user_details({'userId': 'idp-user-id'})
+
+    [span] = tracer.spans
+    assert span.name == 'tahoe_idp.backend.get_user_details'
+    assert span.attributes == {
+        'tahoe_idp.tenant_id': MOCK_TENANT_ID,
+        'tahoe_idp.retry_count': 1,
+    }
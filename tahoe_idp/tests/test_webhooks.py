@@ -0,0 +1,190 @@
+"""
+Tests for the FusionAuth webhook view and events processing.
+"""
+from base64 import b64encode
+import hashlib
+import json
+
+import jwt
+import pytest
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.signals import post_save
+from django.urls import reverse
+from social_django.models import UserSocialAuth
+from unittest.mock import patch
+
+from tahoe_idp.constants import BACKEND_NAME
+from tahoe_idp.helpers import (
+    cache_idp_user,
+    get_idp_permission_flags_cache_key,
+    get_idp_user_cache_key,
+    wait_for_idp_user_ready,
+)
+from tahoe_idp.webhooks import process_events
+
+
+WEBHOOK_SECRET = 'a-webhook-secret-of-at-least-32-bytes'
+IDP_USER_ID = '2a106a94-c8b0-4f0b-bb69-fea0022c18d8'
+
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def webhook_settings(mock_tahoe_idp_settings, settings):
+    settings.TAHOE_IDP_CONFIGS = dict(settings.TAHOE_IDP_CONFIGS, WEBHOOK_SECRET=WEBHOOK_SECRET)
+    return settings
+
+
+@pytest.fixture
+def user():
+    user = User.objects.create(username='someone', email='old@example.com')
+    UserSocialAuth.objects.create(user=user, uid=IDP_USER_ID, provider=BACKEND_NAME, extra_data={
+        'tahoe_idp_capabilities': 0,
+    })
+    return user
+
+
+def post_webhook(client, payload, secret=WEBHOOK_SECRET, body_sha256=None):
+    body = json.dumps(payload).encode('utf-8')
+    token = jwt.encode({
+        'request_body_sha256': body_sha256 or b64encode(hashlib.sha256(body).digest()).decode('ascii'),
+    }, secret, algorithm='HS256')
+    return client.post(
+        reverse('tahoe_idp:webhook'),
+        data=body,
+        content_type='application/json',
+        HTTP_X_FUSIONAUTH_SIGNATURE_JWT=token,
+    )
+
+
+def user_update_event(event_id='event-1', **user_fields):
+    return {
+        'id': event_id,
+        'type': 'user.update',
+        'user': dict({
+            'id': IDP_USER_ID,
+            'email': 'new@example.com',
+            'firstName': 'Some',
+            'lastName': 'One',
+            'lastUpdateInstant': 1634567890123,
+            'data': {'platform_role': 'staff'},
+        }, **user_fields),
+    }
+
+
+@pytest.mark.usefixtures('webhook_settings')
+def test_webhook_user_update(client, user):
+    response = post_webhook(client, {'event': user_update_event()})
+    assert response.status_code == 200
+    assert response.json() == {'processed': 1, 'duplicate': 0, 'ignored': 0}
+
+    user.refresh_from_db()
+    assert (user.email, user.first_name, user.last_name) == ('new@example.com', 'Some', 'One')
+    social_auth_entry = UserSocialAuth.objects.get(user=user)
+    assert social_auth_entry.extra_data['tahoe_idp_capabilities'] == 2
+    assert social_auth_entry.extra_data['tahoe_idp_data_version'] == 1634567890123
+    assert cache.get(get_idp_permission_flags_cache_key(user.id))['is_organization_staff']
+
+
+@pytest.mark.usefixtures('webhook_settings')
+def test_webhook_deduplicates_events(client, user):
+    assert post_webhook(client, {'event': user_update_event()}).json()['processed'] == 1
+    assert post_webhook(client, {'event': user_update_event()}).json() == {
+        'processed': 0,
+        'duplicate': 1,
+        'ignored': 0,
+    }
+
+
+@pytest.mark.usefixtures('webhook_settings')
+def test_webhook_batch(client, user):
+    other_user = User.objects.create(username='unknown')
+    response = post_webhook(client, {'events': [
+        {'id': 'event-1', 'type': 'user.deactivate', 'user': {'id': IDP_USER_ID}},
+        {'id': 'event-2', 'type': 'user.registration.update', 'user': {'id': IDP_USER_ID}},
+        {'id': 'event-3', 'type': 'user.deactivate', 'user': {'id': 'not-a-local-user'}},
+        {'id': 'event-4', 'type': 'user.login.success', 'user': {'id': IDP_USER_ID}},
+        {'id': 'event-5', 'type': 'tenant.create'},
+    ]})
+    assert response.json() == {'processed': 2, 'duplicate': 0, 'ignored': 3}
+
+    user.refresh_from_db()
+    other_user.refresh_from_db()
+    assert not user.is_active
+    assert other_user.is_active
+
+
+@pytest.mark.usefixtures('webhook_settings')
+@patch('tahoe_idp.receivers.user_sync_to_idp')
+def test_webhook_does_not_sync_back(mock_user_sync_to_idp, client, user):
+    post_save.connect(mock_user_sync_to_idp, sender=User)
+    try:
+        post_webhook(client, {'event': user_update_event()})
+    finally:
+        post_save.disconnect(mock_user_sync_to_idp, sender=User)
+    assert not mock_user_sync_to_idp.called
+
+
+@pytest.mark.usefixtures('webhook_settings')
+@pytest.mark.parametrize('kwargs', [
+    {'secret': 'a-wrong-secret-of-at-least-32-bytes'},
+    {'body_sha256': 'tampered'},
+])
+def test_webhook_invalid_signature(client, user, kwargs):
+    response = post_webhook(client, {'event': user_update_event()}, **kwargs)
+    assert response.status_code == 403
+    user.refresh_from_db()
+    assert user.email == 'old@example.com'
+
+
+@pytest.mark.usefixtures('webhook_settings')
+def test_webhook_missing_signature(client):
+    response = client.post(reverse('tahoe_idp:webhook'), data='{}', content_type='application/json')
+    assert response.status_code == 403
+
+
+@pytest.mark.usefixtures('webhook_settings')
+def test_webhook_invalid_payload(client):
+    assert post_webhook(client, ['not', 'an', 'object']).status_code == 400
+    assert post_webhook(client, {'events': ['not an object']}).status_code == 400
+
+
+def test_process_events_failure_allows_retry(user):
+    with patch('tahoe_idp.webhooks._update_user', side_effect=RuntimeError('Database is down')):
+        with pytest.raises(RuntimeError):
+            process_events([user_update_event()])
+
+    assert process_events([user_update_event()])['processed'] == 1, 'Should not be considered a duplicate'
+
+
+def test_process_events_user_create_readiness():
+    """
+    A `user.create` event of a user who didn't log in yet unblocks the login waiting for the username.
+    """
+    assert wait_for_idp_user_ready(IDP_USER_ID, timeout=0) is None
+
+    event = dict(user_update_event(), type='user.create')
+    assert process_events([event]) == {'processed': 1, 'duplicate': 0, 'ignored': 0}
+    assert wait_for_idp_user_ready(IDP_USER_ID, timeout=0) is None, 'Should wait for a username'
+
+    event = user_update_event(event_id='event-2', username='someone')
+    assert process_events([event])['processed'] == 1
+    assert wait_for_idp_user_ready(IDP_USER_ID, timeout=0)['username'] == 'someone'
+
+
+def test_process_events_idp_user_cache(user):
+    """
+    Events refresh the cached FusionAuth user records unless a newer version is cached.
+    """
+    cache_key = get_idp_user_cache_key(IDP_USER_ID)
+    cache_idp_user({'id': IDP_USER_ID, 'email': 'newest@example.com', 'lastUpdateInstant': 1734567890123})
+    process_events([user_update_event()])
+    assert cache.get(cache_key)['email'] == 'newest@example.com', 'Should keep the newer record'
+
+    process_events([user_update_event(event_id='event-2', lastUpdateInstant=1834567890123)])
+    assert cache.get(cache_key)['email'] == 'new@example.com'
+
+    process_events([{'id': 'event-3', 'type': 'user.deactivate', 'user': {'id': IDP_USER_ID}}])
+    assert cache.get(cache_key) is None
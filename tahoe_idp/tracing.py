@@ -0,0 +1,60 @@
+"""
+Optional tracing of the login pipeline and the FusionAuth calls.
+
+Spans are emitted through the tracer returned by the factory in `settings.TAHOE_IDP_TRACER_FACTORY`, a path in the
+form "module.submodule:function" which is called with the instrumentation name. The API is a subset of
+OpenTelemetry's, so "opentelemetry.trace:get_tracer" can be used as is. Tracing is a no-op by default.
+"""
+
+import contextlib
+
+from django.conf import settings
+
+from tahoe_idp.helpers import import_from_path
+from tahoe_idp.settings_cache import cached_until_setting_changed
+
+
+TRACER_NAME = 'tahoe_idp'
+
+
+class NoOpSpan:
+    """
+    Span that records nothing.
+    """
+
+    def set_attribute(self, key, value):
+        pass
+
+    def record_exception(self, exception):
+        pass
+
+
+class NoOpTracer:
+    """
+    Tracer used when TAHOE_IDP_TRACER_FACTORY isn't set.
+    """
+
+    @contextlib.contextmanager
+    def start_as_current_span(self, name, attributes=None):
+        yield NoOpSpan()
+
+
+@cached_until_setting_changed('TAHOE_IDP_TRACER_FACTORY')
+def get_tracer():
+    """
+    Get the configured tracer, or a `NoOpTracer`.
+    """
+    tracer_factory_path = getattr(settings, 'TAHOE_IDP_TRACER_FACTORY', None)
+    if not tracer_factory_path:
+        return NoOpTracer()
+    return import_from_path(tracer_factory_path)(TRACER_NAME)
+
+
+def start_span(name, attributes=None):
+    """
+    Start a span as the current span, to be used as a context manager.
+
+    Attributes with a None value are dropped because OpenTelemetry doesn't accept them.
+    """
+    attributes = {key: value for key, value in (attributes or {}).items() if value is not None}
+    return get_tracer().start_as_current_span(name, attributes=attributes)
@@ -1,8 +1,10 @@
 from django.urls import re_path
 
 from tahoe_idp.magiclink_views import LoginVerify, StudioLoginAPIView
+from tahoe_idp.webhook_views import FusionAuthWebhookView
 
 urlpatterns = [
     re_path('^verify_login/?$', LoginVerify.as_view(), name='verify_login'),
     re_path('^studio/?$', StudioLoginAPIView.as_view(), name='studio'),
+    re_path('^webhook/?$', FusionAuthWebhookView.as_view(), name='webhook'),
 ]
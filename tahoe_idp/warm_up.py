@@ -0,0 +1,62 @@
+"""
+Startup validation and warm-up, enabled by `settings.TAHOE_IDP_WARM_UP_ON_STARTUP`.
+
+Warming up in `TahoeIdpConfig.ready()` surfaces misconfiguration when the worker starts instead of on the first
+login, and moves the one-off costs (imports, URL resolver population, settings compilation) out of the first
+requests of freshly forked workers.
+"""
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.urls import NoReverseMatch, reverse
+
+
+REQUIRED_TAHOE_IDP_CONFIGS = ('BASE_URL', 'API_KEY')
+
+
+def validate_tahoe_idp_configs():
+    """
+    Validate `settings.TAHOE_IDP_CONFIGS` and raise `ImproperlyConfigured` if it's not correct.
+    """
+    tahoe_idp_configs = getattr(settings, 'TAHOE_IDP_CONFIGS', None)
+    if not tahoe_idp_configs:
+        if settings.FEATURES.get('ENABLE_TAHOE_IDP', False):
+            raise ImproperlyConfigured('`TAHOE_IDP_CONFIGS` settings must be defined when enabling Tahoe IdP')
+        return
+
+    if not isinstance(tahoe_idp_configs, dict):
+        raise ImproperlyConfigured('`TAHOE_IDP_CONFIGS` must be a dict')
+
+    for setting_name in REQUIRED_TAHOE_IDP_CONFIGS:
+        if not tahoe_idp_configs.get(setting_name):
+            raise ImproperlyConfigured('Tahoe IdP `{}` cannot be empty'.format(setting_name))
+
+    if not isinstance(tahoe_idp_configs.get('JWT_OPTIONS', {}), dict):
+        raise ImproperlyConfigured('Tahoe IdP `JWT_OPTIONS` must be a dict')
+
+
+def warm_up():
+    """
+    Validate the settings and pre-compute what the first login would otherwise pay for.
+    """
+    validate_tahoe_idp_configs()
+
+    # Import the modules used on login, which import the FusionAuth and site configuration clients
+    from tahoe_idp import api, backend, magiclink_backends  # NOQA: F401
+    from tahoe_idp.magiclink_helpers import get_studio_permission_method
+    from tahoe_idp.models import get_auth_user_fields
+    from tahoe_idp.permissions import get_role_registry
+    from tahoe_idp.redirect_whitelist import get_redirect_whitelist
+
+    try:
+        # Populates the URL resolver caches used by `MagicLink.generate_url`
+        reverse(settings.MAGICLINK_LOGIN_VERIFY_URL)
+    except NoReverseMatch:
+        raise ImproperlyConfigured('Cannot reverse `MAGICLINK_LOGIN_VERIFY_URL`: "{}"'.format(
+            settings.MAGICLINK_LOGIN_VERIFY_URL,
+        ))
+
+    get_studio_permission_method()
+    get_redirect_whitelist()
+    get_role_registry()
+    get_auth_user_fields()
@@ -0,0 +1,39 @@
+import json
+import logging
+
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.generic import View
+
+from tahoe_idp.webhooks import process_events, verify_signature
+
+log = logging.getLogger(__name__)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class FusionAuthWebhookView(View):
+    """
+    Receive FusionAuth webhook events signed with `TAHOE_IDP_CONFIGS['WEBHOOK_SECRET']`.
+
+    Accepts a single event `{"event": {...}}` or a batch `{"events": [{...}, ...]}`.
+    """
+
+    def post(self, request):
+        verify_signature(request)
+
+        try:
+            payload = json.loads(request.body.decode('utf-8'))
+        except ValueError:
+            return HttpResponseBadRequest('Invalid JSON body')
+
+        if not isinstance(payload, dict):
+            return HttpResponseBadRequest('Invalid webhook payload')
+
+        events = payload.get('events') or [payload.get('event')]
+        if not all(isinstance(event, dict) for event in events):
+            return HttpResponseBadRequest('Invalid webhook payload')
+
+        result = process_events(events)
+        log.info('Processed FusionAuth webhook events: %s', result)
+        return JsonResponse(result)
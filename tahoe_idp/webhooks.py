@@ -0,0 +1,195 @@
+"""
+Processing of FusionAuth webhook events, see `webhook_views.FusionAuthWebhookView`.
+
+Local users are updated with `QuerySet.update()` so the `post_save` receivers don't sync the changes back to the IdP.
+"""
+
+from base64 import b64encode
+import hashlib
+import hmac
+import logging
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+
+from . import helpers
+from .constants import BACKEND_NAME
+from .magiclink_backends import invalidate_user_cache
+from .magiclink_helpers import invalidate_studio_permission_cache
+from .permissions import get_capabilities, get_role_with_default
+
+
+log = logging.getLogger(__name__)
+
+User = get_user_model()
+
+SIGNATURE_HEADER = 'HTTP_X_FUSIONAUTH_SIGNATURE_JWT'
+
+EVENT_USER_CREATE = 'user.create'
+EVENT_USER_UPDATE = 'user.update'
+EVENT_USER_DEACTIVATE = 'user.deactivate'
+EVENT_USER_REACTIVATE = 'user.reactivate'
+EVENT_USER_REGISTRATION_PREFIX = 'user.registration.'
+
+
+def verify_signature(request):
+    """
+    Verify the HS256 signature JWT of a webhook request and the SHA-256 of its body.
+
+    Raises `PermissionDenied` if the signature is missing or invalid.
+    """
+    import jwt
+
+    secret = helpers.get_required_setting('WEBHOOK_SECRET')
+    token = request.META.get(SIGNATURE_HEADER)
+    if not token:
+        raise PermissionDenied('Missing webhook signature')
+
+    try:
+        claims = jwt.decode(token, secret, algorithms=['HS256'])
+    except jwt.InvalidTokenError as exc:
+        raise PermissionDenied('Invalid webhook signature: {}'.format(exc))
+
+    body_sha256 = b64encode(hashlib.sha256(request.body).digest())
+    if not hmac.compare_digest(str(claims.get('request_body_sha256', '')).encode('utf-8'), body_sha256):
+        raise PermissionDenied('Webhook body does not match the signature')
+
+
+def _get_event_cache_key(event_id):
+    return 'tahoe_idp.webhooks.event.{event_id}'.format(event_id=hashlib.sha256(event_id.encode('utf-8')).hexdigest())
+
+
+def _is_new_event(event):
+    """
+    Deduplicate events by id, FusionAuth retries the events that were not acknowledged.
+    """
+    event_id = event.get('id')
+    if not event_id:
+        return True
+    return cache.add(
+        _get_event_cache_key(event_id),
+        True,
+        timeout=getattr(settings, 'TAHOE_IDP_WEBHOOK_EVENT_ID_TIMEOUT', 24 * 60 * 60),
+    )
+
+
+def _get_local_user_ids(idp_user_ids):
+    """
+    Map IdP user ids to local user ids with a single query.
+    """
+    from social_django.models import UserSocialAuth
+
+    return dict(UserSocialAuth.objects.filter(
+        provider=BACKEND_NAME, uid__in=idp_user_ids,
+    ).values_list('uid', 'user_id'))
+
+
+def _update_user(user_id, idp_user):
+    from social_django.models import UserSocialAuth
+
+    user_fields = {}
+    if idp_user.get('email'):
+        user_fields['email'] = idp_user['email']
+    if 'firstName' in idp_user:
+        user_fields['first_name'] = idp_user['firstName'] or ''
+    if 'lastName' in idp_user:
+        user_fields['last_name'] = idp_user['lastName'] or ''
+    if user_fields:
+        User.objects.filter(pk=user_id).update(**user_fields)
+
+    capabilities = get_capabilities(get_role_with_default(idp_user.get('data') or {}))
+    social_auth_entry = UserSocialAuth.objects.filter(
+        provider=BACKEND_NAME, user_id=user_id, uid=idp_user['id'],
+    ).only('pk', 'extra_data').first()
+    if social_auth_entry:
+        extra_data = dict(social_auth_entry.extra_data or {})
+        extra_data['tahoe_idp_capabilities'] = capabilities
+        extra_data['tahoe_idp_data_version'] = idp_user.get('lastUpdateInstant')
+        UserSocialAuth.objects.filter(pk=social_auth_entry.pk).update(extra_data=extra_data)
+        helpers.cache_idp_permission_flags(user_id, extra_data)
+
+
+def process_events(events):
+    """
+    Apply a batch of FusionAuth events to the local users.
+
+    :param events: list of the `event` objects of the webhook payloads.
+    :return: dict with the number of `processed`, `duplicate` and `ignored` events.
+    """
+    result = {
+        'processed': 0,
+        'duplicate': 0,
+        'ignored': 0,
+    }
+
+    new_events = []
+    for event in events:
+        if not _is_new_event(event):
+            result['duplicate'] += 1
+        else:
+            new_events.append(event)
+
+    try:
+        _apply_events(new_events, result)
+    except Exception:
+        # Let FusionAuth retry the events
+        cache.delete_many([_get_event_cache_key(event['id']) for event in new_events if event.get('id')])
+        raise
+
+    return result
+
+
+def _apply_events(events, result):
+    """
+    Update the local users of the events in bulk where possible.
+    """
+    user_events = [event for event in events if (event.get('user') or {}).get('id')]
+    result['ignored'] += len(events) - len(user_events)
+    local_user_ids = _get_local_user_ids({event['user']['id'] for event in user_events})
+
+    deactivated_user_ids = set()
+    reactivated_user_ids = set()
+    changed_user_ids = set()
+    for event in user_events:
+        idp_user = event['user']
+        user_id = local_user_ids.get(idp_user['id'])
+        event_type = event.get('type', '')
+        is_user_change = event_type in (EVENT_USER_CREATE, EVENT_USER_UPDATE)
+        if is_user_change:
+            # Unblock the logins waiting for the username in `get_user_details`
+            helpers.set_idp_user_ready(idp_user)
+            helpers.cache_idp_user(idp_user)
+        else:
+            # Events other than `user.create`/`user.update` may carry partial user records
+            helpers.invalidate_cached_idp_user(idp_user['id'])
+
+        if user_id is None:
+            # The user didn't log in yet, only the readiness of the username is useful
+            result['processed' if is_user_change else 'ignored'] += 1
+            continue
+
+        if is_user_change or event_type.startswith(EVENT_USER_REGISTRATION_PREFIX):
+            _update_user(user_id, idp_user)
+        elif event_type == EVENT_USER_DEACTIVATE:
+            reactivated_user_ids.discard(user_id)
+            deactivated_user_ids.add(user_id)
+        elif event_type == EVENT_USER_REACTIVATE:
+            deactivated_user_ids.discard(user_id)
+            reactivated_user_ids.add(user_id)
+        else:
+            result['ignored'] += 1
+            continue
+
+        changed_user_ids.add(user_id)
+        result['processed'] += 1
+
+    if deactivated_user_ids:
+        User.objects.filter(pk__in=deactivated_user_ids).update(is_active=False)
+    if reactivated_user_ids:
+        User.objects.filter(pk__in=reactivated_user_ids).update(is_active=True)
+
+    for user_id in changed_user_ids:
+        invalidate_user_cache(user_id)
+        invalidate_studio_permission_cache(user_id)